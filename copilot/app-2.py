@@ -1,22 +1,63 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 # uvicorn app-2:app --host 127.0.0.1 --port 5000
+# COPILOT_BASE_URL=http://127.0.0.1:8950 uvicorn app-2:app --port 5000   (against fake_copilot.py)
 # --- Imports ---
-from fastapi import FastAPI
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 import asyncio
+import json
 import logging
 import sys
-from app import create_client  # Assuming 'app.py' contains create_client
-from microsoft.agents.activity import ActivityTypes
-from fastapi.staticfiles import StaticFiles
+from contextlib import asynccontextmanager
+from os import environ
+from gateway import CopilotGateway, CopilotStreamClient, base_url_connection
 from fastapi.middleware.cors import CORSMiddleware  # <-- IMPORT THIS
 
-# --- App Initialization ---
-app = FastAPI()
 logger = logging.getLogger(__name__)
+logger.addHandler(logging.StreamHandler(sys.stdout))
 logger.setLevel(logging.DEBUG)
 
+# When set, conversations go to this endpoint (e.g. fake_copilot.py) instead of
+# Copilot Studio, and no token is acquired.
+COPILOT_BASE_URL = environ.get("COPILOT_BASE_URL", "").rstrip("/")
+SESSION_PURGE_INTERVAL = float(environ.get("COPILOT_SESSION_PURGE_INTERVAL", "60"))
+
+
+def create_gateway():
+    """Return (gateway, token manager); the token manager is None for the fake endpoint."""
+    if COPILOT_BASE_URL:
+        logger.info(f"Using the Copilot endpoint at {COPILOT_BASE_URL}")
+        return CopilotGateway(CopilotStreamClient(base_url_connection(COPILOT_BASE_URL), token="fake")), None
+    from app import create_stream_client, create_token_manager
+
+    token_manager = create_token_manager()
+    return CopilotGateway(create_stream_client(token_manager)), token_manager
+
+
+# One pooled client and a conversation per client session, for the lifetime
+# of the process; idle sessions are dropped and the token is renewed in the
+# background.
+gateway = None
+token_manager = None
+
+@asynccontextmanager
+async def lifespan(app):
+    global gateway, token_manager
+    logger.info("Starting copilot client...")
+    gateway, token_manager = create_gateway()
+    purger = asyncio.ensure_future(gateway.purge_periodically(SESSION_PURGE_INTERVAL))
+    if token_manager is not None:
+        token_manager.start()
+    yield
+    purger.cancel()
+    if token_manager is not None:
+        await token_manager.stop()
+    await gateway.client.aclose()
+
+# --- App Initialization ---
+app = FastAPI(lifespan=lifespan)
+
 # --- CORS MIDDLEWARE CONFIGURATION ---
 # This block is added to handle requests from different origins (e.g., your Node.js frontend)
 origins = ["*"]  # Allows all origins
@@ -30,48 +71,58 @@ app.add_middleware(
 )
 # --- END OF CORS CONFIGURATION ---
 
-# Store conversation IDs for sessions
-conversations = {}
-
-@app.on_event("startup")
-async def startup_event():
-    global copilot_client
-    logger.info("Starting copilot client...")
-    copilot_client = create_client()
-
 @app.post("/start")
-async def start_conversation():
-    act = copilot_client.start_conversation(True)
-    actions = []
-    # Initialize conversation_id with a default value
-    conversation_id = None
-    async for action in act:
-        if action.text:
-            actions.append(action.text)
-            # Ensure conversation object and id exist before assigning
-            if action.conversation and action.conversation.id:
-                conversation_id = action.conversation.id
-                conversations["default"] = conversation_id
-    if conversation_id is None:
-        # Handle case where no message with a conversation ID was received
-        # This part might need adjustment based on how start_conversation behaves
-        # For now, we'll raise an error or return a specific message.
+async def start_conversation(session_id: str = ""):
+    try:
+        session_id, conversation, actions = await gateway.start(session_id or None)
+    except Exception as e:
+        logger.error(f"Error during start_conversation: {e}")
         return {"error": "Could not initialize conversation ID."}
-        
-    return {"conversation_id": conversation_id, "suggested_actions": actions}
+    return {"session_id": session_id, "conversation_id": conversation.conversation_id, "suggested_actions": actions}
 
+# Collects every reply before answering. conversation_id is the session id
+# of clients that called /start without one.
 @app.post("/ask")
-async def ask_question(query: str, conversation_id: str):
+async def ask_question(query: str, session_id: str = "", conversation_id: str = ""):
+    session_id = session_id or conversation_id
+    if not session_id:
+        raise HTTPException(status_code=400, detail="session_id is required")
     replies_list = []
     try:
-        replies = copilot_client.ask_question(query, conversation_id)
-        async for reply in replies:
-            if reply.type == ActivityTypes.message:
-                replies_list.append({"type": "message", "text": reply.text})
-            elif reply.type == ActivityTypes.end_of_conversation:
-                replies_list.append({"type": "end", "text": "Conversation ended."})
+        async for kind, data in gateway.ask(session_id, query):
+            replies_list.append({"type": kind, "text": data["text"]})
     except Exception as e:
         logger.error(f"Error during ask_question: {e}")
         return {"error": "An error occurred while communicating with the copilot."}
-        
-    return {"replies": replies_list}
\ No newline at end of file
+
+    return {"replies": replies_list}
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Server-sent events: a "message" event per Copilot reply as it arrives, "end"
+# if Copilot ended the conversation, then "done".
+@app.get("/ask/stream")
+async def ask_question_stream(query: str, session_id: str):
+    async def events():
+        try:
+            async for kind, data in gateway.ask(session_id, query):
+                yield sse_event(kind, data)
+        except Exception as e:
+            logger.error(f"Error during ask_question stream: {e}")
+            yield sse_event("error", {"detail": "An error occurred while communicating with the copilot."})
+        yield sse_event("done", {})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.delete("/sessions/{session_id}")
+async def end_session(session_id: str):
+    return {"deleted": gateway.store.delete(session_id)}
+
+@app.get("/stats")
+async def stats():
+    return {**gateway.stats(), **(token_manager.stats() if token_manager is not None else {})}
@@ -10,7 +10,11 @@ ms_agents_logger.setLevel(logging.INFO)
 
 import sys
 from os import environ
+import argparse
 import asyncio
+import json
+import threading
+import time
 import webbrowser
 
 from dotenv import load_dotenv
@@ -21,9 +25,12 @@ from microsoft.agents.activity import ActivityTypes, load_configuration_from_env
 from microsoft.agents.copilotstudio.client import (
     ConnectionSettings,
     CopilotClient,
+    PowerPlatformEnvironment,
 )
 
+from gateway import CopilotStreamClient, base_url_connection, conversation_id_of
 from local_token_cache import LocalTokenCache
+from token_manager import TokenManager
 
 # Load environment variables from .env file
 load_dotenv()
@@ -42,66 +49,31 @@ async def open_browser(url: str):
     await asyncio.get_event_loop().run_in_executor(None, lambda: webbrowser.open(url))
 
 
-def acquire_token(settings: ConnectionSettings, app_client_id, tenant_id):
-    logger.info("Attempting to acquire authentication token.")
+SCOPES = ["https://api.powerplatform.com/.default"]
+
+
+def create_token_manager(app_client_id=None, tenant_id=None):
+    """A TokenManager for the agent app registration; start() it to keep the token fresh."""
+    app_client_id = app_client_id or environ.get("COPILOTSTUDIOAGENT__AGENTAPPID")
+    tenant_id = tenant_id or environ.get("COPILOTSTUDIOAGENT__TENANTID")
     pca = PublicClientApplication(
         client_id=app_client_id,
         authority=f"https://login.microsoftonline.com/{tenant_id}",
         token_cache=TOKEN_CACHE,
     )
+    return TokenManager(pca, SCOPES, TOKEN_CACHE)
 
-    token_request = {
-        "scopes": ["https://api.powerplatform.com/.default"],
-    }
-    accounts = pca.get_accounts()
-    retry_interactive = False
-    token = None
-
-    logger.debug(f"Found {len(accounts)} cached accounts.")
-
-    try:
-        if accounts:
-            logger.info("Attempting to acquire token silently using a cached account.")
-            response = pca.acquire_token_silent(
-                token_request["scopes"], account=accounts[0]
-            )
-            token = response.get("access_token")
-            if token:
-                logger.info("Successfully acquired token silently.")
-            else:
-                logger.warning("Silent token acquisition failed. No token in response.")
-                retry_interactive = True
-        else:
-            logger.info("No cached accounts found. Proceeding to interactive login.")
-            retry_interactive = True
-    except Exception as e:
-        retry_interactive = True
-        logger.error(
-            f"Error acquiring token silently: {e}. Going to attempt interactive login."
-        )
-
-    if retry_interactive:
-        logger.info("Attempting interactive login...")
-        try:
-            response = pca.acquire_token_interactive(**token_request)
-            token = response.get("access_token")
-            if token:
-                logger.info("Successfully acquired token interactively.")
-            else:
-                logger.error("Interactive login did not return a token.")
-        except Exception as e:
-            logger.error(f"An exception occurred during interactive login: {e}")
-            return None
 
+def acquire_token(settings: ConnectionSettings, app_client_id, tenant_id):
+    logger.info("Attempting to acquire authentication token.")
+    # Silent (cached account) first, then interactive login.
+    token = create_token_manager(app_client_id, tenant_id).acquire(interactive=True)
     if not token:
         logger.error("Failed to acquire token after all attempts.")
-
-    logger.debug(f"Access Token: {token}")
     return token
 
 
-def create_client():
-    logger.info("Creating CopilotClient...")
+def load_settings():
     settings = ConnectionSettings(
         environment_id=environ.get("COPILOTSTUDIOAGENT__ENVIRONMENTID"),
         agent_identifier=environ.get("COPILOTSTUDIOAGENT__SCHEMANAME"),
@@ -111,35 +83,114 @@ def create_client():
     )
     logger.debug(f"Using Environment ID: {settings.environment_id}")
     logger.debug(f"Using Agent Schema Name: {settings.agent_identifier}")
+    return settings
 
-    token = acquire_token(
-        settings,
-        app_client_id=environ.get("COPILOTSTUDIOAGENT__AGENTAPPID"),
-        tenant_id=environ.get("COPILOTSTUDIOAGENT__TENANTID"),
-    )
+
+class RenewingCopilotClient:
+    """CopilotClient that is rebuilt with every renewed token.
+
+    The SDK takes the token only when the client is created, so renew()
+    swaps in a new client; calls already started keep the one they started on.
+    Conversations are addressed by id and so carry over to the new client.
+    """
+
+    def __init__(self, settings, token):
+        self.settings = settings
+        self.client = CopilotClient(settings, token)
+
+    def renew(self, token):
+        self.client = CopilotClient(self.settings, token)
+
+    def start_conversation(self, emit_start_conversation_event=True):
+        return self.client.start_conversation(emit_start_conversation_event)
+
+    def ask_question(self, question, conversation_id=None):
+        return self.client.ask_question(question, conversation_id)
+
+
+def create_client(token_manager=None):
+    """A CopilotClient for the interactive loop; it always talks to Copilot Studio
+    (COPILOT_BASE_URL only applies to the stream client). Without `token_manager`
+    one is created and started here."""
+    logger.info("Creating CopilotClient...")
+    settings = load_settings()
+    own_manager = token_manager is None
+    token_manager = token_manager or create_token_manager()
+    token = token_manager.acquire(interactive=True)
 
     if not token:
         logger.critical("Could not create client because token acquisition failed. Exiting.")
         sys.exit(1)
+    if own_manager:
+        token_manager.start()
 
-    copilot_client = CopilotClient(settings, token)
+    copilot_client = RenewingCopilotClient(settings, token)
+    token_manager.add_listener(copilot_client.renew)
     logger.info("CopilotClient created successfully.")
     return copilot_client
 
 
-async def ainput(string: str) -> str:
-    await asyncio.get_event_loop().run_in_executor(
-        None, lambda s=string: sys.stdout.write(s + " ")
-    )
-    return await asyncio.get_event_loop().run_in_executor(None, sys.stdin.readline)
+def create_stream_client(token_manager=None):
+    """A pooled CopilotStreamClient (gateway.py) for many concurrent conversations.
+
+    COPILOT_BASE_URL points it at another endpoint, e.g. fake_copilot.py.
+    """
+    base_url = environ.get("COPILOT_BASE_URL")
+    if base_url:
+        logger.info(f"Using the Copilot endpoint at {base_url}")
+        return CopilotStreamClient(base_url_connection(base_url), token="fake")
+    settings = load_settings()
+    token_manager = token_manager or create_token_manager()
+    token = token_manager.acquire(interactive=True)
+    if not token:
+        logger.critical("Could not create client because token acquisition failed. Exiting.")
+        sys.exit(1)
+
+    def connection_url(conversation_id):
+        return PowerPlatformEnvironment.get_copilot_studio_connection_url(
+            settings=settings, conversation_id=conversation_id
+        )
+
+    client = CopilotStreamClient(connection_url, token)
+    # Each request reads client.token when it is sent, so a swap never affects streams in flight.
+    token_manager.add_listener(lambda new_token: setattr(client, "token", new_token))
+    return client
+
+
+# --- Interactive mode ---
+def start_stdin_reader():
+    """Read stdin on one thread for the whole session; lines (None at EOF) arrive on the returned queue."""
+    loop = asyncio.get_running_loop()
+    lines = asyncio.Queue()
+
+    def read():
+        try:
+            for line in sys.stdin:
+                loop.call_soon_threadsafe(lines.put_nowait, line)
+            loop.call_soon_threadsafe(lines.put_nowait, None)
+        except RuntimeError:  # event loop already closed
+            pass
+
+    threading.Thread(target=read, name="stdin-reader", daemon=True).start()
+    return lines
+
+
+async def ainput(lines, string: str):
+    sys.stdout.write(string + " ")
+    sys.stdout.flush()
+    return await lines.get()
 
 
 async def ask_question(copilot_client, conversation_id):
-    query = (await ainput("\n>>>: ")).lower().strip()
-    if query in ["exit", "quit"]:
-        print("Exiting...")
-        return
-    if query:
+    lines = start_stdin_reader()
+    while True:
+        line = await ainput(lines, "\n>>>: ")
+        query = (line or "exit").lower().strip()
+        if query in ["exit", "quit"]:
+            print("Exiting...")
+            return
+        if not query:
+            continue
         logger.info(f"Sending query to copilot: '{query}'")
         replies = copilot_client.ask_question(query, conversation_id)
         async for reply in replies:
@@ -154,14 +205,111 @@ async def ask_question(copilot_client, conversation_id):
             elif reply.type == ActivityTypes.end_of_conversation:
                 logger.info("Received end_of_conversation activity.")
                 print("\nEnd of conversation.")
-                sys.exit(0)
-        # Continue the conversation loop
-        await ask_question(copilot_client, conversation_id)
+                return
+
+
+# --- Replay mode ---
+async def replay_turn(client, conversation_id, question):
+    """Ask one question; return (replies, seconds to the first reply, seconds in total, ended, error)."""
+    started = time.perf_counter()
+    replies = []
+    first = None
+    ended = False
+    try:
+        async for activity in client.ask_question(question, conversation_id):
+            if activity.get("type") == "message" and activity.get("text"):
+                first = first if first is not None else time.perf_counter() - started
+                replies.append(activity["text"])
+            elif activity.get("type") == "endOfConversation":
+                ended = True
+    except Exception as e:
+        return replies, first, time.perf_counter() - started, ended, str(e)
+    return replies, first, time.perf_counter() - started, ended, None
+
+
+async def replay(questions, concurrency, repeat, out, token_manager=None):
+    """Replay `questions` (`repeat` times) in `concurrency` parallel conversations, one JSON line per turn."""
+    client = create_stream_client(token_manager)
+    latencies = []
+    errors = 0
+
+    async def conversation(worker):
+        nonlocal errors
+        conversation_id = None
+        async for activity in client.start_conversation(True):
+            conversation_id = conversation_id or conversation_id_of(activity)
+        for turn in range(len(questions) * repeat):
+            question = questions[turn % len(questions)]
+            replies, first, total, ended, error = await replay_turn(client, conversation_id, question)
+            record = {
+                "conversation": worker,
+                "conversation_id": conversation_id,
+                "turn": turn + 1,
+                "question": question,
+                "replies": replies,
+                "first_reply_ms": round(first * 1000, 1) if first is not None else None,
+                "latency_ms": round(total * 1000, 1),
+            }
+            if error:
+                record["error"] = error
+                errors += 1
+            else:
+                latencies.append(total)
+            if ended:
+                record["ended"] = True
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            if ended:
+                logger.info(f"Conversation {conversation_id} ended by the copilot after {turn + 1} turns")
+                return
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(conversation(worker) for worker in range(concurrency)))
+    finally:
+        await client.aclose()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    if latencies:
+        logger.info(
+            f"Replayed {len(latencies) + errors} turns in {elapsed:.1f} s ({len(latencies) / elapsed:.2f} turns/s), "
+            f"{errors} errors, p50 {latencies[len(latencies) // 2] * 1000:.0f} ms, "
+            f"p95 {latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000:.0f} ms"
+        )
+    else:
+        logger.error(f"Replay finished with {errors} errors and no successful turns")
 
 
 async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--replay", metavar="QUESTIONS", help="ask every line of this file instead of reading stdin")
+    parser.add_argument("--concurrency", type=int, default=1, help="parallel conversations in replay mode")
+    parser.add_argument("--repeat", type=int, default=1, help="times each conversation replays the file")
+    parser.add_argument("--out", help="JSON lines output of replay mode (default: stdout)")
+    args = parser.parse_args()
+    if args.replay and not args.out:
+        # stdout carries the JSON lines; keep the log out of it.
+        logger.handlers[0].setStream(sys.stderr)
+
     logger.info("Starting application.")
-    copilot_client = create_client()
+    token_manager = None if environ.get("COPILOT_BASE_URL") else create_token_manager()
+
+    if args.replay:
+        with open(args.replay, "r", encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+        if token_manager is not None:
+            token_manager.start()
+        out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+        try:
+            await replay(questions, args.concurrency, args.repeat, out, token_manager)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        return
+
+    copilot_client = create_client(token_manager)
+    if token_manager is not None:
+        token_manager.start()
     
     logger.info("Starting a new conversation with the copilot...")
     act = copilot_client.start_conversation(True)
@@ -177,4 +325,4 @@ async def main():
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,111 @@
+# python bench_gateway.py --launch --concurrency 1 16 64 --questions 3
+# python bench_gateway.py --url http://127.0.0.1:5000 --concurrency 32
+# Concurrency benchmark for app-2.py: N simulated users each start a session
+# and ask --questions questions over /ask/stream. Reports time to the first
+# Copilot message and to the end of the answer (p50/p95), answers per second
+# and errors for every concurrency level. --launch starts fake_copilot.py and
+# the gateway with uvicorn, so no Copilot Studio tenant is needed.
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+import numpy as np
+
+QUESTIONS = [
+    "How many days of annual leave do I get?",
+    "What is the per diem for business travel?",
+    "Which public holidays are observed this year?",
+    "Is sick leave paid?",
+]
+
+
+async def ask(client, url, session_id, question):
+    """Return (seconds to first message, seconds to the end, error)."""
+    started = time.perf_counter()
+    first = None
+    error = None
+    async with client.stream("GET", f"{url}/ask/stream", params={"query": question, "session_id": session_id}) as response:
+        if response.status_code != 200:
+            return None, time.perf_counter() - started, f"HTTP {response.status_code}"
+        async for line in response.aiter_lines():
+            if line.startswith("event: message") and first is None:
+                first = time.perf_counter() - started
+            elif line.startswith("event: error"):
+                error = "error event"
+    return first, time.perf_counter() - started, error
+
+
+async def user(client, url, questions, results):
+    response = await client.post(f"{url}/start")
+    session_id = response.json().get("session_id")
+    if not session_id:
+        results.append((None, None, "start failed"))
+        return
+    for i in range(questions):
+        results.append(await ask(client, url, session_id, QUESTIONS[i % len(QUESTIONS)]))
+    await client.delete(f"{url}/sessions/{session_id}")
+
+
+async def run(url, concurrency, questions, timeout):
+    results = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(user(client, url, questions, results) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    firsts = [first for first, _, error in results if first is not None and error is None]
+    totals = [total for _, total, error in results if total is not None and error is None]
+    errors = sum(1 for _, _, error in results if error is not None)
+    print(f"concurrency {concurrency:4d}: {len(totals)} answers in {elapsed:6.2f} s, {len(totals) / elapsed:7.2f} answers/s, "
+          f"errors {errors}")
+    if firsts:
+        print(f"  first message p50={np.percentile(firsts, 50) * 1000:8.1f} ms  p95={np.percentile(firsts, 95) * 1000:8.1f} ms")
+        print(f"  full answer   p50={np.percentile(totals, 50) * 1000:8.1f} ms  p95={np.percentile(totals, 95) * 1000:8.1f} ms")
+
+
+def launch(args):
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, COPILOT_BASE_URL=f"http://127.0.0.1:{args.fake_port}")
+    fake = subprocess.Popen(
+        [sys.executable, "fake_copilot.py", "--port", str(args.fake_port), "--latency-ms", str(args.fake_latency_ms)],
+        cwd=here,
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app-2:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=here, env=env,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{args.port}/stats").status_code == 200:
+                break
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    return [fake, server]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--launch", action="store_true", help="start fake_copilot.py and the gateway")
+    parser.add_argument("--port", type=int, default=5098)
+    parser.add_argument("--fake-port", type=int, default=8950)
+    parser.add_argument("--fake-latency-ms", type=float, default=500)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--questions", type=int, default=3, help="questions per session")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    processes = launch(args) if args.launch else []
+    url = f"http://127.0.0.1:{args.port}" if args.launch else args.url.rstrip("/")
+    try:
+        for concurrency in args.concurrency:
+            asyncio.run(run(url, concurrency, args.questions, args.timeout))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
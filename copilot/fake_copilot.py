@@ -0,0 +1,85 @@
+# uvicorn fake_copilot:app --port 8950   (or: python fake_copilot.py --port 8950 --latency-ms 500)
+# A local stand-in for the Copilot Studio Direct-to-Engine endpoint, for
+# testing and benchmarking app-2.py without a tenant. Start the gateway with
+# COPILOT_BASE_URL=http://127.0.0.1:8950 to use it. Every POST starts a
+# conversation (greeting + suggested actions) or, when the body carries an
+# activity, streams a typing activity and FAKE_COPILOT_MESSAGES replies spaced
+# FAKE_COPILOT_LATENCY_MS apart.
+import asyncio
+import json
+import random
+import uuid
+from datetime import datetime, timezone
+from os import environ
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+FAKE_COPILOT_LATENCY_MS = float(environ.get("FAKE_COPILOT_LATENCY_MS", "500"))
+FAKE_COPILOT_JITTER_MS = float(environ.get("FAKE_COPILOT_JITTER_MS", "100"))
+FAKE_COPILOT_MESSAGES = int(environ.get("FAKE_COPILOT_MESSAGES", "2"))
+
+app = FastAPI()
+turns = {}  # conversation id -> questions asked
+
+
+def activity(kind, conversation_id, text=None, suggested_actions=None):
+    data = {
+        "type": kind,
+        "id": str(uuid.uuid4()),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "from": {"id": "fake-copilot", "role": "bot"},
+        "conversation": {"id": conversation_id},
+    }
+    if text is not None:
+        data["text"] = text
+    if suggested_actions:
+        data["suggestedActions"] = {"actions": [{"type": "imBack", "title": title, "value": title}
+                                                for title in suggested_actions]}
+    return f"event: activity\ndata: {json.dumps(data)}\n\n"
+
+
+async def delay():
+    await asyncio.sleep(max(0.0, FAKE_COPILOT_LATENCY_MS + random.uniform(-FAKE_COPILOT_JITTER_MS, FAKE_COPILOT_JITTER_MS)) / 1000)
+
+
+@app.post("/{path:path}")
+async def conversations(path: str, request: Request):
+    body = await request.json()
+    question = body.get("activity")
+
+    async def events():
+        if question is None:
+            conversation_id = str(uuid.uuid4())
+            turns[conversation_id] = 0
+            await delay()
+            yield activity("message", conversation_id, "Hello, I am the EXEO HR assistant. How can I help?",
+                           ["Annual leave", "Travel allowance"])
+            return
+        conversation_id = question["conversation"]["id"]
+        turns[conversation_id] = turns.get(conversation_id, 0) + 1
+        yield activity("typing", conversation_id)
+        for i in range(FAKE_COPILOT_MESSAGES):
+            await delay()
+            yield activity("message", conversation_id,
+                           f"Reply {i + 1} to '{question.get('text', '')}' (turn {turns[conversation_id]})")
+        if question.get("text", "").strip().lower() == "bye":
+            yield activity("endOfConversation", conversation_id)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import uvicorn
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8950)
+    parser.add_argument("--latency-ms", type=float, default=FAKE_COPILOT_LATENCY_MS)
+    parser.add_argument("--messages", type=int, default=FAKE_COPILOT_MESSAGES)
+    args = parser.parse_args()
+    FAKE_COPILOT_LATENCY_MS = args.latency_ms
+    FAKE_COPILOT_MESSAGES = args.messages
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
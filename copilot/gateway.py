@@ -0,0 +1,218 @@
+# Conversation handling for the app-2.py gateway: one Copilot Studio
+# conversation per client session, and a streaming client that talks to the
+# Copilot Studio (Direct-to-Engine) endpoint over one pooled HTTP client.
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from os import environ
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+COPILOT_MAX_CONNECTIONS = int(environ.get("COPILOT_MAX_CONNECTIONS", "64"))
+COPILOT_MAX_KEEPALIVE = int(environ.get("COPILOT_MAX_KEEPALIVE", "32"))
+# Seconds a request may wait for a free pooled connection before failing.
+COPILOT_POOL_TIMEOUT = float(environ.get("COPILOT_POOL_TIMEOUT", "10"))
+COPILOT_READ_TIMEOUT = float(environ.get("COPILOT_READ_TIMEOUT", "120"))
+SESSION_MAX = int(environ.get("COPILOT_SESSION_MAX", "10000"))
+SESSION_IDLE_TIMEOUT = float(environ.get("COPILOT_SESSION_IDLE_TIMEOUT", "1800"))
+
+
+# --- Streaming client ---
+class CopilotStreamClient:
+    """Starts conversations and asks questions, yielding activities (dicts) as the server sends them.
+
+    Unlike CopilotClient, which keeps the "current" conversation on the
+    client, the conversation id is passed explicitly, and every request shares
+    one bounded httpx connection pool, so many sessions can stream at the same
+    time. `connection_url(conversation_id)`
+    builds the endpoint URL; `token` may be replaced while the client is in use.
+    """
+
+    def __init__(self, connection_url, token, max_connections=COPILOT_MAX_CONNECTIONS,
+                 max_keepalive=COPILOT_MAX_KEEPALIVE, pool_timeout=COPILOT_POOL_TIMEOUT,
+                 read_timeout=COPILOT_READ_TIMEOUT):
+        self.connection_url = connection_url
+        self.token = token
+        self.http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive),
+            timeout=httpx.Timeout(10.0, read=read_timeout, pool=pool_timeout),
+        )
+        self.active_streams = 0
+
+    async def _post(self, url, data):
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "text/event-stream",
+            "Authorization": f"Bearer {self.token}",
+        }
+        self.active_streams += 1
+        try:
+            async with self.http.stream("POST", url, json=data, headers=headers) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise httpx.HTTPStatusError(
+                        f"Copilot Studio returned {response.status_code}: {response.text[:200]}",
+                        request=response.request, response=response,
+                    )
+                event_type = None
+                async for line in response.aiter_lines():
+                    if line.startswith("event:"):
+                        event_type = line[6:].strip()
+                    elif line.startswith("data:") and event_type == "activity":
+                        yield json.loads(line[5:])
+        finally:
+            self.active_streams -= 1
+
+    def start_conversation(self, emit_start_conversation_event=True):
+        return self._post(self.connection_url(None), {"emitStartConversationEvent": emit_start_conversation_event})
+
+    def ask_question(self, question, conversation_id):
+        activity = {"type": "message", "text": question, "conversation": {"id": conversation_id}}
+        return self._post(self.connection_url(conversation_id), {"activity": activity})
+
+    async def aclose(self):
+        await self.http.aclose()
+
+
+def base_url_connection(base_url):
+    """connection_url for an endpoint at `base_url` (fake_copilot.py) instead of Copilot Studio."""
+    base_url = base_url.rstrip("/")
+    return lambda conversation_id: f"{base_url}/conversations" + (f"/{conversation_id}" if conversation_id else "")
+
+
+def conversation_id_of(activity):
+    return (activity.get("conversation") or {}).get("id")
+
+
+def suggested_actions_of(activity):
+    actions = (activity.get("suggestedActions") or {}).get("actions") or []
+    return [action.get("title") for action in actions if action.get("title")]
+
+
+# --- Sessions ---
+class Conversation:
+    def __init__(self, session_id, conversation_id):
+        self.session_id = session_id
+        self.conversation_id = conversation_id
+        self.last_seen = time.monotonic()
+        # A Copilot conversation answers one question at a time.
+        self.lock = asyncio.Lock()
+
+
+class ConversationStore:
+    """Maps client sessions to Copilot conversations.
+
+    Sessions idle for longer than `idle_timeout` seconds are dropped, and the
+    least recently used one is evicted when `max_sessions` is reached.
+    """
+
+    def __init__(self, max_sessions=SESSION_MAX, idle_timeout=SESSION_IDLE_TIMEOUT):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._conversations = OrderedDict()
+        self.evicted = 0
+        self.expired = 0
+
+    def get(self, session_id):
+        conversation = self._conversations.get(session_id)
+        if conversation is None:
+            return None
+        if time.monotonic() - conversation.last_seen > self.idle_timeout:
+            del self._conversations[session_id]
+            self.expired += 1
+            return None
+        conversation.last_seen = time.monotonic()
+        self._conversations.move_to_end(session_id)
+        return conversation
+
+    def put(self, session_id, conversation_id):
+        conversation = Conversation(session_id, conversation_id)
+        self._conversations[session_id] = conversation
+        self._conversations.move_to_end(session_id)
+        while len(self._conversations) > self.max_sessions:
+            self._conversations.popitem(last=False)
+            self.evicted += 1
+        return conversation
+
+    def delete(self, session_id):
+        return self._conversations.pop(session_id, None) is not None
+
+    def purge_idle(self):
+        cutoff = time.monotonic() - self.idle_timeout
+        idle = [session_id for session_id, conversation in self._conversations.items()
+                if conversation.last_seen < cutoff and not conversation.lock.locked()]
+        for session_id in idle:
+            del self._conversations[session_id]
+        self.expired += len(idle)
+        return len(idle)
+
+    def stats(self):
+        return {"sessions": len(self._conversations), "evicted": self.evicted, "expired": self.expired}
+
+
+# --- Gateway ---
+class CopilotGateway:
+    """Per-session conversations on top of a CopilotStreamClient."""
+
+    def __init__(self, client, store=None):
+        self.client = client
+        self.store = store or ConversationStore()
+        self._starting = {}  # session id -> task starting its conversation
+
+    async def start(self, session_id=None):
+        """Start a conversation for `session_id`; returns (session_id, conversation, greeting texts).
+
+        Without a session id the conversation id is used as one, so clients of
+        the old API can keep passing the conversation id.
+        """
+        conversation_id = None
+        greeting = []
+        async for activity in self.client.start_conversation(True):
+            conversation_id = conversation_id or conversation_id_of(activity)
+            if activity.get("type") == "message" and activity.get("text"):
+                greeting.append(activity["text"])
+        if conversation_id is None:
+            raise RuntimeError("Copilot Studio did not return a conversation id")
+        session_id = session_id or conversation_id
+        logger.info(f"Started conversation {conversation_id} for session {session_id}")
+        return session_id, self.store.put(session_id, conversation_id), greeting
+
+    async def conversation(self, session_id):
+        conversation = self.store.get(session_id)
+        if conversation is not None:
+            return conversation
+        # Concurrent first questions of a session share one new conversation.
+        task = self._starting.get(session_id)
+        if task is None:
+            task = self._starting[session_id] = asyncio.ensure_future(self.start(session_id))
+            task.add_done_callback(lambda _: self._starting.pop(session_id, None))
+        _, conversation, _ = await asyncio.shield(task)
+        return conversation
+
+    async def ask(self, session_id, question):
+        """Yield ("message", {"text", "suggested_actions"}) and ("end", {}) events as Copilot replies."""
+        conversation = await self.conversation(session_id)
+        async with conversation.lock:
+            async for activity in self.client.ask_question(question, conversation.conversation_id):
+                kind = activity.get("type")
+                if kind == "message" and activity.get("text"):
+                    yield "message", {"text": activity["text"], "suggested_actions": suggested_actions_of(activity)}
+                elif kind == "endOfConversation":
+                    self.store.delete(session_id)
+                    yield "end", {"text": "Conversation ended."}
+            conversation.last_seen = time.monotonic()
+
+    async def purge_periodically(self, interval=60.0):
+        while True:
+            await asyncio.sleep(interval)
+            purged = self.store.purge_idle()
+            if purged:
+                logger.info(f"Dropped {purged} idle sessions")
+
+    def stats(self):
+        return {**self.store.stats(), "active_streams": self.client.active_streams}
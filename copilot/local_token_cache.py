@@ -1,39 +1,143 @@
+import atexit
 import os.path
 import json
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
 
 from msal import TokenCache
 
+try:
+    import fcntl
+except ImportError:  # Windows: a single worker, no file locking
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
 
 class LocalTokenCache(TokenCache):
+    """msal token cache persisted to a JSON file shared by every worker.
+
+    Changes are written by a background thread, coalesced over `write_delay`
+    seconds, to a temporary file that then replaces the cache file, so readers
+    never see a partial file. `locked()` holds an exclusive lock on
+    <file>.lock across processes; `reload()` picks up what other workers wrote.
+    """
 
-    def __init__(self, cache_location: str):
+    def __init__(self, cache_location: str, write_delay: float = 0.5):
         super().__init__()
         self.__cache_location = cache_location
         self.__has_state_changed = False
+        self.__write_delay = write_delay
+        self.__write_timer = None
+        self.__write_lock = threading.Lock()
+        self.__file_lock = threading.RLock()
+        self.__lock_file = None
+        self.__lock_depth = 0
+        self.__loaded_stamp = None
+
+        with self.locked():
+            if not os.path.exists(self.__cache_location):
+                self._write("{}")
+            else:
+                self.reload()
+        atexit.register(self._flush_in_background)
+
+    # --- Cross-process locking ---
+    @contextmanager
+    def locked(self):
+        """Hold the cache file lock (re-entrant within a thread)."""
+        with self.__file_lock:
+            if self.__lock_depth == 0 and fcntl is not None:
+                self.__lock_file = open(self.__cache_location + ".lock", "a")
+                fcntl.flock(self.__lock_file, fcntl.LOCK_EX)
+            self.__lock_depth += 1
+            try:
+                yield
+            finally:
+                self.__lock_depth -= 1
+                if self.__lock_depth == 0 and self.__lock_file is not None:
+                    fcntl.flock(self.__lock_file, fcntl.LOCK_UN)
+                    self.__lock_file.close()
+                    self.__lock_file = None
+
+    def _stamp(self):
+        try:
+            status = os.stat(self.__cache_location)
+        except FileNotFoundError:
+            return None
+        return status.st_mtime_ns, status.st_size
 
-        if not os.path.exists(self.__cache_location):
+    def reload(self):
+        """Load the file if another process changed it since we last read or wrote it."""
+        with self.locked():
+            stamp = self._stamp()
+            if stamp is None or stamp == self.__loaded_stamp or self.__has_state_changed:
+                return False
+            with open(self.__cache_location, "r") as f:
+                data = json.load(f)
             with self._lock:
-                if not os.path.exists(self.__cache_location):
-                    with open(self.__cache_location, "w") as f:
-                        json.dump({}, f)
-        else:
+                self._cache = data
+            self.__loaded_stamp = stamp
+            return True
+
+    # --- Writing ---
+    def _write(self, text):
+        directory = os.path.dirname(os.path.abspath(self.__cache_location))
+        fd, temp_path = tempfile.mkstemp(prefix=".token_cache.", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(temp_path, 0o600)
+            os.replace(temp_path, self.__cache_location)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self.__loaded_stamp = self._stamp()
+
+    def flush(self):
+        """Write pending changes now (on the calling thread)."""
+        with self.__write_lock:
+            self.__write_timer = None
+        with self.locked():
+            if not self.__has_state_changed:
+                return
             with self._lock:
-                with open(self.__cache_location, "r") as f:
-                    self._cache = json.load(f)
+                text = json.dumps(self._cache)
+                self.__has_state_changed = False
+            self._write(text)
+        logger.debug(f"Token cache written to {self.__cache_location}")
+
+    def _schedule_write(self):
+        with self.__write_lock:
+            if self.__write_timer is None:
+                self.__write_timer = threading.Timer(self.__write_delay, self._flush_in_background)
+                self.__write_timer.daemon = True
+                self.__write_timer.start()
 
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Failed to write token cache {self.__cache_location}: {e}")
+
+    # --- TokenCache ---
     def add(self, event, **kwargs):
         super().add(event, **kwargs)
         self.__has_state_changed = True  # cache correctness shouldn't be impacted if another thread modified __has_state_changed between this and the previous line
+        self._schedule_write()
 
     def modify(self, credential_type, old_entry, new_key_value_pairs=None):
         super().modify(credential_type, old_entry, new_key_value_pairs)
         self.__has_state_changed = True
+        self._schedule_write()
 
     def serialize(self):
+        # The file is written by the background writer; nothing blocks here.
         if self.__has_state_changed:
-            with self._lock:
-                if self.__has_state_changed:
-                    with open(self.__cache_location, "w") as f:
-                        json.dump(self._cache, f)
-                        self.__has_state_changed = False
-                        return json.dumps(self._cache)
\ No newline at end of file
+            self._schedule_write()
+        with self._lock:
+            return json.dumps(self._cache)
@@ -0,0 +1,133 @@
+# Keeps the Copilot Studio access token fresh: a background task renews it
+# silently (refresh token) a few minutes before it expires and hands the new
+# token to the live clients. Workers sharing the token cache file refresh
+# under its file lock and re-read it first, so only one of them calls Entra ID
+# per expiry; the others pick up the token it wrote.
+import asyncio
+import logging
+import random
+import time
+from os import environ
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+TOKEN_REFRESH_MARGIN = float(environ.get("COPILOT_TOKEN_REFRESH_MARGIN", "300"))  # seconds before expiry
+TOKEN_RETRY_INTERVAL = float(environ.get("COPILOT_TOKEN_RETRY_INTERVAL", "30"))
+
+
+class TokenManager:
+    """Acquires tokens for `scopes` from an msal PublicClientApplication and renews them in the background.
+
+    `cache` is the application's LocalTokenCache. Callbacks registered with
+    add_listener(fn) receive every new token; requests already sent keep the
+    token they were sent with.
+    """
+
+    def __init__(self, pca, scopes, cache, refresh_margin=TOKEN_REFRESH_MARGIN, retry_interval=TOKEN_RETRY_INTERVAL):
+        self.pca = pca
+        self.scopes = scopes
+        self.cache = cache
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+        self.token = None
+        self.expires_at = 0.0
+        self.refreshes = 0
+        self.failures = 0
+        self._listeners = []
+        self._task = None
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def _silent(self, force_refresh=False):
+        accounts = self.pca.get_accounts()
+        logger.debug(f"Found {len(accounts)} cached accounts.")
+        if not accounts:
+            return None
+        return self.pca.acquire_token_silent(self.scopes, account=accounts[0], force_refresh=force_refresh)
+
+    def _locked_silent(self):
+        """Silent acquisition under the cache file lock, re-reading the cache first."""
+        with self.cache.locked():
+            # Another worker may have refreshed the token since we last looked.
+            self.cache.reload()
+            try:
+                response = self._silent()
+                if response and response.get("expires_in", 0) <= self.refresh_margin:
+                    # msal only refreshes on its own close to expiry; ask for a new one now.
+                    response = self._silent(force_refresh=True)
+            except Exception as e:
+                logger.error(f"Error acquiring token silently: {e}.")
+                response = None
+            self.cache.flush()
+        return response
+
+    def acquire(self, interactive=False):
+        """Return a valid access token (blocking), renewing it if it expires within the refresh margin.
+
+        Falls back to an interactive login only when `interactive` is set;
+        returns None if no token could be acquired.
+        """
+        response = self._locked_silent()
+        if not (response and response.get("access_token")) and interactive:
+            # The login waits on the user; do it without holding the cache lock
+            # so the other workers can keep refreshing meanwhile.
+            logger.info("Attempting interactive login...")
+            try:
+                response = self.pca.acquire_token_interactive(self.scopes)
+            except Exception as e:
+                logger.error(f"An exception occurred during interactive login: {e}")
+                response = None
+            # Save the new account under the lock, like the background writer would.
+            self.cache.flush()
+
+        token = (response or {}).get("access_token")
+        if not token:
+            logger.error(f"Failed to acquire token: {(response or {}).get('error_description', 'no cached account')}")
+            return None
+        changed = token != self.token
+        self.token = token
+        self.expires_at = time.time() + float(response.get("expires_in", 3600))
+        if changed:
+            self.refreshes += 1
+            logger.info(f"Acquired token ({response.get('token_source', 'unknown source')}), "
+                        f"expires in {int(self.expires_at - time.time())} s")
+            for listener in self._listeners:
+                listener(token)
+        return token
+
+    def seconds_until_refresh(self):
+        # A little jitter so workers started together do not all wake at once.
+        return max(0.0, self.expires_at - self.refresh_margin - time.time()) + random.uniform(0, 5)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.seconds_until_refresh())
+            # msal does blocking HTTP and file I/O; keep it off the event loop.
+            token = await loop.run_in_executor(None, self.acquire)
+            if token is None:
+                self.failures += 1
+                logger.warning(f"Token refresh failed, retrying in {self.retry_interval} s "
+                               f"(current token expires in {int(self.expires_at - time.time())} s)")
+                await asyncio.sleep(self.retry_interval)
+
+    def start(self):
+        """Start the background refresh task on the running event loop."""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        return self._task
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self):
+        return {
+            "token_expires_in": max(0, int(self.expires_at - time.time())),
+            "token_refreshes": self.refreshes,
+            "token_refresh_failures": self.failures,
+        }
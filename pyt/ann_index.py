@@ -0,0 +1,81 @@
+import logging
+import math
+
+import faiss
+import numpy as np
+
+# Approximate index types selectable with INDEX_TYPE / ingest.py --index-type.
+INDEX_TYPES = ["flat", "ivf_flat", "hnsw", "ivf_pq"]
+
+
+def default_nlist(count):
+    # ~4*sqrt(n) lists, but keep at least 39 training points per list.
+    return max(1, min(int(4 * math.sqrt(count)), count // 39))
+
+
+def factory_string(index_type, count, dimension, nlist=None, hnsw_m=32, pq_m=None):
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "hnsw":
+        return f"HNSW{hnsw_m}"
+    nlist = nlist or default_nlist(count)
+    if index_type == "ivf_flat":
+        return f"IVF{nlist},Flat"
+    if index_type == "ivf_pq":
+        # Sub-quantizers of at least 16 dimensions each (48 for mpnet's 768).
+        pq_m = pq_m or next(m for m in (64, 48, 32, 24, 16, 8, 4, 2, 1) if dimension % m == 0 and dimension // m >= 16)
+        # 8-bit codes need 256 centroids per sub-quantizer; shrink them for small corpora.
+        nbits = max(1, min(8, int(math.log2(max(2, count // 39)))))
+        return f"IVF{nlist},PQ{pq_m}x{nbits}"
+    raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+
+
+def build_index(vectors, index_type, metric=faiss.METRIC_L2, **options):
+    """Build and fill a FAISS index of `index_type` from an (n, d) float32 array."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    count, dimension = vectors.shape
+    description = factory_string(index_type, count, dimension, **options)
+    index = faiss.index_factory(dimension, description, metric)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    logging.info("Built %s index with %d vectors", description, count)
+    return index
+
+
+def index_vectors(index):
+    """All vectors of a flat index, in row order."""
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def convert_vectorstore(vectorstore, index_type, **options):
+    """Replace the flat index of a langchain FAISS store with an ANN index.
+
+    Row order is preserved, so the store's index_to_docstore_id stays valid.
+    """
+    if index_type == "flat":
+        return vectorstore
+    vectorstore.index = build_index(index_vectors(vectorstore.index), index_type, vectorstore.index.metric_type, **options)
+    return vectorstore
+
+
+def apply_search_params(index, nprobe=None, ef_search=None):
+    """Set query-time search parameters on whichever index type this is."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and nprobe:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    hnsw = getattr(faiss.downcast_index(index), "hnsw", None)
+    if hnsw is not None and ef_search:
+        hnsw.efSearch = ef_search
+    return index
+
+
+def describe(index):
+    index = faiss.downcast_index(index)
+    info = {"type": type(index).__name__, "ntotal": index.ntotal, "dimension": index.d}
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        info.update({"nlist": ivf.nlist, "nprobe": ivf.nprobe})
+    if getattr(index, "hnsw", None) is not None:
+        info["ef_search"] = index.hnsw.efSearch
+    return info
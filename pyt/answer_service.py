@@ -0,0 +1,226 @@
+# The question-answering HTTP surface shared by appfast.py and
+# appfast-parlant.py (and, for the ops routes, retrieval_sidecar.py):
+# create_app() sets up logging, startup, CORS and metrics, `router` holds the
+# answer endpoints and `ops_router` the metrics, health and index admin ones.
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from batch_answer import BATCH_CONCURRENCY, BATCH_MAX_QUESTIONS, abatch_answer
+from functions import acontextualize, aget_answer, astream_answer, readiness, remember_in_background, start_background_startup
+from llm_scheduler import BUSY_DETAIL, is_rate_limit, retry_after_header
+from metrics import MetricsMiddleware, render, stats_collector, timings_ms, trace
+from structured_log import configure_logging, fields
+import asyncio
+import functions
+import hmac
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime
+from pydantic import BaseModel, Field
+from typing import List, Optional
+
+# Token for the mutating admin routes, sent as X-Admin-Token. Unset: they only
+# answer requests from this host (loopback or the sidecar's Unix socket); set
+# it when a reverse proxy on this host forwards outside traffic.
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+# JSON lines in app.<pid>.log, written by a background thread (see structured_log.py).
+log_handler = configure_logging()
+stats_collector.add("log", log_handler.stats)
+
+# The embedding model and index (or the connection to the retrieval sidecar)
+# load in the background after the server starts, so /healthz answers right
+# away and /readyz once warmed up.
+@asynccontextmanager
+async def lifespan(app):
+    start_background_startup()
+    yield
+
+def create_app(**kwargs):
+    app = FastAPI(lifespan=lifespan, **kwargs)
+    # Allow CORS for all routes
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # Allow all origins, you can restrict this for security
+        allow_credentials=True,
+        allow_methods=["*"],  # Allow all methods
+        allow_headers=["*"],  # Allow all headers
+    )
+    app.add_middleware(MetricsMiddleware)
+    return app
+
+router = APIRouter()
+ops_router = APIRouter()
+
+@router.get("/")
+async def home():
+    return {"message": "AISE"}
+
+# With a session_id the server keeps the conversation history itself; the
+# history parameter is only used by clients that do not send one. Queries
+# with such a history skip the answer cache: the embedding model truncates
+# long inputs, so the question itself may not be part of the cache key.
+@router.get("/get_answer")
+async def get_answer_api(query: str,request: Request,history: str = "",session_id: str = ""):
+    try:
+        request_time = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+        client_ip = request.client.host
+        server_port = request.url.hostname
+        with trace() as timings:
+            if session_id:
+                full_query = await acontextualize(session_id, query)
+            else:
+                full_query = f"{history}\nUser: {query}" if history else f"User: {query}"
+
+            response = await aget_answer(full_query, use_cache=bool(session_id) or not history)
+        if session_id:
+            remember_in_background(session_id, query, response)
+        logging.info("Generated answer", extra=fields(
+            client=client_ip, server=server_port, request_time=request_time, session_id=session_id,
+            query=query, timings_ms=timings_ms(timings), answer=response["Answer"], sources=response["Sources"],
+        ))
+        return response
+
+    except asyncio.TimeoutError:
+        logging.error("Timed out generating answer", extra=fields(query=query, session_id=session_id))
+        raise HTTPException(status_code=504, detail="Timed out while generating the answer.")
+    except Exception as e:
+        if is_rate_limit(e):
+            # Groq rate limit or a full LLM queue (llm_scheduler.py): tell the client to come back.
+            logging.warning("Rejected question, LLM busy", extra=fields(query=query, error=str(e)))
+            raise HTTPException(status_code=429, detail=BUSY_DETAIL, headers={"Retry-After": retry_after_header(e)})
+        logging.error("Failed to generate answer", extra=fields(query=query, error=str(e)))
+        raise HTTPException(status_code=500, detail=str(e))
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Server-sent events: one "token" event per LLM token, then a final "answer"
+# event carrying the citations and the full formatted answer.
+@router.get("/get_answer/stream")
+async def stream_answer_api(query: str, request: Request, history: str = "", session_id: str = ""):
+    request_time = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+    client_ip = request.client.host
+
+    async def events():
+        try:
+            with trace() as timings:
+                if session_id:
+                    full_query = await acontextualize(session_id, query)
+                else:
+                    full_query = f"{history}\nUser: {query}" if history else f"User: {query}"
+                async for kind, data in astream_answer(full_query, use_cache=bool(session_id) or not history):
+                    if kind == "token":
+                        yield sse_event("token", {"text": data})
+                    else:
+                        logging.info("Streamed answer", extra=fields(
+                            client=client_ip, request_time=request_time, session_id=session_id,
+                            query=query, timings_ms=timings_ms(timings), answer=data["Answer"], sources=data["Sources"],
+                        ))
+                        if session_id:
+                            remember_in_background(session_id, query, data)
+                        yield sse_event("answer", data)
+        except asyncio.TimeoutError:
+            logging.error("Timed out streaming answer", extra=fields(query=query, session_id=session_id))
+            yield sse_event("error", {"status": 504, "detail": "Timed out while generating the answer."})
+        except Exception as e:
+            if is_rate_limit(e):
+                logging.warning("Rejected question, LLM busy", extra=fields(query=query, error=str(e)))
+                yield sse_event("error", {"status": 429, "detail": BUSY_DETAIL, "retry_after": int(retry_after_header(e))})
+                return
+            logging.error("Failed to stream answer", extra=fields(query=query, error=str(e)))
+            yield sse_event("error", {"status": 500, "detail": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# Bulk answering (FAQ pre-answering, post-reindex checks): one JSON line per
+# question as soon as it is answered; "index" is its position in the request.
+class BatchRequest(BaseModel):
+    questions: List[str]
+    concurrency: Optional[int] = Field(None, ge=1)
+
+@router.post("/batch_answer")
+async def batch_answer_api(batch: BatchRequest, request: Request):
+    if len(batch.questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_QUESTIONS} questions per batch.")
+    client_ip = request.client.host
+    # Clients may ask for less LLM concurrency than the server allows, not more.
+    concurrency = min(batch.concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY)
+
+    async def lines():
+        failed = 0
+        try:
+            with trace() as timings:
+                async for result in abatch_answer(batch.questions, concurrency=concurrency):
+                    failed += "error" in result
+                    yield json.dumps(result) + "\n"
+            logging.info("Answered batch", extra=fields(
+                client=client_ip, questions=len(batch.questions), failed=failed, timings_ms=timings_ms(timings),
+            ))
+        except Exception as e:
+            logging.error("Failed to answer batch", extra=fields(questions=len(batch.questions), error=str(e)))
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+# Prometheus scrape endpoint: stage latencies, request counts, in-flight
+# requests, cache hit ratios and LLM token counters.
+@ops_router.get("/metrics")
+async def metrics():
+    body, content_type = render()
+    return Response(body, media_type=content_type)
+
+
+# --- Health ---
+@ops_router.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+@ops_router.get("/readyz")
+async def readyz():
+    ready, details = readiness()
+    return JSONResponse(details, status_code=200 if ready else 503)
+
+
+# --- Index admin ---
+# With RETRIEVAL_SOCKET set the index lives in the retrieval sidecar; these
+# answer 503 on the workers and are served by the sidecar instead.
+def require_admin(request: Request):
+    if ADMIN_TOKEN:
+        if not hmac.compare_digest(request.headers.get("x-admin-token", ""), ADMIN_TOKEN):
+            raise HTTPException(status_code=403, detail="Admin token required")
+    elif request.client is not None and request.client.host not in ("127.0.0.1", "::1", "localhost"):
+        raise HTTPException(status_code=403, detail="Admin routes are local only unless ADMIN_TOKEN is set")
+
+@ops_router.get("/admin/index")
+async def index_status():
+    index_manager = functions.index_manager
+    if index_manager is None:
+        raise HTTPException(status_code=503, detail="No index loaded")
+    return index_manager.status()
+
+@ops_router.post("/admin/index/reload", dependencies=[Depends(require_admin)])
+async def reload_index():
+    index_manager = functions.index_manager
+    if index_manager is None:
+        raise HTTPException(status_code=503, detail="No index loaded")
+    try:
+        await asyncio.to_thread(index_manager.reload)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return index_manager.status()
+
+@ops_router.post("/admin/index/search_params", dependencies=[Depends(require_admin)])
+async def set_index_search_params(nprobe: int = None, ef_search: int = None):
+    index_manager = functions.index_manager
+    if index_manager is None:
+        raise HTTPException(status_code=503, detail="No index loaded")
+    index_manager.set_search_params(nprobe=nprobe, ef_search=ef_search)
+    return index_manager.status()
@@ -1,26 +1,26 @@
-# uvicorn appfast:app --host 127.0.0.1 --port 5001
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.middleware.cors import CORSMiddleware
-from functions import get_answer
+# uvicorn appfast-parlant:app --host 127.0.0.1 --port 5001
+# Parlant-style sessions and events on top of the answer endpoints of
+# answer_service.py (shared with appfast.py).
+from fastapi import HTTPException, Request
+from fastapi.responses import StreamingResponse
+from answer_service import create_app, ops_router, router
+from event_log import OffsetGone, make_event
+from functions import EVENT_WAIT_MAX, acontextualize, aget_answer, astream_answer, event_log, remember_in_background, session_store
+from llm_scheduler import BUSY_DETAIL, is_rate_limit, retry_after_header
+from metrics import stats_collector, timings_ms, trace
+from structured_log import fields
+import asyncio
+import json
 import logging
 from datetime import datetime, timezone
-from pydantic import BaseModel, Field
+from pydantic import BaseModel
 import uuid
 from typing import Dict, Any, List
 
-logging.basicConfig(filename='app.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
 # Initialize FastAPI app
-app = FastAPI()
-
-# Allow CORS for all routes
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+app = create_app()
+app.include_router(router)
+app.include_router(ops_router)
 
 # --- DATA MODELS ---
 class SessionRequest(BaseModel):
@@ -53,24 +53,121 @@ class Event(BaseModel):
     deleted: bool
     data: Dict[str, Any]
 
+class SessionUpdate(BaseModel):
+    consumption_offsets: Dict[str, int]
+
+TIMEOUT_DETAIL = "Timed out while generating the answer."
+
+async def answer_events(session_id: str, user_message: str, correlation_id: str, stream: bool = False):
+    # Appends a "status" typing event, the "message" event with citations and
+    # a final "status" event to the session's log, yielding each one. With
+    # `stream`, one "message_chunk" event per LLM token is yielded as well;
+    # chunks are not logged and carry the offset of the typing event.
+    typing = await event_log.aappend(session_id, make_event("status", {"status": "typing"}, correlation_id))
+    yield typing
+    try:
+        with trace() as timings:
+            question = await acontextualize(session_id, user_message)
+            if stream:
+                async for kind, data in astream_answer(question):
+                    if kind == "token":
+                        yield make_event("message_chunk", {"message": data}, correlation_id, offset=typing["offset"])
+                    else:
+                        agent_response = data
+            else:
+                agent_response = await aget_answer(question)
+        logging.info("Sending response", extra=fields(
+            session_id=session_id, query=user_message, question=question, timings_ms=timings_ms(timings),
+            answer=agent_response["Answer"], sources=agent_response["Sources"], stream=stream,
+        ))
+        remember_in_background(session_id, user_message, agent_response)
+        yield await event_log.aappend(session_id, make_event("message", {"message": agent_response}, correlation_id))
+        status = {"status": "ready"}
+    except asyncio.TimeoutError:
+        logging.error("Timed out processing event", extra=fields(session_id=session_id))
+        status = {"status": "error", "detail": TIMEOUT_DETAIL}
+    except Exception as e:
+        if is_rate_limit(e):
+            # Groq rate limit or a full LLM queue (llm_scheduler.py): tell the client to come back.
+            logging.warning("Rejected event, LLM busy", extra=fields(session_id=session_id, error=str(e)))
+            status = {"status": "error", "detail": BUSY_DETAIL, "retry_after": int(retry_after_header(e))}
+        else:
+            logging.error("Error processing event", extra=fields(session_id=session_id, error=str(e)))
+            status = {"status": "error", "detail": str(e)}
+    yield await event_log.aappend(session_id, make_event("status", status, correlation_id))
+
+# Answers are generated by background tasks that append to the event log, so
+# they finish even if the client that asked has gone, and any number of
+# clients can wait on GET /sessions/{id}/events in the meantime.
+_generations = set()
+stats_collector.add("generations", lambda: {"running": len(_generations)})
+
+async def generate(session_id: str, user_message: str, correlation_id: str):
+    return [event async for event in answer_events(session_id, user_message, correlation_id)]
+
+def generate_in_background(session_id: str, user_message: str, correlation_id: str):
+    task = asyncio.ensure_future(generate(session_id, user_message, correlation_id))
+    _generations.add(task)
+    task.add_done_callback(_generations.discard)
+    return task
+
+def raise_for_status(status: Dict[str, Any]):
+    if status.get("status") != "error":
+        return
+    if "retry_after" in status:
+        raise HTTPException(status_code=429, detail=status["detail"], headers={"Retry-After": str(status["retry_after"])})
+    raise HTTPException(status_code=504 if status["detail"] == TIMEOUT_DETAIL else 500, detail=status["detail"])
+
+def session_response(session_id: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": session_id,
+        "agent_id": metadata.get("agent_id", ""),
+        "customer_id": metadata.get("customer_id", ""),
+        "creation_utc": metadata.get("creation_utc", ""),
+        "consumption_offsets": metadata.get("consumption_offsets", {}),
+    }
+
 # --- ENDPOINTS ---
 @app.post("/sessions", response_model=SessionResponse)
 async def create_session(request: SessionRequest):
     session_id = str(uuid.uuid4())
-    customer_id = str(uuid.uuid4())
-    creation_time = datetime.now(timezone.utc).isoformat()
-    logging.info(f"New session created: {session_id} for agent {request.agent_id}")
-    return {
-        "id": session_id,
+    metadata = {
         "agent_id": request.agent_id,
-        "customer_id": customer_id,
-        "creation_utc": creation_time,
-        "consumption_offsets": {}
+        "customer_id": str(uuid.uuid4()),
+        "creation_utc": datetime.now(timezone.utc).isoformat(),
+        "consumption_offsets": {},
     }
+    await asyncio.to_thread(session_store.create, session_id, **metadata)
+    logging.info("New session created", extra=fields(session_id=session_id, agent_id=request.agent_id))
+    return session_response(session_id, metadata)
+
+@app.get("/sessions/{session_id}", response_model=SessionResponse)
+async def get_session(session_id: str):
+    session = await asyncio.to_thread(session_store.get, session_id, False)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return session_response(session_id, session.metadata)
+
+# Clients record how far they have read, e.g. {"consumption_offsets": {"client": 7}},
+# and resume from there after reconnecting.
+@app.patch("/sessions/{session_id}", response_model=SessionResponse)
+async def update_session(session_id: str, update: SessionUpdate):
+    session = await asyncio.to_thread(session_store.get, session_id, False)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    offsets = {**session.metadata.get("consumption_offsets", {}), **update.consumption_offsets}
+    session = await asyncio.to_thread(session_store.update, session_id, consumption_offsets=offsets)
+    return session_response(session_id, session.metadata)
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    await asyncio.to_thread(session_store.delete, session_id)
+    await asyncio.to_thread(event_log.delete, session_id)
+    return {"deleted": session_id}
 
 @app.get("/agents/{agent_id}", response_model=AgentDetails)
 async def get_agent_details(agent_id: str):
-    logging.info(f"Fetching details for agent: {agent_id}")
+    logging.debug("Fetching agent details", extra=fields(agent_id=agent_id))
     return {
         "id": agent_id,
         "name": "AI Support Assistant",
@@ -78,49 +175,53 @@ async def get_agent_details(agent_id: str):
         "welcome_message": "Hello! How can I assist you today?"
     }
 
-# The response_model is now a List of Event objects
+# The customer's message is logged and answered by a background task. By
+# default the request waits for the answer and returns its "message" event;
+# with wait=false it returns the customer's event right away and the client
+# reads the answer from GET /sessions/{id}/events. With stream=true the events
+# are sent as server-sent events while they are generated.
 @app.post("/sessions/{session_id}/events", response_model=List[Event])
-async def handle_session_events(session_id: str, event: EventRequest, request: Request):
+async def handle_session_events(session_id: str, event: EventRequest, request: Request, stream: bool = False, wait: bool = True):
+    user_message = event.message
+    if not user_message:
+        raise HTTPException(status_code=400, detail="Message cannot be empty")
+
+    logging.info("Received message", extra=fields(session_id=session_id, user_message=user_message))
+    correlation_id = str(uuid.uuid4())
+    customer_event = await event_log.aappend(
+        session_id, make_event("message", {"message": user_message}, correlation_id, source="customer")
+    )
+
+    if stream:
+        events = (f"data: {json.dumps(e)}\n\n" async for e in answer_events(session_id, user_message, correlation_id, stream=True))
+        return StreamingResponse(
+            events,
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    task = generate_in_background(session_id, user_message, correlation_id)
+    if not wait:
+        return [customer_event]
+    # A client that disconnects cancels only its wait, not the answer.
+    events = await asyncio.shield(task)
+    raise_for_status(events[-1]["data"])
+    return [e for e in events if e["kind"] == "message"]
+
+# Long poll: the session's events at or after min_offset, waiting up to
+# wait_for_data seconds (at most EVENT_WAIT_MAX) for the first one; 504 if
+# none arrives in time. 410 if min_offset is past the end of the log, which
+# was dropped and started again: the client should re-read from offset 0.
+@app.get("/sessions/{session_id}/events", response_model=List[Event])
+async def list_session_events(session_id: str, min_offset: int = 0, wait_for_data: int = 60):
+    timeout = min(max(wait_for_data, 0), EVENT_WAIT_MAX)
     try:
-        user_message = event.message
-        if not user_message:
-            raise HTTPException(status_code=400, detail="Message cannot be empty")
-
-        logging.info(f"Received message for session {session_id}: {user_message}")
-        
-        agent_response = get_answer(user_message)
-        
-        logging.info(f"Sending response for session {session_id}: {agent_response}")
-        
-        # We now return a list containing the single event object
-        return [{
-            "id": str(uuid.uuid4()),
-            "source": "agent",
-            "kind": "message",
-            "offset": 1, 
-            "creation_utc": datetime.now(timezone.utc).isoformat(),
-            "correlation_id": str(uuid.uuid4()),
-            "deleted": False,
-            "data": {
-                "message": agent_response
-            }
-        }]
-    except Exception as e:
-        logging.error(f"Error processing event for session {session_id}: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
-
-
-@app.get("/")
-async def home():
-    return {"message": "AISE"}
-
-@app.get("/get_answer")
-async def get_answer_api(query: str, request: Request, history: str = ""):
-    try:
-        response = get_answer(query)
-        return response
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        events = await event_log.wait(session_id, min_offset, timeout)
+    except OffsetGone as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    if not events and timeout > 0:
+        raise HTTPException(status_code=504, detail="No new events before the timeout.")
+    return events
 
 
 if __name__ == "__main__":
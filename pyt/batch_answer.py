@@ -0,0 +1,217 @@
+# python batch_answer.py faq.txt --out answers.jsonl --concurrency 8
+# python batch_answer.py --eval labelled.jsonl --out eval.jsonl
+# Answers a list of questions in bulk: questions are embedded and searched in
+# batches (one model call and one FAISS search per batch), then the LLM calls
+# run through a bounded pool that waits out a full LLM queue with backoff.
+# Results are written as JSON lines in completion order ("index" is the
+# position in the input). --eval skips the LLM and scores retrieval against a
+# labelled file: one {"question": ..., "sources": [...]} object per line, a
+# question counts as a hit when any expected source is among the retrieved ones.
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+
+from functions import (
+    ANSWER_TIMEOUT, SAFETY_CHECK, UNSAFE_RESPONSE, cache_lookup, cache_store, embed_batch, format_answer, get_engine,
+    run_in_pool, wait_until_ready,
+)
+from llm_scheduler import PRIORITY_BATCH, LLMQueueFull, llm_priority, retry_after
+
+# --- Configuration ---
+BATCH_SIZE = int(os.environ.get("BATCH_SIZE", "64"))  # questions per embedding call / FAISS search
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "8"))  # LLM calls in flight
+BATCH_RETRIES = int(os.environ.get("BATCH_RETRIES", "5"))
+BATCH_BACKOFF = float(os.environ.get("BATCH_BACKOFF", "1.0"))  # seconds, doubled per attempt
+BATCH_MAX_QUESTIONS = int(os.environ.get("BATCH_MAX_QUESTIONS", "1000"))  # per /batch_answer request
+BATCH_ANSWER_TIMEOUT = float(os.environ.get("BATCH_ANSWER_TIMEOUT", str(ANSWER_TIMEOUT * 2)))
+
+
+# --- Retries ---
+async def with_retries(make_call, retries=BATCH_RETRIES, backoff=BATCH_BACKOFF):
+    """Await make_call(), retrying with jittered exponential backoff while the LLM queue is full.
+
+    The scheduler already retries rate-limited and failed calls; a full queue
+    rejects the call before it is queued, and a batch can wait that out
+    instead of failing the question.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return await make_call()
+        except LLMQueueFull as e:
+            if attempt == retries:
+                raise
+            delay = retry_after(e) or backoff * 2 ** attempt
+            delay *= random.uniform(1.0, 1.5)
+            logging.warning("LLM queue full, retrying in %.1f s (attempt %d/%d)", delay, attempt + 1, retries)
+            await asyncio.sleep(delay)
+
+
+# --- Batch answering ---
+def _prepare(engine, questions):
+    """Embed a batch, look it up in the answer cache and retrieve context for the misses."""
+    vectors = embed_batch(questions)
+    cached = [cache_lookup(question, vector) for question, vector in zip(questions, vectors)]
+    misses = [i for i, hit in enumerate(cached) if hit is None]
+    source_documents = [None] * len(questions)
+    if misses:
+        retrieved = engine.retrieve_batch([questions[i] for i in misses], [vectors[i] for i in misses])
+        for i, documents in zip(misses, retrieved):
+            source_documents[i] = documents
+    return vectors, cached, source_documents
+
+
+async def _answer(engine, slots, index, question, vector, cached, source_documents, retries, backoff):
+    async with slots:
+        try:
+            if SAFETY_CHECK and not await with_retries(lambda: engine.guard.acheck(question), retries, backoff):
+                return {"index": index, "question": question, **UNSAFE_RESPONSE}
+            if cached is not None:
+                answer, source_documents = cached
+            else:
+                answer = await asyncio.wait_for(
+                    with_retries(lambda: engine.agenerate(question, source_documents), retries, backoff),
+                    BATCH_ANSWER_TIMEOUT,
+                )
+                await run_in_pool(cache_store, question, answer, source_documents, vector)
+            return {"index": index, "question": question, **format_answer(answer, source_documents),
+                    "cached": cached is not None}
+        except asyncio.TimeoutError:
+            return {"index": index, "question": question, "error": "Timed out while generating the answer."}
+        except Exception as e:
+            logging.error("Batch answer failed for '%s': %s", question, e)
+            return {"index": index, "question": question, "error": str(e)}
+
+
+async def abatch_answer(questions, concurrency=BATCH_CONCURRENCY, batch_size=BATCH_SIZE,
+                        retries=BATCH_RETRIES, backoff=BATCH_BACKOFF):
+    """Answer `questions`, yielding one result dict per question as it completes.
+
+    A result holds "index", "question" and either the get_answer fields plus
+    "cached", or "error". The next batch is embedded and searched while the
+    LLM calls of the previous ones are running.
+    """
+    await wait_until_ready(ANSWER_TIMEOUT)
+    engine = get_engine()
+    slots = asyncio.Semaphore(concurrency)
+    results = asyncio.Queue()
+    tasks = []
+
+    async def produce():
+        for start in range(0, len(questions), batch_size):
+            batch = questions[start:start + batch_size]
+            vectors, cached, source_documents = await run_in_pool(_prepare, engine, batch)
+            for offset, question in enumerate(batch):
+                # The task inherits the priority: interactive requests get their LLM calls first.
+                with llm_priority(PRIORITY_BATCH):
+                    task = asyncio.ensure_future(_answer(
+                        engine, slots, start + offset, question, vectors[offset], cached[offset],
+                        source_documents[offset], retries, backoff,
+                    ))
+                task.add_done_callback(lambda done: done.cancelled() or results.put_nowait(done.result()))
+                tasks.append(task)
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        for _ in range(len(questions)):
+            getter = asyncio.ensure_future(results.get())
+            await asyncio.wait([getter, producer], return_when=asyncio.FIRST_COMPLETED)
+            if not getter.done():
+                getter.cancel()
+                producer.result()  # re-raises a failed embedding/search batch
+                yield await results.get()
+            else:
+                yield getter.result()
+    finally:
+        for task in [producer, *tasks]:
+            task.cancel()
+        await asyncio.gather(producer, *tasks, return_exceptions=True)
+
+
+# --- Retrieval evaluation ---
+def source_matches(expected, source):
+    """Case-insensitive match on file names, so "Leave Policy.pdf" matches a full path or URL."""
+    expected = expected.replace("\\", "/").rstrip("/").rsplit("/", 1)[-1].lower()
+    source = source.replace("\\", "/").rstrip("/").rsplit("/", 1)[-1].lower()
+    return bool(expected) and expected in source
+
+
+def evaluate(items, batch_size=BATCH_SIZE):
+    """Yield {question, expected, retrieved, hit, rank} for every labelled item (no LLM calls)."""
+    engine = get_engine()
+    for start in range(0, len(items), batch_size):
+        batch = items[start:start + batch_size]
+        questions = [item["question"] for item in batch]
+        results = engine.retrieve_batch(questions, embed_batch(questions), pack=False)
+        for item, documents in zip(batch, results):
+            retrieved = [doc.metadata.get("source", "") for doc in documents]
+            rank = next(
+                (i + 1 for i, source in enumerate(retrieved)
+                 if any(source_matches(expected, source) for expected in item["sources"])),
+                None,
+            )
+            yield {"question": item["question"], "expected": item["sources"], "retrieved": retrieved,
+                   "hit": rank is not None, "rank": rank}
+
+
+def summarize(rows):
+    total = len(rows)
+    hits = sum(row["hit"] for row in rows)
+    return {
+        "questions": total,
+        "hits": hits,
+        "hit_rate": round(hits / total, 4) if total else 0.0,
+        "mrr": round(sum(1 / row["rank"] for row in rows if row["hit"]) / total, 4) if total else 0.0,
+    }
+
+
+def read_questions(path):
+    """Questions from a .jsonl file ({"question": ...} per line) or a text file (one per line)."""
+    with open(path, "r", encoding="utf-8") as f:
+        lines = [line.strip() for line in f if line.strip()]
+    if path.endswith(".jsonl"):
+        return [json.loads(line) for line in lines]
+    return [{"question": line} for line in lines]
+
+
+async def main(args, out):
+    questions = [item["question"] for item in read_questions(args.questions)]
+    answered = failed = 0
+    async for result in abatch_answer(questions, concurrency=args.concurrency, batch_size=args.batch_size,
+                                      retries=args.retries):
+        out.write(json.dumps(result, ensure_ascii=False) + "\n")
+        out.flush()
+        answered += 1
+        failed += "error" in result
+    logging.info("Answered %d questions (%d failed)", answered, failed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("questions", nargs="?", help="questions file (.txt, one per line, or .jsonl)")
+    parser.add_argument("--eval", metavar="LABELLED", help="score retrieval against a labelled .jsonl file instead")
+    parser.add_argument("--out", help="JSON lines output (default: stdout)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--retries", type=int, default=BATCH_RETRIES)
+    args = parser.parse_args()
+    if not args.questions and not args.eval:
+        parser.error("give a questions file or --eval LABELLED")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stderr)
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    try:
+        if args.eval:
+            rows = []
+            for row in evaluate(read_questions(args.eval), args.batch_size):
+                out.write(json.dumps(row, ensure_ascii=False) + "\n")
+                rows.append(row)
+            print(json.dumps(summarize(rows)), file=sys.stderr)
+        else:
+            asyncio.run(main(args, out))
+    finally:
+        if out is not sys.stdout:
+            out.close()
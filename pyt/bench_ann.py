@@ -0,0 +1,95 @@
+# python bench_ann.py db --scales 1,100,1000 --queries 200
+# Recall@k against the exact flat index, p50/p99 single-query search latency,
+# build time and serialized index size for every approximate index type, on
+# the EXEO corpus (scale 1) and on synthetic corpora scaled up from it.
+# Synthetic vectors are real chunk vectors plus Gaussian noise, so they keep
+# the clustering of the real embedding space.
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+from ann_index import apply_search_params, build_index, index_vectors
+
+SEARCH_GRID = {
+    "flat": [{}],
+    "ivf_flat": [{"nprobe": n} for n in (1, 4, 8, 16, 32)],
+    "hnsw": [{"ef_search": ef} for ef in (16, 32, 64, 128)],
+    "ivf_pq": [{"nprobe": n} for n in (1, 4, 8, 16, 32)],
+}
+
+
+def load_corpus(path):
+    return index_vectors(faiss.read_index(f"{path}/index.faiss"))
+
+
+def scale_corpus(base, scale, rng, noise=0.15):
+    if scale == 1:
+        return base
+    picks = base[rng.integers(0, len(base), size=len(base) * scale)]
+    spread = noise * base.std(axis=0)
+    return (picks + rng.standard_normal(picks.shape).astype(np.float32) * spread).astype(np.float32)
+
+
+def make_queries(base, count, rng, noise=0.1):
+    picks = base[rng.integers(0, len(base), size=count)]
+    return (picks + rng.standard_normal(picks.shape).astype(np.float32) * noise * base.std(axis=0)).astype(np.float32)
+
+
+def search_latencies(index, queries, k):
+    latencies = []
+    results = np.empty((len(queries), k), dtype=np.int64)
+    for i, query in enumerate(queries):
+        started = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        results[i] = ids[0]
+    return results, np.array(latencies)
+
+
+def recall_at_k(results, truth):
+    hits = sum(len(set(row[row >= 0]) & set(expected)) for row, expected in zip(results, truth))
+    return hits / truth.size
+
+
+def run(vectors, queries, k, label):
+    truth_index = build_index(vectors, "flat")
+    _, truth = truth_index.search(queries, k)
+    print(f"\n{label}: {len(vectors)} vectors, {len(queries)} queries, k={k}")
+    print(f"{'index':<10}{'params':<16}{'recall@k':>10}{'p50 ms':>10}{'p99 ms':>10}{'build s':>10}{'size MiB':>10}")
+    for index_type, grid in SEARCH_GRID.items():
+        started = time.perf_counter()
+        try:
+            index = build_index(vectors, index_type)
+        except RuntimeError as e:
+            print(f"{index_type:<10}{'-':<16} skipped: {e}")
+            continue
+        build_seconds = time.perf_counter() - started
+        size_mib = faiss.serialize_index(index).nbytes / 2**20
+        for params in grid:
+            apply_search_params(index, **params)
+            results, latencies = search_latencies(index, queries, k)
+            label_params = ",".join(f"{key}={value}" for key, value in params.items()) or "-"
+            print(
+                f"{index_type:<10}{label_params:<16}{recall_at_k(results, truth):>10.3f}"
+                f"{np.percentile(latencies, 50):>10.3f}{np.percentile(latencies, 99):>10.3f}"
+                f"{build_seconds:>10.2f}{size_mib:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", nargs="?", default="db")
+    parser.add_argument("--scales", default="1,100,1000", help="corpus multipliers; 1 is the real corpus")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    base = load_corpus(args.path)
+    queries = make_queries(base, args.queries, rng)
+    for scale in (int(s) for s in args.scales.split(",")):
+        label = "EXEO corpus" if scale == 1 else f"synthetic x{scale}"
+        run(scale_corpus(base, scale, rng), queries, args.k, label)
@@ -0,0 +1,36 @@
+# python bench_answer_service.py --workers 4 --concurrency 32 --duration 60
+# Runs the same load as loadtest.py (stub LLM, same question mix) against
+# appfast twice: with the embedding model and index loaded in every worker,
+# and with one shared retrieval_sidecar.py. Prints throughput, latency and
+# the peak memory of the server processes (PSS, so shared pages are counted
+# once) for both. Accepts every loadtest.py option; --launch defaults to appfast.
+import asyncio
+
+import loadtest
+
+
+def run_mode(args, retrieval):
+    args.retrieval = retrieval
+    processes, url = loadtest.launch(args)
+    try:
+        return asyncio.run(loadtest.run(args, url, [process.pid for process in processes[1:]]))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    parser = loadtest.build_parser()
+    parser.set_defaults(launch="appfast")
+    parser.add_argument("--modes", default="in-process,sidecar")
+    args = parser.parse_args()
+
+    results = {retrieval: run_mode(args, retrieval) for retrieval in args.modes.split(",")}
+    print(f"appfast, {args.workers} workers, {args.concurrency} users, {args.mode}:")
+    for retrieval, summary in results.items():
+        latency = summary["latency"] or {}
+        workers = [memory.get("Pss", 0) for memory in summary["memory_mib"].values()]
+        print(f"  {retrieval:<10}  {summary['rps']:7.2f} req/s  p50={latency.get('p50_ms', 0):8.1f} ms  "
+              f"p95={latency.get('p95_ms', 0):8.1f} ms  errors={sum(summary['errors'].values())}  "
+              f"total PSS={summary['total_pss_mib']:8.1f} MiB  largest process={max(workers, default=0):7.1f} MiB")
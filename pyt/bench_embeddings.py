@@ -0,0 +1,83 @@
+# python bench_embeddings.py db --onnx-dir models/mpnet-int8 --threads 1 2 4
+# Compares the PyTorch sentence-transformers model with the int8 ONNX export
+# (onnx_embeddings.py): single-query latency, batch throughput on chunks from
+# the index, and retrieval agreement -- recall@k of the ONNX query vectors
+# against the top-k the PyTorch vectors retrieve from the same index.
+import argparse
+import time
+
+import numpy as np
+
+from bench_hybrid import QUESTIONS
+from index_manager import load_faiss
+from ingest import DEFAULT_MODEL_NAME, PrecomputedEmbeddings
+from onnx_embeddings import OnnxEmbeddings
+
+
+def percentiles(values):
+    values = np.array(values)
+    return f"p50={np.percentile(values, 50):7.2f} ms  p99={np.percentile(values, 99):7.2f} ms"
+
+
+def query_latencies(embeddings, queries, repeat):
+    latencies = []
+    for _ in range(repeat):
+        for query in queries:
+            started = time.perf_counter()
+            embeddings.embed_query(query)
+            latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+def throughput(embeddings, texts, batch_size):
+    started = time.perf_counter()
+    for start in range(0, len(texts), batch_size):
+        embeddings.embed_documents(texts[start:start + batch_size])
+    return len(texts) / (time.perf_counter() - started)
+
+
+def top_k(index, vectors, k):
+    _, rows = index.search(np.array(vectors, dtype=np.float32), k)
+    return [set(int(row) for row in hits if row >= 0) for hits in rows]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", nargs="?", default="db")
+    parser.add_argument("--onnx-dir", default="models/mpnet-int8")
+    parser.add_argument("--model", default=DEFAULT_MODEL_NAME)
+    parser.add_argument("--threads", type=int, nargs="+", default=[0], help="onnxruntime intra-op threads to try")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--chunks", type=int, default=256, help="indexed chunks used for throughput and as extra queries")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--k", type=int, default=4)
+    args = parser.parse_args()
+
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    vectorstore = load_faiss(args.path, PrecomputedEmbeddings())
+    rows = sorted(vectorstore.index_to_docstore_id)[:args.chunks]
+    texts = [vectorstore.docstore.search(vectorstore.index_to_docstore_id[row]).page_content for row in rows]
+    queries = QUESTIONS + [text[:200] for text in texts[:40]]
+
+    started = time.perf_counter()
+    torch_embeddings = HuggingFaceEmbeddings(model_name=args.model)
+    print(f"torch      load {time.perf_counter() - started:6.2f} s")
+    reference = torch_embeddings.embed_documents(queries)
+    expected = top_k(vectorstore.index, reference, args.k)
+    print(f"torch      query {percentiles(query_latencies(torch_embeddings, QUESTIONS, args.repeat))}  "
+          f"batch {throughput(torch_embeddings, texts, args.batch_size):7.1f} chunks/s")
+
+    for threads in args.threads:
+        started = time.perf_counter()
+        onnx_embeddings = OnnxEmbeddings(args.onnx_dir, threads=threads, batch_size=args.batch_size)
+        load_seconds = time.perf_counter() - started
+        vectors = onnx_embeddings.embed_documents(queries)
+        found = top_k(vectorstore.index, vectors, args.k)
+        recall = np.mean([len(a & b) / max(1, len(b)) for a, b in zip(found, expected)])
+        a, b = np.array(vectors), np.array(reference)
+        cosine = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+        print(f"onnx-int8 threads={threads or 'auto'} load {load_seconds:6.2f} s")
+        print(f"           query {percentiles(query_latencies(onnx_embeddings, QUESTIONS, args.repeat))}  "
+              f"batch {throughput(onnx_embeddings, texts, args.batch_size):7.1f} chunks/s")
+        print(f"           recall@{args.k} vs torch {recall:.3f}  cosine mean {cosine.mean():.4f} min {cosine.min():.4f}")
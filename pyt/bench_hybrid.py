@@ -0,0 +1,91 @@
+# python bench_hybrid.py db --repeat 50
+# Measures what hybrid retrieval adds on top of dense search: BM25 index build
+# time at load, and per-query latency of the FAISS search alone, the BM25
+# search, and the full fused retrieval. Query embeddings are computed once up
+# front so the numbers isolate search and fusion cost.
+import argparse
+import time
+
+import numpy as np
+
+from bm25 import BM25Index, reciprocal_rank_fusion
+from index_manager import load_faiss
+from ingest import PrecomputedEmbeddings
+
+QUESTIONS = [
+    "How many days of annual leave do I get?",
+    "What is the per diem for business travel?",
+    "Which public holidays are observed this year?",
+    "Is sick leave paid?",
+    "What does the code of business conduct say about gifts?",
+    "Who approves training and certification requests?",
+    "What is the maximum number of working hours per week?",
+    "How is overtime compensated?",
+    "What is EXEO-HRD-PO-03?",
+    "Can I carry over unused vacation days?",
+]
+
+
+def percentiles(values):
+    values = np.array(values)
+    return f"p50={np.percentile(values, 50):7.3f} ms  p99={np.percentile(values, 99):7.3f} ms"
+
+
+def timed(fn, repeat):
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", nargs="?", default="db")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--fetch-k", type=int, default=20)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--embed", action="store_true", help="embed questions with the real model instead of sampling index vectors")
+    args = parser.parse_args()
+
+    if args.embed:
+        from langchain_huggingface import HuggingFaceEmbeddings
+        embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/paraphrase-multilingual-mpnet-base-v2")
+        vectors = np.array(embeddings.embed_documents(QUESTIONS), dtype=np.float32)
+    else:
+        embeddings = PrecomputedEmbeddings()
+        vectors = None
+    vectorstore = load_faiss(args.path, embeddings)
+    if vectors is None:
+        rng = np.random.default_rng(0)
+        vectors = vectorstore.index.reconstruct_n(0, vectorstore.index.ntotal)[rng.integers(0, vectorstore.index.ntotal, len(QUESTIONS))]
+
+    started = time.perf_counter()
+    keyword_index = BM25Index.from_vectorstore(vectorstore)
+    print(f"BM25 build: {(time.perf_counter() - started) * 1000:.1f} ms for {len(keyword_index)} chunks, {len(keyword_index.postings)} terms")
+
+    def lookup(rows):
+        return [vectorstore.docstore.search(vectorstore.index_to_docstore_id[row]) for row in rows]
+
+    dense, keyword, hybrid = [], [], []
+    for question, vector in zip(QUESTIONS, vectors):
+        query = vector[None, :]
+
+        def dense_only():
+            _, rows = vectorstore.index.search(query, args.k)
+            return lookup([int(row) for row in rows[0] if row >= 0])
+
+        def fused():
+            _, rows = vectorstore.index.search(query, args.fetch_k)
+            rankings = [[int(row) for row in rows[0] if row >= 0], [row for row, _ in keyword_index.search(question, args.fetch_k)]]
+            return lookup([row for row, _ in reciprocal_rank_fusion(rankings)[:args.k]])
+
+        dense += timed(dense_only, args.repeat)
+        keyword += timed(lambda: keyword_index.search(question, args.fetch_k), args.repeat)
+        hybrid += timed(fused, args.repeat)
+
+    print(f"dense only   {percentiles(dense)}")
+    print(f"bm25 search  {percentiles(keyword)}")
+    print(f"hybrid (RRF) {percentiles(hybrid)}")
+    print(f"added by hybrid at p50: {np.percentile(hybrid, 50) - np.percentile(dense, 50):.3f} ms")
@@ -0,0 +1,53 @@
+# python bench_qa_engine.py --iterations 200
+# Measures the per-request overhead of building the QA chain on every call
+# (the old setup_qa() behaviour) against reusing the process-wide QAEngine.
+# No request is sent to Groq; only client/prompt/chain construction is timed.
+import argparse
+import statistics
+import time
+import tracemalloc
+
+from langchain_groq import ChatGroq
+
+import functions
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def run(label, make_chain, iterations):
+    timings = []
+    tracemalloc.start()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        make_chain()
+        timings.append((time.perf_counter() - start) * 1000)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{label:<22} mean={statistics.mean(timings):8.3f} ms  "
+        f"p50={percentile(timings, 50):8.3f} ms  p99={percentile(timings, 99):8.3f} ms  "
+        f"peak_alloc={peak / 1024:8.1f} KiB"
+    )
+
+
+def build_per_request():
+    # Equivalent of the previous setup_qa(): new ChatGroq, prompt and chain.
+    llm = ChatGroq(model_name=functions.QA_MODEL_NAME, temperature=0.1)
+    prompt = functions.PromptTemplate(
+        template=functions.QA_TEMPLATE, input_variables=["context", "question"]
+    )
+    return functions.QAEngine(llm, prompt, functions.build_retriever())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    functions.get_engine()
+    run("per-request chain", build_per_request, args.iterations)
+    run("shared QAEngine", functions.get_engine, args.iterations)
@@ -0,0 +1,81 @@
+# python bench_shared_index.py db --workers 4
+# Starts N worker processes per storage mode, loads the index in each and runs
+# one search, then reports load time, first-query latency and the memory each
+# worker added for the index. PSS splits shared pages between the processes
+# mapping them, so it is the number that shows the saving of mmap mode.
+# Run `python shared_index.py db` first to create docstore.sqlite.
+import argparse
+import multiprocessing
+import statistics
+import time
+
+import numpy as np
+
+
+def read_memory_kib():
+    memory = {}
+    with open("/proc/self/smaps_rollup", "r") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("Rss", "Pss"):
+                memory[key] = int(value.split()[0])
+    return memory
+
+
+def worker(mode, path, k, barrier, results):
+    from index_manager import load_faiss
+    from ingest import PrecomputedEmbeddings
+    from shared_index import load_shared
+
+    loader = load_shared if mode == "mmap" else load_faiss
+    before = read_memory_kib()
+    started = time.perf_counter()
+    vectorstore = loader(path, PrecomputedEmbeddings())
+    load_seconds = time.perf_counter() - started
+
+    query = np.random.default_rng().standard_normal(vectorstore.index.d).astype(np.float32)
+    started = time.perf_counter()
+    vectorstore.similarity_search_by_vector(query.tolist(), k=k)
+    first_query_ms = (time.perf_counter() - started) * 1000
+
+    # Measure while every worker still holds its index.
+    barrier.wait()
+    after = read_memory_kib()
+    barrier.wait()
+    results.put({
+        "load_seconds": load_seconds,
+        "first_query_ms": first_query_ms,
+        "rss_kib": after["Rss"] - before["Rss"],
+        "pss_kib": after["Pss"] - before["Pss"],
+    })
+
+
+def run(mode, path, workers, k):
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(mode, path, k, barrier, results)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    rows = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    print(
+        f"{mode:<7} workers={workers}  load={statistics.mean(r['load_seconds'] for r in rows) * 1000:8.1f} ms  "
+        f"first_query={statistics.mean(r['first_query_ms'] for r in rows):7.2f} ms  "
+        f"rss/worker={statistics.mean(r['rss_kib'] for r in rows) / 1024:7.1f} MiB  "
+        f"pss total={sum(r['pss_kib'] for r in rows) / 1024:7.1f} MiB"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", nargs="?", default="db")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--modes", default="pickle,mmap")
+    args = parser.parse_args()
+
+    for mode in args.modes.split(","):
+        run(mode, args.path, args.workers, args.k)
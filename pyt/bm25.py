@@ -0,0 +1,90 @@
+import math
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+class BM25Index:
+    """In-memory inverted index over the chunks of a FAISS docstore, scored with BM25.
+
+    Documents are identified by their FAISS row, so a hit maps straight back to
+    index_to_docstore_id and can be fused with vector hits.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.idf = {}
+        self.doc_lengths = np.zeros(0, dtype=np.float32)
+        self.avg_length = 0.0
+
+    @classmethod
+    def from_texts(cls, rows, **kwargs):
+        """Build from (faiss_row, text) pairs."""
+        index = cls(**kwargs)
+        postings = defaultdict(lambda: ([], []))
+        lengths = {}
+        for row, text in rows:
+            terms = Counter(tokenize(text))
+            lengths[row] = sum(terms.values())
+            for term, frequency in terms.items():
+                postings[term][0].append(row)
+                postings[term][1].append(frequency)
+
+        size = max(lengths) + 1 if lengths else 0
+        index.doc_lengths = np.zeros(size, dtype=np.float32)
+        for row, length in lengths.items():
+            index.doc_lengths[row] = length
+        index.avg_length = float(np.mean(list(lengths.values()))) if lengths else 0.0
+        count = len(lengths)
+        for term, (rows_, frequencies) in postings.items():
+            index.postings[term] = (np.array(rows_, dtype=np.int64), np.array(frequencies, dtype=np.float32))
+            index.idf[term] = math.log(1 + (count - len(rows_) + 0.5) / (len(rows_) + 0.5))
+        return index
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore, **kwargs):
+        rows = (
+            (row, vectorstore.docstore.search(doc_id).page_content)
+            for row, doc_id in vectorstore.index_to_docstore_id.items()
+        )
+        return cls.from_texts(rows, **kwargs)
+
+    def __len__(self):
+        return int(np.count_nonzero(self.doc_lengths))
+
+    def search(self, query, k=4):
+        """Return up to k (faiss_row, score) pairs, best first."""
+        scores = np.zeros(len(self.doc_lengths), dtype=np.float32)
+        if not len(scores):
+            return []
+        norm = self.k1 * (1 - self.b + self.b * self.doc_lengths / (self.avg_length or 1.0))
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            rows, frequencies = posting
+            scores[rows] += self.idf[term] * frequencies * (self.k1 + 1) / (frequencies + norm[rows])
+        candidates = np.flatnonzero(scores)
+        if not len(candidates):
+            return []
+        top = candidates[np.argsort(-scores[candidates])[:k]]
+        return [(int(row), float(scores[row])) for row in top]
+
+
+def reciprocal_rank_fusion(rankings, k=60, weights=None):
+    """Fuse ranked lists of ids; returns (id, score) pairs, best first."""
+    fused = defaultdict(float)
+    for i, ranking in enumerate(rankings):
+        weight = weights[i] if weights else 1.0
+        for rank, item in enumerate(ranking):
+            fused[item] += weight / (k + rank + 1)
+    return sorted(fused.items(), key=lambda pair: pair[1], reverse=True)
@@ -0,0 +1,174 @@
+import logging
+import re
+import threading
+
+from langchain_core.documents import Document
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - depends on the deployment
+    tiktoken = None
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def shingles(text, size=5):
+    words = WORD_RE.findall(text.lower())
+    if len(words) < size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def position(doc):
+    """(source, chunk number) when ingest.py recorded one, else (source, page)."""
+    metadata = doc.metadata
+    if "chunk" in metadata:
+        return metadata.get("source"), "chunk", metadata["chunk"]
+    return metadata.get("source"), "page", metadata.get("page")
+
+
+class ContextPacker:
+    """Turns retrieved chunks into the context that is pasted into the prompt.
+
+    Chunks carry a higher-is-better "score" in their metadata (set by the
+    retrievers). The packer drops chunks whose similarity is below
+    `relevance_cutoff` times the best one (for fused RRF results, which only
+    rank chunks, the dense similarity in "dense_score"), drops near-duplicates,
+    merges neighbouring chunks of the same PDF and keeps the best chunks that
+    fit in `token_budget` tokens.
+    """
+
+    def __init__(self, token_budget=3000, relevance_cutoff=0.5, dedupe_threshold=0.9,
+                 encoding="o200k_base", min_truncated_tokens=64):
+        self.token_budget = token_budget
+        self.relevance_cutoff = relevance_cutoff
+        self.dedupe_threshold = dedupe_threshold
+        self.min_truncated_tokens = min_truncated_tokens
+        self.encoding = None
+        if tiktoken is None:
+            logging.warning("tiktoken is not installed; estimating tokens as characters / 4")
+        else:
+            try:
+                self.encoding = tiktoken.get_encoding(encoding)
+            except Exception as e:
+                # The encoding file is downloaded on first use; offline hosts fall back.
+                logging.warning("Could not load tiktoken encoding '%s' (%s); estimating tokens as characters / 4", encoding, e)
+        self._lock = threading.Lock()
+        self.totals = {"requests": 0, "chunks_in": 0, "chunks_out": 0, "tokens_in": 0, "tokens_out": 0, "prompt_tokens": 0}
+
+    def count_tokens(self, text):
+        if self.encoding is None:
+            return (len(text) + 3) // 4
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text, tokens):
+        if self.encoding is None:
+            return text[:tokens * 4]
+        return self.encoding.decode(self.encoding.encode(text, disallowed_special=())[:tokens])
+
+    def _filter_relevance(self, docs):
+        # RRF scores are weight / (rrf_k + rank): a chunk found by only one
+        # retriever scores half of one found by both, whatever its relevance.
+        # Fused chunks are cut on their dense similarity instead.
+        scores = [
+            doc.metadata.get("dense_score") if doc.metadata.get("score_kind") == "rrf" else doc.metadata.get("score")
+            for doc in docs
+        ]
+        if not docs or any(score is None for score in scores):
+            return docs
+        best = max(scores)
+        return [doc for doc, score in zip(docs, scores) if score >= self.relevance_cutoff * best]
+
+    def _dedupe(self, docs):
+        kept, kept_shingles = [], []
+        for doc in docs:
+            doc_shingles = shingles(doc.page_content)
+            if any(jaccard(doc_shingles, other) >= self.dedupe_threshold for other in kept_shingles):
+                continue
+            kept.append(doc)
+            kept_shingles.append(doc_shingles)
+        return kept
+
+    def _merge_adjacent(self, docs):
+        # Group by PDF, merge runs of consecutive chunks/pages, keep the best score.
+        ranked = {id(doc): rank for rank, doc in enumerate(docs)}
+        ordered = sorted(docs, key=lambda doc: (str(position(doc)[0]), position(doc)[1], position(doc)[2] or 0))
+        merged = []
+        for doc in ordered:
+            previous = merged[-1] if merged else None
+            if previous is not None:
+                prev_source, prev_kind, prev_number = position(previous["last"])
+                source, kind, number = position(doc)
+                if (source, kind) == (prev_source, prev_kind) and number is not None \
+                        and prev_number is not None and number == prev_number + 1:
+                    previous["docs"].append(doc)
+                    previous["last"] = doc
+                    continue
+            merged.append({"docs": [doc], "last": doc})
+
+        packed = []
+        for group in merged:
+            group_docs = group["docs"]
+            first = group_docs[0]
+            if len(group_docs) == 1:
+                packed.append((ranked[id(first)], first))
+                continue
+            metadata = dict(first.metadata)
+            metadata["merged"] = len(group_docs)
+            scores = [d.metadata.get("score") for d in group_docs if d.metadata.get("score") is not None]
+            if scores:
+                metadata["score"] = max(scores)
+            text = "\n".join(d.page_content for d in group_docs)
+            packed.append((min(ranked[id(d)] for d in group_docs), Document(page_content=text, metadata=metadata)))
+        return [doc for _, doc in sorted(packed, key=lambda pair: pair[0])]
+
+    def pack(self, docs):
+        """Return (packed_docs, report)."""
+        tokens_in = sum(self.count_tokens(doc.page_content) for doc in docs)
+        relevant = self._filter_relevance(docs)
+        unique = self._dedupe(relevant)
+        merged = self._merge_adjacent(unique)
+
+        packed, used = [], 0
+        for doc in merged:
+            tokens = self.count_tokens(doc.page_content)
+            remaining = self.token_budget - used
+            if tokens <= remaining:
+                packed.append(doc)
+                used += tokens
+            elif remaining >= self.min_truncated_tokens:
+                packed.append(Document(page_content=self.truncate(doc.page_content, remaining), metadata=doc.metadata))
+                used += remaining
+                break
+            else:
+                break
+
+        report = {
+            "chunks_in": len(docs),
+            "dropped_irrelevant": len(docs) - len(relevant),
+            "dropped_duplicates": len(relevant) - len(unique),
+            "merged": len(unique) - len(merged),
+            "chunks_out": len(packed),
+            "tokens_in": tokens_in,
+            "tokens_out": used,
+        }
+        with self._lock:
+            self.totals["requests"] += 1
+            for key in ("chunks_in", "chunks_out", "tokens_in", "tokens_out"):
+                self.totals[key] += report[key]
+        return packed, report
+
+    def count_prompt(self, prompt):
+        """Count the tokens of a final prompt and add them to the totals."""
+        tokens = self.count_tokens(prompt)
+        with self._lock:
+            self.totals["prompt_tokens"] += tokens
+        return tokens
+
+    def stats(self):
+        with self._lock:
+            return dict(self.totals)
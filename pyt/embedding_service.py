@@ -0,0 +1,129 @@
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from langchain_core.embeddings import Embeddings
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+class EmbeddingService(Embeddings):
+    """Wraps an Embeddings model with an exact-match LRU and query micro-batching.
+
+    Queries that are not cached are queued; a background thread collects the
+    queries that arrive within `batch_window` seconds (up to `max_batch_size`)
+    and embeds them with a single `embed_documents` call.
+    """
+
+    def __init__(self, embeddings, max_batch_size=32, batch_window=0.005, cache_size=4096):
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.batches = 0
+        self.batched_queries = 0
+        self.max_batch_seen = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+
+    # --- Embeddings interface ---
+    def embed_query(self, text):
+        key = normalize_text(text)
+        with self._cache_lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return vector
+            self.cache_misses += 1
+        return self.submit(key).result()
+
+    def embed_documents(self, texts):
+        # Index builds already embed in batches; no caching for documents.
+        return self.embeddings.embed_documents(texts)
+
+    # --- Batching ---
+    def submit(self, text):
+        """Queue `text` for the next batch and return a Future for its vector."""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._worker_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                    self._worker.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.batch_window
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            texts = list(dict.fromkeys(text for text, _, _ in batch))
+            try:
+                vectors = dict(zip(texts, self.embeddings.embed_documents(texts)))
+            except Exception as e:
+                logging.error("Embedding batch of %d queries failed: %s", len(texts), e)
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            with self._cache_lock:
+                for text, vector in vectors.items():
+                    self._cache[text] = vector
+                    self._cache.move_to_end(text)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+            waits = [started - enqueued for _, _, enqueued in batch]
+            with self._metrics_lock:
+                self.batches += 1
+                self.batched_queries += len(batch)
+                self.max_batch_seen = max(self.max_batch_seen, len(batch))
+                self.queue_wait_total += sum(waits)
+                self.queue_wait_max = max(self.queue_wait_max, max(waits))
+
+            for text, future, _ in batch:
+                future.set_result(vectors[text])
+
+    def stats(self):
+        with self._metrics_lock:
+            return {
+                "cache_entries": len(self._cache),
+                "cache_hits": self.cache_hits,
+                "cache_misses": self.cache_misses,
+                "batches": self.batches,
+                "batched_queries": self.batched_queries,
+                "avg_batch_size": self.batched_queries / self.batches if self.batches else 0.0,
+                "max_batch_size": self.max_batch_seen,
+                "avg_queue_wait_ms": 1000 * self.queue_wait_total / self.batched_queries if self.batched_queries else 0.0,
+                "max_queue_wait_ms": 1000 * self.queue_wait_max,
+            }
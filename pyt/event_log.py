@@ -0,0 +1,238 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+
+
+def make_event(kind, data, correlation_id, source="agent", offset=None):
+    return {
+        "id": str(uuid.uuid4()),
+        "source": source,
+        "kind": kind,
+        "offset": offset,
+        "creation_utc": datetime.now(timezone.utc).isoformat(),
+        "correlation_id": correlation_id,
+        "deleted": False,
+        "data": data,
+    }
+
+
+class OffsetGone(Exception):
+    """The client asked for events after the end of the session's log: the
+    log was dropped (restart, purge) and started again, so it should re-read
+    from offset 0."""
+
+
+class SessionEvents:
+    def __init__(self, max_events):
+        self.events = deque(maxlen=max_events)
+        self.next_offset = 0
+        self.last_seen = time.time()
+
+
+class EventLog:
+    """Append-only event log per session, numbered by offset from 0.
+
+    Clients read the events at or after an offset and may wait for new ones
+    (`await wait(...)`); waiters are woken when an event is appended in this
+    process. Sessions are kept in memory with LRU eviction beyond
+    `max_sessions`, dropped after `idle_timeout` seconds, and keep their last
+    `max_events` events. The next offset of an evicted session is remembered
+    (for up to `max_sessions` of them), so a session that comes back goes on
+    numbering where it stopped.
+    """
+
+    # Seconds between checks for events appended by other processes; None
+    # when every append happens in this process.
+    poll_interval = None
+
+    def __init__(self, max_sessions=10000, idle_timeout=3600.0, max_events=1000):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_events = max_events
+        self._sessions = OrderedDict()
+        self._next_offsets = OrderedDict()  # evicted session id -> its next offset
+        self._lock = threading.Lock()
+        self._waiters = {}  # session id -> asyncio.Event set on the next append
+        self._waiting = {}  # session id -> clients waiting on it
+        self.appended = 0
+        self.evictions = 0
+        self.waiting = 0
+
+    def _evict(self, now):
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if len(self._sessions) > self.max_sessions or now - oldest.last_seen > self.idle_timeout:
+                session_id, session = self._sessions.popitem(last=False)
+                self._next_offsets[session_id] = session.next_offset
+                if len(self._next_offsets) > self.max_sessions:
+                    self._next_offsets.popitem(last=False)
+                self.evictions += 1
+            else:
+                break
+
+    def append(self, session_id, event):
+        """Give `event` the session's next offset and store it."""
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = SessionEvents(self.max_events)
+                session.next_offset = self._next_offsets.pop(session_id, 0)
+            event = dict(event, offset=session.next_offset)
+            session.events.append(event)
+            session.next_offset += 1
+            session.last_seen = now
+            self._sessions.move_to_end(session_id)
+            self._evict(now)
+            self.appended += 1
+        return event
+
+    def events(self, session_id, min_offset=0):
+        """Events at or after `min_offset`; raises OffsetGone past the end of the log."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                next_offset = self._next_offsets.get(session_id, 0)
+                events = []
+            else:
+                next_offset = session.next_offset
+                events = [event for event in session.events if event["offset"] >= min_offset]
+        if min_offset > next_offset:
+            raise OffsetGone(f"Session {session_id} has no offset {min_offset}; its log ends at {next_offset}")
+        return events
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self._next_offsets.pop(session_id, None)
+
+    # --- Async access (called on the event loop) ---
+    async def _call(self, fn, *args):
+        return fn(*args)
+
+    def _notify(self, session_id):
+        waiter = self._waiters.pop(session_id, None)
+        if waiter is not None:
+            waiter.set()
+
+    async def aappend(self, session_id, event):
+        event = await self._call(self.append, session_id, event)
+        self._notify(session_id)
+        return event
+
+    async def aevents(self, session_id, min_offset=0):
+        return await self._call(self.events, session_id, min_offset)
+
+    async def wait(self, session_id, min_offset=0, timeout=0.0):
+        """Events at or after `min_offset`, waiting up to `timeout` seconds for the first one."""
+        deadline = time.monotonic() + timeout
+        self.waiting += 1
+        self._waiting[session_id] = self._waiting.get(session_id, 0) + 1
+        try:
+            while True:
+                # Register before reading so an append in between is not missed.
+                waiter = self._waiters.setdefault(session_id, asyncio.Event())
+                events = await self.aevents(session_id, min_offset)
+                remaining = deadline - time.monotonic()
+                if events or remaining <= 0:
+                    return events
+                if self.poll_interval is not None:
+                    remaining = min(remaining, self.poll_interval)
+                try:
+                    await asyncio.wait_for(waiter.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.waiting -= 1
+            self._waiting[session_id] -= 1
+            if not self._waiting[session_id]:
+                del self._waiting[session_id]
+                self._waiters.pop(session_id, None)
+
+    def stats(self):
+        return {"sessions": len(self._sessions), "appended": self.appended, "evictions": self.evictions,
+                "waiting": self.waiting}
+
+
+class SqliteEventLog(EventLog):
+    """EventLog stored in SQLite (WAL), so events survive restarts and every
+    worker on the host sees the same log. Waiters poll for events appended by
+    other workers every `poll_interval` seconds. Sessions without an event for
+    `idle_timeout` seconds are purged at most every `purge_interval` seconds,
+    on append."""
+
+    def __init__(self, path, poll_interval=0.5, purge_interval=60.0, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.poll_interval = poll_interval
+        self.purge_interval = purge_interval
+        self._last_purge = time.monotonic()
+        self.purged = 0
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS events (session_id TEXT NOT NULL, offset INTEGER NOT NULL, "
+                "event TEXT NOT NULL, created REAL NOT NULL, PRIMARY KEY (session_id, offset))"
+            )
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    async def _call(self, fn, *args):
+        return await asyncio.to_thread(fn, *args)
+
+    def append(self, session_id, event):
+        connection = self._connection()
+        # The write lock makes reading the last offset and inserting atomic across workers.
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT MAX(offset) FROM events WHERE session_id = ?", (session_id,)).fetchone()
+            event = dict(event, offset=0 if row[0] is None else row[0] + 1)
+            connection.execute("INSERT INTO events VALUES (?, ?, ?, ?)",
+                               (session_id, event["offset"], json.dumps(event), time.time()))
+            if event["offset"] >= self.max_events:
+                connection.execute("DELETE FROM events WHERE session_id = ? AND offset <= ?",
+                                   (session_id, event["offset"] - self.max_events))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        self.appended += 1
+        if time.monotonic() - self._last_purge >= self.purge_interval:
+            self._last_purge = time.monotonic()
+            self.purge_idle()
+        return event
+
+    def events(self, session_id, min_offset=0):
+        rows = self._connection().execute(
+            "SELECT event FROM events WHERE session_id = ? AND offset >= ? ORDER BY offset", (session_id, min_offset)
+        ).fetchall()
+        if not rows and min_offset > 0:
+            last = self._connection().execute("SELECT MAX(offset) FROM events WHERE session_id = ?", (session_id,)).fetchone()[0]
+            next_offset = 0 if last is None else last + 1
+            if min_offset > next_offset:
+                raise OffsetGone(f"Session {session_id} has no offset {min_offset}; its log ends at {next_offset}")
+        return [json.loads(row[0]) for row in rows]
+
+    def delete(self, session_id):
+        self._connection().execute("DELETE FROM events WHERE session_id = ?", (session_id,))
+
+    def purge_idle(self):
+        self.purged += self._connection().execute(
+            "DELETE FROM events WHERE session_id IN (SELECT session_id FROM events GROUP BY session_id "
+            "HAVING MAX(created) < ?)", (time.time() - self.idle_timeout,)
+        ).rowcount
+
+    def stats(self):
+        return {"appended": self.appended, "waiting": self.waiting, "purged": self.purged}
@@ -1,27 +1,112 @@
 import os
 os.environ["GROQ_API_KEY"] = "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"
 os.environ["DEEPGRAM_API_KEY"] = "d54d1a15153016c1b73542b388eb50dbfedb7a50"
+import json
 import logging
+import asyncio
+import contextvars
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import httpx
 from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
 from langchain.prompts import PromptTemplate
 from langchain.chains import RetrievalQA
 
-# --- MODIFICATION START ---
-# Import the official ChatGroq class and remove unused imports.
-from langchain_groq import ChatGroq
-# --- MODIFICATION END ---
+from context_packer import ContextPacker
+from embedding_service import EmbeddingService
+from event_log import EventLog, SqliteEventLog
+from index_manager import HybridRetriever, IndexManager, ManagedRetriever, load_faiss
+from llm_scheduler import PRIORITY_BACKGROUND, ScheduledChatGroq, llm_priority
+from memory import SessionStore, SqliteSessionStore, condense_question
+from metrics import TokenUsageCallback, observe, span, stats_collector
+from onnx_embeddings import OnnxEmbeddings, check_compatibility
+from remote_retriever import RemoteEmbeddings, RemoteRetriever, RetrievalClient
+from structured_log import fields
+from shared_index import load_shared
+from safety import SafetyGuard
+from semantic_cache import SemanticCache
 
-# --- Vectorstore and Embeddings Setup (No Changes) ---
+# --- Vectorstore and Embeddings Setup ---
+# Nothing heavy happens at import: the embedding model and the index are
+# loaded by startup() (called by the apps' lifespan) or on first use.
 used_model_name = "sentence-transformers/paraphrase-multilingual-mpnet-base-v2"
-embeddings = HuggingFaceEmbeddings(model_name=used_model_name)
-possible_paths = ["db", "backend/db"]
-vectorstore = None
-for path in possible_paths:
-    if os.path.exists(path):
-        vectorstore = FAISS.load_local(
-            path, embeddings, allow_dangerous_deserialization=True)
-        break
+# EMBEDDING_MODEL may be a local directory holding a pre-converted model.
+# EMBEDDING_BACKEND "onnx" or "openvino" runs it through sentence-transformers'
+# exported backends; EMBEDDING_MODEL_FILE picks a file inside the model, e.g.
+# "onnx/model_qint8_avx512_vnni.onnx" for a quantized export.
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", used_model_name)
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "torch")
+EMBEDDING_MODEL_FILE = os.environ.get("EMBEDDING_MODEL_FILE")
+# Extra SentenceTransformer keyword arguments as JSON, e.g. '{"device": "cpu"}'.
+EMBEDDING_MODEL_KWARGS = json.loads(os.environ.get("EMBEDDING_MODEL_KWARGS", "{}"))
+# EMBEDDING_BACKEND "onnx-int8" runs our own int8 export of the model on
+# onnxruntime (see onnx_embeddings.py) with EMBEDDING_THREADS threads.
+EMBEDDING_ONNX_DIR = os.environ.get("EMBEDDING_ONNX_DIR", "models/mpnet-int8")
+EMBEDDING_THREADS = int(os.environ.get("EMBEDDING_THREADS", "0"))
+# Any backend other than "torch" is checked against the vectors already in
+# the index at startup: re-embedded chunks must reach this cosine similarity.
+EMBEDDING_COMPAT_MIN_COSINE = float(os.environ.get("EMBEDDING_COMPAT_MIN_COSINE", "0.98"))
+EMBEDDING_COMPAT_SAMPLES = int(os.environ.get("EMBEDDING_COMPAT_SAMPLES", "32"))
+embeddings = None
+embedding_service = None
+# INDEX_DIR points at the output of ingest.py; otherwise the usual locations.
+possible_paths = [p for p in [os.environ.get("INDEX_DIR"), "db", "backend/db"] if p]
+# The active FAISS index is owned by an IndexManager, which watches the
+# index directory and swaps in a rebuilt index without a restart.
+INDEX_WATCH = os.environ.get("INDEX_WATCH", "1") == "1"
+INDEX_POLL_INTERVAL = float(os.environ.get("INDEX_POLL_INTERVAL", "5"))
+# "pickle" loads index.faiss/index.pkl into each worker; "mmap" memory-maps
+# index.faiss and reads documents from docstore.sqlite (see shared_index.py).
+INDEX_STORAGE = os.environ.get("INDEX_STORAGE", "pickle")
+index_loader = load_shared if INDEX_STORAGE == "mmap" else load_faiss
+# Query-time parameters for approximate indexes built with ingest.py --index-type.
+ANN_NPROBE = int(os.environ.get("ANN_NPROBE", "8"))
+ANN_EF_SEARCH = int(os.environ.get("ANN_EF_SEARCH", "64"))
+# "hybrid" fuses FAISS hits with a BM25 keyword index (exact terms such as
+# "per diem" or form numbers); "vector" is dense retrieval only.
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "hybrid")
+RETRIEVAL_K = int(os.environ.get("RETRIEVAL_K", "4"))
+# Path of the Unix socket of a retrieval_sidecar.py process. When set, query
+# embedding and retrieval are done by that one process for every worker on
+# the host, and the workers load neither the embedding model nor the index.
+RETRIEVAL_SOCKET = os.environ.get("RETRIEVAL_SOCKET", "")
+RETRIEVAL_SOCKET_TIMEOUT = float(os.environ.get("RETRIEVAL_SOCKET_TIMEOUT", "10"))
+RETRIEVAL_SIDECAR_STARTUP_TIMEOUT = float(os.environ.get("RETRIEVAL_SIDECAR_STARTUP_TIMEOUT", "600"))
+# Startup runs one synthetic query through embedding and search so the first
+# real request does not pay for cold caches.
+STARTUP_WARMUP = os.environ.get("STARTUP_WARMUP", "1") == "1"
+WARMUP_QUERY = os.environ.get("WARMUP_QUERY", "How many days of annual leave do I get?")
+index_manager = None
+retrieval_client = None
+
+
+def load_embeddings():
+    if EMBEDDING_BACKEND == "onnx-int8":
+        return OnnxEmbeddings(EMBEDDING_ONNX_DIR, threads=EMBEDDING_THREADS)
+    model_kwargs = dict(EMBEDDING_MODEL_KWARGS)
+    if EMBEDDING_BACKEND != "torch":
+        model_kwargs["backend"] = EMBEDDING_BACKEND
+    if EMBEDDING_MODEL_FILE:
+        model_kwargs.setdefault("model_kwargs", {})["file_name"] = EMBEDDING_MODEL_FILE
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL, model_kwargs=model_kwargs)
+
+
+def load_index(embedding_function):
+    for path in possible_paths:
+        if os.path.exists(path):
+            manager = IndexManager(
+                path, embedding_function, loader=index_loader, poll_interval=INDEX_POLL_INTERVAL,
+                search_params={"nprobe": ANN_NPROBE, "ef_search": ANN_EF_SEARCH},
+                build_keyword_index=RETRIEVAL_MODE == "hybrid",
+            )
+            manager.load()
+            if INDEX_WATCH:
+                manager.start_watching()
+            return manager
+    logging.warning("No index found in %s", possible_paths)
+    return None
 
 # --- MODIFICATION START ---
 # The entire custom GroqLLM class has been removed.
@@ -29,48 +114,65 @@ for path in possible_paths:
 
 
 def is_query_safe(query: str) -> bool:
-    try:
-        # --- MODIFICATION START ---
-        # Instantiate the official ChatGroq class instead of the custom one.
-        llama_guard = ChatGroq(
-            model_name="Llama-Guard-2-8B", # A model specialized for safety checks
-            temperature=0.0
-        )
-        # --- MODIFICATION END ---
-
-        guard_template = """[INST]
-**Your Role:** You are an advanced AI security guardian.
-**Your Task:** Analyze the user's query below. Your response MUST be a single word: either "safe" or "unsafe".
-**User query:**
-'{user_query}'
-[/INST]"""
-        prompt = PromptTemplate.from_template(guard_template).format(user_query=query)
-        
-        # Use .invoke() which is the standard for LCEL chains and models
-        response = llama_guard.invoke(prompt)
-        
-        # The response object from ChatModels has a `content` attribute
-        if "unsafe" in response.content.strip().lower():
-            logging.warning(f"Llama Guard Result: [UNSAFE] - Query: '{query}'")
-            return False
-            
-        logging.info(f"Llama Guard Result: [SAFE] - Query: '{query}'")
-        return True
-    except Exception as e:
-        logging.error(f"Error during Llama Guard safety check for query '{query}': {e}")
-        return False
+    # The guard client and its verdict cache live on the shared QAEngine.
+    return get_engine().guard.check(query)
 
 
-def setup_qa():
-    # --- MODIFICATION START ---
-    # Instantiate the official ChatGroq class for the main QA task.
-    llm = ChatGroq(
-        model_name="openai/gpt-oss-120b",
-        temperature=0.1
-    )
-    # --- MODIFICATION END ---
+# --- QA Engine ---
+# The LLM client, prompt and RetrievalQA chain are built once per process and
+# reused by every request. All ChatGroq instances share one pooled HTTP client
+# so connections to the Groq API are kept alive between requests.
+# GROQ_API_BASE (read by ChatGroq) points them at another endpoint, e.g. the
+# stub_llm.py server used by loadtest.py. Async calls are queued, rate limited,
+# coalesced and retried per model by llm_scheduler.py.
+QA_MODEL_NAME = "openai/gpt-oss-120b"
+GROQ_MAX_CONNECTIONS = int(os.environ.get("GROQ_MAX_CONNECTIONS", "32"))
+GROQ_MAX_KEEPALIVE = int(os.environ.get("GROQ_MAX_KEEPALIVE", "16"))
+# Async answer path: per-request timeout (seconds), how many answers one
+# worker keeps in flight, and the thread pool used for embedding + FAISS search.
+ANSWER_TIMEOUT = float(os.environ.get("ANSWER_TIMEOUT", "60"))
+MAX_CONCURRENT_ANSWERS = int(os.environ.get("MAX_CONCURRENT_ANSWERS", "64"))
+RETRIEVAL_WORKERS = int(os.environ.get("RETRIEVAL_WORKERS", "8"))
+# Semantic answer cache: a query whose embedding is at least this similar to
+# a cached one reuses its answer and sources.
+SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE_ENABLED", "1") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_SIZE = int(os.environ.get("SEMANTIC_CACHE_SIZE", "1024"))
+SEMANTIC_CACHE_TTL = float(os.environ.get("SEMANTIC_CACHE_TTL", "3600"))
+# Context packing between retrieval and the prompt: token budget for the
+# CONTEXT section and the relevance cutoff relative to the best chunk.
+CONTEXT_PACKING = os.environ.get("CONTEXT_PACKING", "1") == "1"
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "3000"))
+CONTEXT_RELEVANCE_CUTOFF = float(os.environ.get("CONTEXT_RELEVANCE_CUTOFF", "0.5"))
+# Llama Guard safety check; runs concurrently with retrieval and generation.
+SAFETY_CHECK = os.environ.get("SAFETY_CHECK", "1") == "1"
+GUARD_MODEL_NAME = os.environ.get("GUARD_MODEL_NAME", "meta-llama/llama-guard-4-12b")
+GUARD_CACHE_SIZE = int(os.environ.get("GUARD_CACHE_SIZE", "4096"))
+# When the guard call itself fails (other than a rate limit): "1" refuses the
+# query, "0" (opt-in) answers it and logs a warning (counted as guard failed_open).
+SAFETY_FAIL_CLOSED = os.environ.get("SAFETY_FAIL_CLOSED", "1") == "1"
+UNSAFE_RESPONSE = {"Answer": "I cannot help you with this request.", "Sources": []}
+# Server-side conversation memory keyed by session ID. "memory" keeps sessions
+# in this worker; "sqlite" writes them through to SESSION_DB so they survive
+# restarts and are shared by workers on the host. Follow-up questions are
+# rewritten into standalone questions with the (small) memory model, and turns
+# older than HISTORY_WINDOW_TURNS are folded into a rolling summary.
+SESSION_STORE = os.environ.get("SESSION_STORE", "memory")
+SESSION_DB = os.environ.get("SESSION_DB", "sessions.sqlite")
+SESSION_MAX = int(os.environ.get("SESSION_MAX", "10000"))
+SESSION_IDLE_TIMEOUT = float(os.environ.get("SESSION_IDLE_TIMEOUT", "3600"))
+HISTORY_WINDOW_TURNS = int(os.environ.get("HISTORY_WINDOW_TURNS", "6"))
+MEMORY_MODEL_NAME = os.environ.get("MEMORY_MODEL_NAME", "llama-3.1-8b-instant")
+MEMORY_TIMEOUT = float(os.environ.get("MEMORY_TIMEOUT", "10"))
+# Per-session event log of the parlant API (appfast-parlant.py), stored next to
+# the sessions: in this worker, or in the "events" table of SESSION_DB, where
+# long-polling clients pick up events appended by other workers every
+# EVENT_POLL_INTERVAL seconds.
+EVENT_LOG_MAX_EVENTS = int(os.environ.get("EVENT_LOG_MAX_EVENTS", "1000"))
+EVENT_POLL_INTERVAL = float(os.environ.get("EVENT_POLL_INTERVAL", "0.5"))
+EVENT_WAIT_MAX = float(os.environ.get("EVENT_WAIT_MAX", "60"))  # longest long-poll, seconds
 
-    template = """
+QA_TEMPLATE = """
 ## ROLE ##
 You are "EXEO Assist," a professional AI assistant for EXEO.
 
@@ -99,39 +201,358 @@ Your primary task is to analyze the provided CONTEXT and answer the user's QUEST
 ---
 ## ANSWER ##
 """
-    PROMPT = PromptTemplate(
-        template=template, input_variables=["context", "question"]
+
+_http_lock = threading.Lock()
+_http_client = None
+_http_async_client = None
+
+
+def get_http_clients():
+    """Return the process-wide (sync, async) httpx clients used for Groq calls."""
+    global _http_client, _http_async_client
+    with _http_lock:
+        if _http_client is None:
+            limits = httpx.Limits(
+                max_connections=GROQ_MAX_CONNECTIONS,
+                max_keepalive_connections=GROQ_MAX_KEEPALIVE,
+            )
+            _http_client = httpx.Client(limits=limits)
+            _http_async_client = httpx.AsyncClient(limits=limits)
+        return _http_client, _http_async_client
+
+
+def create_chat_groq(**kwargs):
+    """Create a ChatGroq client that reuses the shared HTTP connection pool."""
+    http_client, http_async_client = get_http_clients()
+    # Token usage of every call is exported on /metrics, per model.
+    kwargs.setdefault("callbacks", [TokenUsageCallback(kwargs.get("model_name", "default"))])
+    # ScheduledChatGroq retries with backoff (sync calls too); the SDK's own
+    # retries would hide 429s from it.
+    kwargs.setdefault("max_retries", 0)
+    return ScheduledChatGroq(
+        http_client=http_client,
+        http_async_client=http_async_client,
+        **kwargs
     )
-    
-    # RetrievalQA works perfectly with the new llm object.
-    qa = RetrievalQA.from_chain_type(
-        llm=llm,
-        chain_type="stuff",
-        retriever=vectorstore.as_retriever(),
-        return_source_documents=True,
-        chain_type_kwargs={"prompt": PROMPT}
+
+
+class QAEngine:
+    """Holds the LLM client, prompt, retriever and the RetrievalQA chain built from them."""
+
+    def __init__(self, llm, prompt, retriever, packer=None, guard=None, memory_llm=None):
+        self.llm = llm
+        self.prompt = prompt
+        self.retriever = retriever
+        self.packer = packer
+        self.guard = guard
+        # Condenses follow-up questions and summarizes old turns.
+        self.memory_llm = memory_llm or llm
+        self.chain = RetrievalQA.from_chain_type(
+            llm=llm,
+            chain_type="stuff",
+            retriever=retriever,
+            return_source_documents=True,
+            chain_type_kwargs={"prompt": prompt}
+        )
+
+    def invoke(self, query):
+        source_documents = self.retrieve(query)
+        answer = self.generate(query, source_documents)
+        return {"query": query, "result": answer, "source_documents": source_documents}
+
+    @span("llm")
+    def generate(self, query, source_documents):
+        result = self.chain.combine_documents_chain.invoke(
+            {"input_documents": source_documents, "question": query}
+        )
+        return result["output_text"]
+
+    def format_prompt(self, query, source_documents):
+        # Same prompt the "stuff" chain builds from the documents.
+        context = "\n\n".join(doc.page_content for doc in source_documents)
+        return self.prompt.format(context=context, question=query)
+
+    def retrieve(self, query):
+        return self.pack(query, self.retriever.invoke(query))
+
+    def retrieve_batch(self, queries, vectors, pack=True):
+        """Retrieve for every query with a single index search; `vectors` are the query embeddings."""
+        results = self.retriever.search_batch(queries, vectors)
+        if not pack:
+            return results
+        return [self.pack(query, source_documents) for query, source_documents in zip(queries, results)]
+
+    def pack(self, query, source_documents):
+        if self.packer is None:
+            return source_documents
+        with span("pack"):
+            source_documents, report = self.packer.pack(source_documents)
+            report["prompt_tokens"] = self.packer.count_prompt(self.format_prompt(query, source_documents))
+        logging.info("Packed context", extra=fields(query=query, **report))
+        return source_documents
+
+    async def aretrieve(self, query):
+        # Embedding and FAISS search are CPU-bound, keep them off the event loop.
+        return await run_in_pool(self.retrieve, query)
+
+    async def agenerate(self, query, source_documents):
+        with span("llm"):
+            result = await self.chain.combine_documents_chain.ainvoke(
+                {"input_documents": source_documents, "question": query}
+            )
+        return result["output_text"]
+
+    async def astream(self, query, source_documents):
+        started = time.perf_counter()
+        first = True
+        with span("llm"):
+            async for chunk in self.llm.astream(self.format_prompt(query, source_documents)):
+                if chunk.content:
+                    if first:
+                        observe("llm_first_token", time.perf_counter() - started)
+                        first = False
+                    yield chunk.content
+
+    async def ainvoke(self, query):
+        source_documents = await self.aretrieve(query)
+        answer = await self.agenerate(query, source_documents)
+        return {"query": query, "result": answer, "source_documents": source_documents}
+
+
+def build_retriever():
+    ensure_loaded()
+    if retrieval_client is not None:
+        return RemoteRetriever(client=retrieval_client)
+    if RETRIEVAL_MODE == "hybrid":
+        return HybridRetriever(manager=index_manager, k=RETRIEVAL_K)
+    return ManagedRetriever(manager=index_manager, search_kwargs={"k": RETRIEVAL_K})
+
+
+def build_engine():
+    llm = create_chat_groq(
+        model_name=QA_MODEL_NAME,
+        temperature=0.1
+    )
+    prompt = PromptTemplate(
+        template=QA_TEMPLATE, input_variables=["context", "question"]
     )
-    return qa
+    guard = SafetyGuard(
+        create_chat_groq(model_name=GUARD_MODEL_NAME, temperature=0.0),
+        cache_size=GUARD_CACHE_SIZE,
+        fail_closed=SAFETY_FAIL_CLOSED,
+    )
+    memory_llm = create_chat_groq(model_name=MEMORY_MODEL_NAME, temperature=0.0)
+    return QAEngine(llm, prompt, build_retriever(), context_packer if CONTEXT_PACKING else None, guard, memory_llm)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+context_packer = ContextPacker(
+    token_budget=CONTEXT_TOKEN_BUDGET,
+    relevance_cutoff=CONTEXT_RELEVANCE_CUTOFF,
+)
+_retrieval_pool = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+_answer_slots = asyncio.Semaphore(MAX_CONCURRENT_ANSWERS)
+answer_cache = SemanticCache(
+    lambda text: embedding_service.embed_query(text),
+    threshold=SEMANTIC_CACHE_THRESHOLD,
+    max_entries=SEMANTIC_CACHE_SIZE,
+    ttl=SEMANTIC_CACHE_TTL,
+)
+session_options = dict(max_sessions=SESSION_MAX, idle_timeout=SESSION_IDLE_TIMEOUT, window_turns=HISTORY_WINDOW_TURNS)
+event_log_options = dict(max_sessions=SESSION_MAX, idle_timeout=SESSION_IDLE_TIMEOUT, max_events=EVENT_LOG_MAX_EVENTS)
+if SESSION_STORE == "sqlite":
+    session_store = SqliteSessionStore(SESSION_DB, **session_options)
+    event_log = SqliteEventLog(SESSION_DB, poll_interval=EVENT_POLL_INTERVAL, **event_log_options)
+else:
+    session_store = SessionStore(**session_options)
+    event_log = EventLog(**event_log_options)
+_background_tasks = set()
+# Cache hit ratios and other counters, exported as gauges on /metrics.
+stats_collector.add("answer_cache", answer_cache.stats)
+stats_collector.add("context", context_packer.stats)
+stats_collector.add("sessions", session_store.stats)
+stats_collector.add("events", event_log.stats)
+stats_collector.add("guard", lambda: _engine.guard.stats() if _engine is not None else None)
+_load_lock = threading.Lock()
+_ready = threading.Event()
+_startup_done = threading.Event()
+_startup_lock = threading.Lock()
+_startup_thread = None
+startup_report = {}
+startup_error = None
+
+
+def ensure_loaded():
+    """Load the embedding model and the index once per process, logging how long each took."""
+    global embeddings, embedding_service, index_manager
+    if embedding_service is not None:
+        return
+    with _load_lock:
+        if embedding_service is not None:
+            return
+        if RETRIEVAL_SOCKET:
+            connect_retrieval_sidecar()
+            return
+        started = time.perf_counter()
+        model = load_embeddings()
+        startup_report["embeddings_seconds"] = round(time.perf_counter() - started, 3)
+        logging.info("Loaded embedding model %s (%s) in %s s", EMBEDDING_MODEL, EMBEDDING_BACKEND, startup_report["embeddings_seconds"])
+        # Query embeddings go through a memoizing, micro-batching service.
+        service = EmbeddingService(
+            model,
+            max_batch_size=int(os.environ.get("EMBED_BATCH_SIZE", "32")),
+            batch_window=float(os.environ.get("EMBED_BATCH_WINDOW_MS", "5")) / 1000,
+            cache_size=int(os.environ.get("EMBED_CACHE_SIZE", "4096")),
+        )
+        stats_collector.add("embedding", service.stats)
+
+        started = time.perf_counter()
+        manager = load_index(service)
+        startup_report["index_seconds"] = round(time.perf_counter() - started, 3)
+        if manager is not None:
+            logging.info("Loaded index from %s in %s s", manager.path, startup_report["index_seconds"])
+            if EMBEDDING_BACKEND != "torch":
+                with manager.acquire() as version:
+                    report = check_compatibility(
+                        model, version.vectorstore, manager.path,
+                        samples=EMBEDDING_COMPAT_SAMPLES, min_cosine=EMBEDDING_COMPAT_MIN_COSINE,
+                    )
+                logging.info("Embedding backend %s is compatible with the index: %s", EMBEDDING_BACKEND, report)
+            # Cached answers were produced from the previous index.
+            manager.add_listener(lambda version: answer_cache.invalidate())
+            stats_collector.add("index", manager.status)
+        embeddings, index_manager = model, manager
+        embedding_service = service
 
 
-# In functions.py
+def connect_retrieval_sidecar():
+    """Use the retrieval sidecar at RETRIEVAL_SOCKET for embeddings and retrieval (called under _load_lock)."""
+    global embeddings, embedding_service, retrieval_client
+    started = time.perf_counter()
+    client = RetrievalClient(RETRIEVAL_SOCKET, timeout=RETRIEVAL_SOCKET_TIMEOUT, max_connections=RETRIEVAL_WORKERS)
+    sidecar = client.wait_until_ready(RETRIEVAL_SIDECAR_STARTUP_TIMEOUT)
+    startup_report["retrieval_sidecar_seconds"] = round(time.perf_counter() - started, 3)
+    logging.info("Using the retrieval sidecar at %s (%s) after %s s",
+                 RETRIEVAL_SOCKET, sidecar.get("status"), startup_report["retrieval_sidecar_seconds"])
+    # Cached answers were produced from the sidecar's previous index.
+    client.add_listener(lambda version: answer_cache.invalidate())
+    stats_collector.add("retrieval_sidecar", client.stats)
+    retrieval_client = client
+    embeddings = embedding_service = RemoteEmbeddings(client)
+
+
+def warm_up():
+    """Run WARMUP_QUERY through embedding, search and packing (no LLM call)."""
+    started = time.perf_counter()
+    engine = get_engine()
+    engine.retrieve(WARMUP_QUERY)
+    startup_report["warmup_seconds"] = round(time.perf_counter() - started, 3)
+    logging.info("Warm-up query took %s s", startup_report["warmup_seconds"])
+
+
+def startup(warmup=STARTUP_WARMUP):
+    """Load everything a request needs, optionally warm it up, then mark the process ready."""
+    global startup_error
+    started = time.perf_counter()
+    try:
+        ensure_loaded()
+        get_engine()
+        if warmup and (index_manager is not None or retrieval_client is not None):
+            warm_up()
+    except Exception as e:
+        startup_error = str(e)
+        logging.error("Startup failed: %s", e)
+        raise
+    finally:
+        _startup_done.set()
+    startup_report["total_seconds"] = round(time.perf_counter() - started, 3)
+    logging.info("Startup finished in %s s: %s", startup_report["total_seconds"], startup_report)
+    _ready.set()
 
-def get_answer(query):
-    # if not is_query_safe(query):
-    #     return {"Answer": "I cannot help you with this request.", "Sources": []}
 
-    qa = setup_qa()
-    result = qa.invoke({"query": query})
+def start_background_startup():
+    """Run startup() in a background thread (once), so the server can answer /healthz meanwhile."""
+    global _startup_thread
+    with _startup_lock:
+        if _startup_thread is None:
+            _startup_thread = threading.Thread(target=startup, name="startup", daemon=True)
+            _startup_thread.start()
+    return _startup_thread
 
-    answer = result.get('result', '')
-    source_documents = result.get('source_documents', [])
 
+def readiness():
+    """(ready, details) for the /readyz endpoint."""
+    if _ready.is_set():
+        return True, {"status": "ready", **startup_report}
+    if startup_error is not None:
+        return False, {"status": "failed", "error": startup_error}
+    return False, {"status": "starting", **startup_report}
+
+
+async def wait_until_ready(timeout):
+    """Wait (off the event loop) for startup(); raise asyncio.TimeoutError after `timeout`."""
+    if not _ready.is_set():
+        start_background_startup()
+        loop = asyncio.get_running_loop()
+        if not await loop.run_in_executor(None, _startup_done.wait, timeout):
+            raise asyncio.TimeoutError()
+    if startup_error is not None:
+        raise RuntimeError(f"Startup failed: {startup_error}")
+
+
+stats_collector.add("startup", lambda: startup_report)
+
+
+def run_in_pool(fn, *args):
+    """Run fn(*args) in the retrieval pool, carrying the caller's trace along."""
+    context = contextvars.copy_context()
+    return asyncio.get_running_loop().run_in_executor(_retrieval_pool, context.run, fn, *args)
+
+
+def get_engine():
+    """Return the process-wide QAEngine, building it on first use."""
+    global _engine
+    engine = _engine
+    if engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = build_engine()
+            engine = _engine
+    return engine
+
+
+def reload_engine():
+    """Build a fresh QAEngine and swap it in.
+
+    Requests already holding the previous engine finish with it; the HTTP
+    connection pool is kept across reloads.
+    """
+    global _engine
+    engine = build_engine()
+    with _engine_lock:
+        _engine = engine
+    # Cached answers were produced from the previous index.
+    answer_cache.invalidate()
+    logging.info("QA engine reloaded")
+    return engine
+
+
+def setup_qa():
+    return get_engine().chain
+
+
+@span("format")
+def format_answer(answer, source_documents):
     # --- MODIFICATION START: Format the response into a single Markdown string ---
 
     unique_sources = set()
     for doc in source_documents:
         # We only need the URL from the source metadata for the links
         source_url = doc.metadata.get('source')
+        if source_url and "://" not in source_url:
+            # Older ingest runs cited DB_files/x.pdf; count it once with DB_files\x.pdf
+            source_url = source_url.replace("/", "\\")
         if source_url and source_url not in unique_sources and not source_url.endswith(".txt"):
             unique_sources.add(source_url)
     
@@ -156,4 +577,202 @@ def get_answer(query):
         # We still return a "Sources" key for potential future use, but it's not displayed
         "Sources": sources 
     }
-    # --- MODIFICATION END ---
\ No newline at end of file
+    # --- MODIFICATION END ---
+
+
+@span("cache")
+def cache_lookup(query, vector=None):
+    """Return a cached (answer, source_documents) pair for `query` or None."""
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    return answer_cache.lookup(query, vector)
+
+
+def cache_store(query, answer, source_documents, vector=None):
+    if SEMANTIC_CACHE_ENABLED and answer.strip():
+        answer_cache.store(query, (answer, source_documents), vector)
+
+
+@span("embed")
+def embed_batch(queries):
+    """Embed many queries with one model call (bypasses the per-query micro-batcher)."""
+    ensure_loaded()
+    return embedding_service.embed_documents(queries)
+
+
+def get_answer(query, use_cache=True):
+    engine = get_engine()
+    # The safety check runs in the retrieval pool while we look up and retrieve.
+    verdict = _retrieval_pool.submit(contextvars.copy_context().run, engine.guard.check, query) if SAFETY_CHECK else None
+
+    cached = cache_lookup(query) if use_cache else None
+    source_documents = cached[1] if cached is not None else engine.retrieve(query)
+    if verdict is not None and not verdict.result():
+        return dict(UNSAFE_RESPONSE)
+    if cached is not None:
+        return format_answer(*cached)
+
+    answer = engine.generate(query, source_documents)
+    if use_cache:
+        cache_store(query, answer, source_documents)
+    return format_answer(answer, source_documents)
+
+
+async def _cancel(*tasks):
+    for task in tasks:
+        if task is not None and not task.done():
+            task.cancel()
+    await asyncio.gather(*(task for task in tasks if task is not None), return_exceptions=True)
+
+
+async def aget_answer(query, timeout=ANSWER_TIMEOUT, use_cache=True):
+    """Async variant of get_answer.
+
+    The safety check runs concurrently with the cache lookup, retrieval and
+    the LLM call; an unsafe verdict cancels the LLM call. Raises
+    asyncio.TimeoutError when the answer (including the wait for a free slot)
+    takes longer than `timeout` seconds. With `use_cache` false the semantic
+    cache is neither read nor written (e.g. for queries carrying a long
+    conversation history, which the embedding model truncates).
+    """
+
+    async def _run():
+        await wait_until_ready(timeout)
+        async with _answer_slots:
+            engine = get_engine()
+            guard = asyncio.ensure_future(engine.guard.acheck(query)) if SAFETY_CHECK else None
+            generation = None
+            try:
+                cached = await run_in_pool(cache_lookup, query) if use_cache else None
+                if cached is None:
+                    source_documents = await engine.aretrieve(query)
+                    generation = asyncio.ensure_future(engine.agenerate(query, source_documents))
+                if guard is not None and not await guard:
+                    return None
+                if cached is not None:
+                    return cached
+                answer = await generation
+            finally:
+                await _cancel(guard, generation)
+            if use_cache:
+                await run_in_pool(cache_store, query, answer, source_documents)
+            return answer, source_documents
+
+    result = await asyncio.wait_for(_run(), timeout)
+    if result is None:
+        return dict(UNSAFE_RESPONSE)
+    return format_answer(*result)
+
+
+async def astream_answer(query, timeout=ANSWER_TIMEOUT, use_cache=True):
+    """Stream an answer as it is generated.
+
+    Yields ("token", text) for every LLM token and finally ("answer", response)
+    where response is the get_answer dict plus a "Citations" key holding the
+    citation/reference block appended to the streamed text. The safety check
+    runs concurrently with the cache lookup and retrieval and must pass
+    before the first token is sent. `use_cache` as for aget_answer.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+
+    def remaining():
+        left = deadline - loop.time()
+        if left <= 0:
+            raise asyncio.TimeoutError()
+        return left
+
+    await wait_until_ready(remaining())
+    async with _answer_slots:
+        engine = get_engine()
+        guard = asyncio.ensure_future(engine.guard.acheck(query)) if SAFETY_CHECK else None
+        try:
+            cached = await asyncio.wait_for(
+                run_in_pool(cache_lookup, query), remaining()
+            ) if use_cache else None
+            if cached is None:
+                source_documents = await asyncio.wait_for(engine.aretrieve(query), remaining())
+            if guard is not None and not await asyncio.wait_for(guard, remaining()):
+                response = dict(UNSAFE_RESPONSE, Citations="")
+                yield "token", response["Answer"]
+                yield "answer", response
+                return
+        finally:
+            await _cancel(guard)
+
+        if cached is not None:
+            answer, source_documents = cached
+            yield "token", answer
+        else:
+            tokens = []
+            stream = engine.astream(query, source_documents)
+            try:
+                while True:
+                    try:
+                        token = await asyncio.wait_for(stream.__anext__(), remaining())
+                    except StopAsyncIteration:
+                        break
+                    tokens.append(token)
+                    yield "token", token
+            finally:
+                await stream.aclose()
+            answer = "".join(tokens)
+            if use_cache:
+                await run_in_pool(cache_store, query, answer, source_documents)
+
+    response = format_answer(answer, source_documents)
+    response["Citations"] = response["Answer"][len(answer.strip()):]
+    yield "answer", response
+
+
+# --- Conversation memory ---
+CITATIONS_RE = re.compile(r"(\s*<sup>\[\d+\]</sup>)+(\n\n(\[\d+\]: [^\n]*\n?)+)?\s*$")
+
+
+async def acontextualize(session_id, query):
+    """Return `query` rewritten as a standalone question using the session history.
+
+    The first question of a session is returned as is. If the rewrite fails or
+    takes longer than MEMORY_TIMEOUT the original query is used.
+    """
+    await wait_until_ready(ANSWER_TIMEOUT)
+    history = await run_in_pool(session_store.history_text, session_id)
+    if not history:
+        return query
+    try:
+        with span("condense"):
+            standalone = await asyncio.wait_for(
+                condense_question(get_engine().memory_llm, history, query), MEMORY_TIMEOUT
+            )
+    except asyncio.TimeoutError:
+        logging.warning("Timed out condensing follow-up question for session %s", session_id)
+        return query
+    if standalone != query:
+        logging.info("Rewrote follow-up question", extra=fields(session_id=session_id, query=query, question=standalone))
+    return standalone
+
+
+async def aremember(session_id, query, response):
+    """Record a question/answer turn and fold old turns into the summary."""
+    if response["Answer"] == UNSAFE_RESPONSE["Answer"]:
+        return
+    answer = CITATIONS_RE.sub("", response["Answer"])
+    await run_in_pool(session_store.append, session_id, "User", query)
+    await run_in_pool(session_store.append, session_id, "Assistant", answer)
+    if await run_in_pool(session_store.needs_compaction, session_id):
+        # Summaries can wait behind the questions users are waiting on.
+        with llm_priority(PRIORITY_BACKGROUND):
+            await asyncio.wait_for(session_store.compact(session_id, get_engine().memory_llm), MEMORY_TIMEOUT * 3)
+
+
+def remember_in_background(session_id, query, response):
+    """Schedule aremember without holding up the response."""
+    def done(task):
+        _background_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error("Failed to update memory for session %s: %s", session_id, task.exception())
+
+    task = asyncio.ensure_future(aremember(session_id, query, response))
+    _background_tasks.add(task)
+    task.add_done_callback(done)
+    return task
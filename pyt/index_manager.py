@@ -0,0 +1,306 @@
+import gc
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+import numpy as np
+
+from ann_index import apply_search_params, describe
+from bm25 import BM25Index, reciprocal_rank_fusion
+from metrics import span
+
+WATCHED_FILES = ["index.faiss", "index.pkl", "docstore.sqlite", "manifest.json"]
+
+
+def index_fingerprint(path):
+    """(mtime_ns, size) of the index files, used to detect a rebuilt index."""
+    fingerprint = []
+    for name in WATCHED_FILES:
+        file_path = os.path.join(path, name)
+        if os.path.exists(file_path):
+            stat = os.stat(file_path)
+            fingerprint.append((name, stat.st_mtime_ns, stat.st_size))
+    return tuple(fingerprint)
+
+
+def load_faiss(path, embeddings):
+    return FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+
+
+def index_built_utc(path):
+    """Build time recorded by ingest.py, if the index came from it."""
+    try:
+        with open(os.path.join(path, "manifest.json"), "r") as f:
+            return json.load(f).get("updated_utc")
+    except (OSError, ValueError):
+        return None
+
+
+class IndexVersion:
+    def __init__(self, number, path, fingerprint, vectorstore, load_seconds, keyword_index=None):
+        self.number = number
+        self.built_utc = index_built_utc(path)
+        self.path = path
+        self.fingerprint = fingerprint
+        self.vectorstore = vectorstore
+        # BM25 index over the same chunks, built with the vectors so the two never drift.
+        self.keyword_index = keyword_index
+        self.load_seconds = load_seconds
+        self.loaded_utc = datetime.now(timezone.utc).isoformat()
+        self.readers = 0
+        self.retired = False
+
+
+class IndexManager:
+    """Owns the active FAISS index and swaps in rebuilt ones without a restart.
+
+    Readers take the active version with `acquire()`; a swap only changes
+    which version new readers get. A replaced version is released as soon as
+    its last reader is done.
+    """
+
+    def __init__(self, path, embeddings, loader=load_faiss, poll_interval=5.0, search_params=None,
+                 build_keyword_index=False):
+        self.path = path
+        self.build_keyword_index = build_keyword_index
+        self.embeddings = embeddings
+        self.loader = loader
+        self.poll_interval = poll_interval
+        # nprobe / ef_search for IVF and HNSW indexes, kept across reloads.
+        self.search_params = dict(search_params or {})
+        self._current = None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._listeners = []
+        self._watcher = None
+        self._stop = threading.Event()
+        self._versions_loaded = 0
+        self.last_error = None
+
+    @property
+    def current(self):
+        return self._current
+
+    def add_listener(self, callback):
+        """Call `callback(version)` after every swap."""
+        self._listeners.append(callback)
+
+    def _load(self):
+        fingerprint = index_fingerprint(self.path)
+        started = time.perf_counter()
+        vectorstore = self.loader(self.path, self.embeddings)
+        apply_search_params(vectorstore.index, **self.search_params)
+        keyword_index = BM25Index.from_vectorstore(vectorstore) if self.build_keyword_index else None
+        load_seconds = time.perf_counter() - started
+        self._versions_loaded += 1
+        return IndexVersion(self._versions_loaded, self.path, fingerprint, vectorstore, load_seconds, keyword_index)
+
+    def reload(self):
+        """Load the index from disk and make it the active version."""
+        with self._reload_lock:
+            try:
+                version = self._load()
+            except Exception as e:
+                self.last_error = str(e)
+                logging.error("Failed to load index from %s: %s", self.path, e)
+                raise
+            self.last_error = None
+            with self._lock:
+                previous, self._current = self._current, version
+                release = False
+                if previous is not None:
+                    previous.retired = True
+                    release = previous.readers == 0
+            if release:
+                self._release(previous)
+            logging.info(
+                "Index version %s active (%s vectors, loaded in %.2fs)",
+                version.number, version.vectorstore.index.ntotal, version.load_seconds,
+            )
+            for callback in self._listeners:
+                try:
+                    callback(version)
+                except Exception as e:
+                    logging.error("Index swap listener failed: %s", e)
+            return version
+
+    def load(self):
+        return self.reload()
+
+    def set_search_params(self, **params):
+        """Change query-time search parameters of the active and future versions."""
+        self.search_params.update({key: value for key, value in params.items() if value is not None})
+        with self.acquire() as version:
+            apply_search_params(version.vectorstore.index, **self.search_params)
+
+    def _release(self, version):
+        version.vectorstore = None
+        version.keyword_index = None
+        gc.collect()
+        logging.info("Index version %s released", version.number)
+
+    @contextmanager
+    def acquire(self):
+        with self._lock:
+            version = self._current
+            if version is None:
+                raise RuntimeError(f"No index loaded from {self.path}")
+            version.readers += 1
+        try:
+            yield version
+        finally:
+            with self._lock:
+                version.readers -= 1
+                release = version.retired and version.readers == 0
+            if release:
+                self._release(version)
+
+    # --- Watching ---
+    def start_watching(self):
+        if self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch, name="index-watcher", daemon=True)
+            self._watcher.start()
+
+    def stop_watching(self):
+        self._stop.set()
+
+    def _watch(self):
+        pending = None
+        while not self._stop.wait(self.poll_interval):
+            fingerprint = index_fingerprint(self.path)
+            current = self._current
+            if not fingerprint or (current is not None and fingerprint == current.fingerprint):
+                pending = None
+                continue
+            # Only load once the files have stopped changing for a full interval.
+            if fingerprint != pending:
+                pending = fingerprint
+                continue
+            pending = None
+            try:
+                self.reload()
+            except Exception:
+                # Already logged; keep serving the previous version.
+                pass
+
+    def status(self):
+        version = self._current
+        status = {"path": self.path, "watching": self._watcher is not None, "last_error": self.last_error}
+        if version is not None:
+            status.update({
+                "version": version.number,
+                "built_utc": version.built_utc,
+                "loaded_utc": version.loaded_utc,
+                "load_seconds": round(version.load_seconds, 3),
+                "index": describe(version.vectorstore.index) if version.vectorstore is not None else None,
+                "keyword_index": len(version.keyword_index) if version.keyword_index is not None else None,
+                "readers": version.readers,
+            })
+        return status
+
+
+def with_score(doc, score, kind="similarity", **extra):
+    # Copy: the docstore hands out its own Document objects. "score_kind" tells
+    # the context packer whether the score is a similarity or a fused rank.
+    return Document(id=doc.id, page_content=doc.page_content,
+                    metadata={**doc.metadata, "score": score, "score_kind": kind, **extra})
+
+
+def lookup(vectorstore, row):
+    return vectorstore.docstore.search(vectorstore.index_to_docstore_id[row])
+
+
+class ManagedRetriever(BaseRetriever):
+    """Retriever that searches whichever index version is active at call time."""
+
+    manager: Any
+    search_kwargs: Dict[str, Any] = {}
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        with self.manager.acquire() as version:
+            vectorstore = version.vectorstore
+            with span("embed"):
+                embedding = vectorstore.embedding_function.embed_query(query)
+            with span("search"):
+                hits = vectorstore.similarity_search_with_score_by_vector(embedding, **self.search_kwargs)
+        # Higher is better, like the fused scores of HybridRetriever.
+        return [with_score(doc, 1.0 / (1.0 + float(distance))) for doc, distance in hits]
+
+    def search_batch(self, queries, vectors):
+        """Retrieve for many queries with one FAISS search; `vectors` are their embeddings."""
+        k = self.search_kwargs.get("k", 4)
+        with self.manager.acquire() as version:
+            vectorstore = version.vectorstore
+            with span("search"):
+                distances, rows = vectorstore.index.search(np.asarray(vectors, dtype=np.float32), k)
+                return [
+                    [with_score(lookup(vectorstore, int(row)), 1.0 / (1.0 + float(distance)))
+                     for distance, row in zip(query_distances, query_rows) if row >= 0]
+                    for query_distances, query_rows in zip(distances, rows)
+                ]
+
+
+class HybridRetriever(BaseRetriever):
+    """Dense + BM25 retrieval over the active index, fused with reciprocal-rank fusion.
+
+    Both searches run against the same pinned index version, so FAISS rows
+    from either side refer to the same chunks. Every fused chunk also carries
+    its dense similarity ("dense_score", 1 / (1 + distance)) for the context
+    packer's relevance cutoff; chunks only BM25 found get the similarity of
+    the last dense hit, which bounds theirs from above.
+    """
+
+    manager: Any
+    k: int = 4
+    fetch_k: int = 20
+    rrf_k: int = 60
+    keyword_weight: float = 1.0
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        with self.manager.acquire() as version:
+            vectorstore = version.vectorstore
+            with span("embed"):
+                embedding = np.array([vectorstore.embedding_function.embed_query(query)], dtype=np.float32)
+            with span("search"):
+                distances, rows = vectorstore.index.search(embedding, self.fetch_k)
+                return self._fuse(version, query, rows[0], distances[0])
+
+    def _fuse(self, version, query, dense_rows, dense_distances):
+        similarities = {
+            int(row): 1.0 / (1.0 + float(distance)) for row, distance in zip(dense_rows, dense_distances) if row >= 0
+        }
+        floor = min(similarities.values(), default=None)
+        rankings = [[int(row) for row in dense_rows if row >= 0]]
+        weights = [1.0]
+        if version.keyword_index is not None:
+            rankings.append([row for row, _ in version.keyword_index.search(query, self.fetch_k)])
+            weights.append(self.keyword_weight)
+        fused = reciprocal_rank_fusion(rankings, k=self.rrf_k, weights=weights)[:self.k]
+        return [
+            with_score(lookup(version.vectorstore, row), score, "rrf", dense_score=similarities.get(row, floor))
+            for row, score in fused
+        ]
+
+    def search_batch(self, queries, vectors):
+        """Retrieve for many queries with one FAISS search; `vectors` are their embeddings."""
+        with self.manager.acquire() as version:
+            with span("search"):
+                distances, rows = version.vectorstore.index.search(np.asarray(vectors, dtype=np.float32), self.fetch_k)
+                return [
+                    self._fuse(version, query, query_rows, query_distances)
+                    for query, query_rows, query_distances in zip(queries, rows, distances)
+                ]
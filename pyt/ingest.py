@@ -0,0 +1,321 @@
+# python ingest.py --pdf-dir .. --out db
+# Builds (or incrementally updates) the FAISS index that functions.py loads
+# with FAISS.load_local. Each PDF is tracked by its content hash in
+# <out>/manifest.json: unchanged PDFs are skipped, changed or new PDFs are
+# re-chunked and re-embedded, and chunks of deleted PDFs are removed. A change
+# of model, embedding backend, quantization or chunking re-embeds everything.
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from ann_index import INDEX_TYPES, convert_vectorstore
+from shared_index import export_docstore
+
+DEFAULT_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-mpnet-base-v2"
+MANIFEST_NAME = "manifest.json"
+# For approximate index types the exact flat index is kept in <out>/master,
+# since incremental updates need to delete rows, which HNSW cannot do.
+MASTER_DIR = "master"
+# Sources are cited as DB_files\<file>.pdf, like the documents in the shipped index.
+SOURCE_SEPARATOR = "\\"
+
+logger = logging.getLogger("ingest")
+
+
+class PrecomputedEmbeddings(Embeddings):
+    """Placeholder for a vectorstore whose vectors are computed elsewhere."""
+
+    def embed_documents(self, texts):
+        raise NotImplementedError("Embeddings are computed by the ingestion workers")
+
+    def embed_query(self, text):
+        raise NotImplementedError("Embeddings are computed by the ingestion workers")
+
+
+# --- Embedding workers ---
+_worker_embeddings = None
+
+
+def _init_worker(model_name, threads, backend="torch", onnx_dir=None):
+    global _worker_embeddings
+    if backend == "onnx-int8":
+        from onnx_embeddings import OnnxEmbeddings
+        _worker_embeddings = OnnxEmbeddings(onnx_dir, threads=threads)
+        return
+    if threads:
+        try:
+            import torch
+            torch.set_num_threads(threads)
+        except ImportError:
+            pass
+    from langchain_huggingface import HuggingFaceEmbeddings
+    _worker_embeddings = HuggingFaceEmbeddings(model_name=model_name)
+
+
+def _embed_batch(texts):
+    return _worker_embeddings.embed_documents(texts)
+
+
+def embedding_quantization(backend, onnx_dir):
+    """Quantization preset of the onnx-int8 export in `onnx_dir`; None for torch."""
+    if backend != "onnx-int8":
+        return None
+    from onnx_embeddings import CONFIG_NAME
+    with open(os.path.join(onnx_dir, CONFIG_NAME), "r") as f:
+        return json.load(f).get("quantization")
+
+
+# --- Documents ---
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(out_dir):
+    path = os.path.join(out_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def write_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, MANIFEST_NAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def source_name(source_prefix, name):
+    """Citation name of a PDF, in the DB_files\\<file>.pdf form the shipped index uses."""
+    source = f"{source_prefix}/{name}" if source_prefix else name
+    return source.replace("/", SOURCE_SEPARATOR)
+
+
+def iter_chunks(pdf_path, source, digest, splitter):
+    """Stream the chunks of one PDF, page by page."""
+    # Chunk ids depend on the document name too, so identical copies of a PDF
+    # do not collide in the docstore.
+    id_prefix = hashlib.sha256(f"{source}:{digest}".encode()).hexdigest()[:16]
+    chunk_number = 0
+    for page in PyPDFLoader(pdf_path).lazy_load():
+        page.metadata = {"source": source, "page": page.metadata.get("page", 0)}
+        for chunk in splitter.split_documents([page]):
+            if not chunk.page_content.strip():
+                continue
+            chunk.metadata["chunk"] = chunk_number
+            chunk.id = f"{id_prefix}-{chunk_number}"
+            chunk_number += 1
+            yield chunk
+
+
+def iter_batches(chunks, batch_size):
+    batch = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def embed_chunks(chunks, batch_size, workers, model_name, backend="torch", onnx_dir=None):
+    """Embed chunks in batches, across a process pool when workers > 1.
+
+    Yields (chunk, vector) pairs in input order. At most 2 * workers batches
+    are in flight so memory stays bounded while PDFs are streamed.
+    """
+    if workers <= 1:
+        _init_worker(model_name, 0, backend, onnx_dir)
+        for batch in iter_batches(chunks, batch_size):
+            yield from zip(batch, _embed_batch([c.page_content for c in batch]))
+        return
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model_name, threads, backend, onnx_dir)) as pool:
+        pending = deque()
+        for batch in iter_batches(chunks, batch_size):
+            pending.append((batch, pool.submit(_embed_batch, [c.page_content for c in batch])))
+            if len(pending) >= 2 * workers:
+                batch, future = pending.popleft()
+                yield from zip(batch, future.result())
+        while pending:
+            batch, future = pending.popleft()
+            yield from zip(batch, future.result())
+
+
+# --- Index ---
+def save_index(vectorstore, out_dir):
+    # Write under temporary names and rename, so readers never see a partial index.
+    vectorstore.save_local(out_dir, index_name="index.tmp")
+    os.replace(os.path.join(out_dir, "index.tmp.faiss"), os.path.join(out_dir, "index.faiss"))
+    os.replace(os.path.join(out_dir, "index.tmp.pkl"), os.path.join(out_dir, "index.pkl"))
+
+
+def ingest(pdf_dir, out_dir, chunk_size=1000, chunk_overlap=150, batch_size=64,
+           workers=1, model_name=DEFAULT_MODEL_NAME, source_prefix="DB_files", full=False, shared=False,
+           index_type="flat", ann_options=None, backend="torch", onnx_dir=None):
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+    os.makedirs(out_dir, exist_ok=True)
+    quantization = embedding_quantization(backend, onnx_dir)
+    manifest = None if full else load_manifest(out_dir)
+    if manifest is not None and (
+        manifest.get("model") != model_name
+        or manifest.get("backend", "torch") != backend
+        or manifest.get("quantization") != quantization
+        or manifest.get("chunk_size") != chunk_size
+        or manifest.get("chunk_overlap") != chunk_overlap
+        or manifest.get("source_separator") != SOURCE_SEPARATOR
+    ):
+        # Vectors of another backend or quantization do not match this one's queries.
+        logger.info("Embedding model, backend, chunking or source naming changed; rebuilding the index from scratch.")
+        manifest = None
+
+    master_dir = os.path.join(out_dir, MASTER_DIR)
+    load_dir = master_dir if os.path.exists(os.path.join(master_dir, "index.faiss")) else out_dir
+    vectorstore = None
+    if manifest is not None and os.path.exists(os.path.join(load_dir, "index.faiss")):
+        vectorstore = FAISS.load_local(load_dir, PrecomputedEmbeddings(), allow_dangerous_deserialization=True)
+    else:
+        manifest = None
+    known = manifest["documents"] if manifest else {}
+
+    pdf_paths = sorted(glob.glob(os.path.join(pdf_dir, "**", "*.pdf"), recursive=True))
+    current = {}
+    for path in pdf_paths:
+        name = os.path.relpath(path, pdf_dir).replace(os.sep, "/")
+        current[name] = (path, file_sha256(path))
+
+    changed = [name for name, (_, digest) in current.items() if known.get(name, {}).get("sha256") != digest]
+    removed = [name for name in known if name not in current]
+    logger.info(
+        "%d PDFs: %d new or changed, %d removed, %d unchanged.",
+        len(current), len(changed), len(removed), len(current) - len(changed),
+    )
+
+    stale_ids = [chunk_id for name in changed + removed for chunk_id in known.get(name, {}).get("chunk_ids", [])]
+    if vectorstore is not None and stale_ids:
+        vectorstore.delete(stale_ids)
+
+    documents = {name: entry for name, entry in known.items() if name in current and name not in changed}
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+    def changed_chunks():
+        for name in changed:
+            path, digest = current[name]
+            documents[name] = {"sha256": digest, "chunk_ids": []}
+            for chunk in iter_chunks(path, source_name(source_prefix, name), digest, splitter):
+                documents[name]["chunk_ids"].append(chunk.id)
+                yield chunk
+
+    started = time.perf_counter()
+    added = 0
+    for batch in iter_batches(embed_chunks(changed_chunks(), batch_size, workers, model_name, backend, onnx_dir), batch_size):
+        text_embeddings = [(chunk.page_content, vector) for chunk, vector in batch]
+        metadatas = [chunk.metadata for chunk, _ in batch]
+        ids = [chunk.id for chunk, _ in batch]
+        if vectorstore is None:
+            vectorstore = FAISS.from_embeddings(text_embeddings, PrecomputedEmbeddings(), metadatas=metadatas, ids=ids)
+        else:
+            vectorstore.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        added += len(batch)
+    logger.info("Embedded %d chunks in %.1fs.", added, time.perf_counter() - started)
+
+    if vectorstore is None or vectorstore.index.ntotal == 0:
+        logger.error("No chunks to index; leaving the existing index untouched.")
+        return None
+
+    needs_save = (
+        changed or removed or manifest is None
+        or manifest.get("index_type", "flat") != index_type
+        or (shared and not os.path.exists(os.path.join(out_dir, "docstore.sqlite")))
+    )
+    if needs_save:
+        if index_type == "flat":
+            save_index(vectorstore, out_dir)
+            shutil.rmtree(master_dir, ignore_errors=True)
+        else:
+            os.makedirs(master_dir, exist_ok=True)
+            save_index(vectorstore, master_dir)
+            # The served store shares the master's docstore; only its index is replaced.
+            served = convert_vectorstore(FAISS(
+                embedding_function=vectorstore.embedding_function,
+                index=vectorstore.index,
+                docstore=vectorstore.docstore,
+                index_to_docstore_id=vectorstore.index_to_docstore_id,
+            ), index_type, **(ann_options or {}))
+            save_index(served, out_dir)
+        if shared or os.path.exists(os.path.join(out_dir, "docstore.sqlite")):
+            export_docstore(vectorstore, out_dir)
+        write_manifest(out_dir, {
+            "model": model_name,
+            "backend": backend,
+            "quantization": quantization,
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+            "source_separator": SOURCE_SEPARATOR,
+            "index_type": index_type,
+            "updated_utc": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "documents": documents,
+        })
+        logger.info("Wrote %s index with %d chunks to %s.", index_type, vectorstore.index.ntotal, out_dir)
+    else:
+        logger.info("Index is up to date.")
+    return vectorstore
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the FAISS index from the EXEO policy PDFs.")
+    parser.add_argument("--pdf-dir", default="..")
+    parser.add_argument("--out", default="db")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=150)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=1, help="embedding processes")
+    parser.add_argument("--model", default=DEFAULT_MODEL_NAME)
+    parser.add_argument("--backend", choices=["torch", "onnx-int8"], default="torch",
+                        help="onnx-int8 embeds with the export of onnx_embeddings.py")
+    parser.add_argument("--onnx-dir", default="models/mpnet-int8")
+    parser.add_argument("--source-prefix", default="DB_files")
+    parser.add_argument("--full", action="store_true", help="ignore the manifest and rebuild everything")
+    parser.add_argument("--shared", action="store_true", help="also write docstore.sqlite for INDEX_STORAGE=mmap")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=os.environ.get("INDEX_TYPE", "flat"))
+    parser.add_argument("--nlist", type=int, help="IVF lists (default ~4*sqrt(n))")
+    parser.add_argument("--hnsw-m", type=int, default=32, help="HNSW neighbours per node")
+    args = parser.parse_args()
+
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    ingest(
+        args.pdf_dir, args.out,
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        model_name=args.model,
+        source_prefix=args.source_prefix,
+        full=args.full,
+        shared=args.shared,
+        index_type=args.index_type,
+        ann_options={"nlist": args.nlist, "hnsw_m": args.hnsw_m},
+        backend=args.backend,
+        onnx_dir=args.onnx_dir,
+    )
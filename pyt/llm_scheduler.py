@@ -0,0 +1,359 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_groq import ChatGroq
+
+from metrics import stats_collector
+
+# --- Configuration ---
+# Client-side limits per model, below the Groq account limits so bursts queue
+# here instead of failing upstream. 0 disables a limit. LLM_RATE_LIMITS
+# overrides them per model: '{"openai/gpt-oss-120b": {"rpm": 30, "tpm": 8000}}'.
+LLM_RPM = float(os.environ.get("LLM_RPM", "0"))
+LLM_TPM = float(os.environ.get("LLM_TPM", "0"))
+LLM_RATE_LIMITS = json.loads(os.environ.get("LLM_RATE_LIMITS", "{}"))
+LLM_QUEUE_SIZE = int(os.environ.get("LLM_QUEUE_SIZE", "256"))  # waiting calls per model before failing fast
+LLM_RETRIES = int(os.environ.get("LLM_RETRIES", "3"))
+LLM_BACKOFF = float(os.environ.get("LLM_BACKOFF", "1.0"))  # seconds, doubled per attempt
+LLM_COMPLETION_TOKENS = int(os.environ.get("LLM_COMPLETION_TOKENS", "512"))  # assumed until usage is known
+BUSY_DETAIL = "The assistant is busy right now, please try again shortly."
+
+# Lower values are served first.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1  # memory compaction
+PRIORITY_BATCH = 2  # batch_answer.py
+
+_priority = contextvars.ContextVar("llm_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def llm_priority(priority):
+    """Queue the LLM calls made inside the block with `priority`."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class LLMQueueFull(Exception):
+    """Raised instead of queueing when a model already has queue_size calls waiting."""
+
+    status_code = 429
+
+    def __init__(self, model, retry_after):
+        super().__init__(f"Too many requests waiting for {model}")
+        self.retry_after = retry_after
+
+
+# --- Errors ---
+def is_rate_limit(error):
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+
+def is_retryable(error):
+    status = getattr(error, "status_code", None)
+    return is_rate_limit(error) or (status is not None and status >= 500) or type(error).__name__ == "APIConnectionError"
+
+
+def retry_after(error):
+    """Seconds the caller should wait before retrying, from the error or its Retry-After header."""
+    seconds = getattr(error, "retry_after", None)
+    if seconds is not None:
+        return seconds
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers["retry-after"])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+def retry_after_header(error):
+    """Retry-After value (whole seconds) for a 429 answered because of `error`."""
+    return str(max(1, math.ceil(retry_after(error) or 1)))
+
+
+# --- Scheduling ---
+class TokenBucket:
+    """Allows `per_minute` units per minute, refilled continuously, with bursts up to a minute's worth."""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount, now):
+        """Seconds until `amount` units are available (0 if they are now)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        # May go negative when usage turns out higher than estimated.
+        self.level -= amount
+
+
+class LLMScheduler:
+    """Admission control for the calls to one model.
+
+    Calls wait in a priority queue until the request and token buckets allow
+    them, and fail fast with LLMQueueFull when `queue_size` calls are already
+    waiting. Identical concurrent calls share one upstream call. Rate-limited
+    and transient failures are retried with jittered exponential backoff; a
+    429 also pauses the whole queue for its Retry-After.
+    """
+
+    def __init__(self, model, rpm=0, tpm=0, queue_size=LLM_QUEUE_SIZE, retries=LLM_RETRIES, backoff=LLM_BACKOFF):
+        self.model = model
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.queue_size = queue_size
+        self.retries = retries
+        self.backoff = backoff
+        self._waiting = []  # heap of [priority, seq, event]
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self._inflight = {}  # coalescing key -> [task, waiters]
+        self.calls = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.retried = 0
+        self.rate_limited = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        # retry_delay also runs in the worker threads of synchronous calls.
+        self._retry_lock = threading.Lock()
+
+    def _delay(self, tokens):
+        now = time.monotonic()
+        delay = max(0.0, self._paused_until - now)
+        if self.requests is not None:
+            delay = max(delay, self.requests.delay(1, now))
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.delay(tokens, now))
+        return delay
+
+    async def acquire(self, tokens):
+        """Wait for this call's turn and its share of the rate limits."""
+        if len(self._waiting) >= self.queue_size:
+            self.rejected += 1
+            raise LLMQueueFull(self.model, max(1.0, self._delay(tokens)))
+        started = time.perf_counter()
+        entry = [_priority.get(), next(self._seq), asyncio.Event()]
+        heapq.heappush(self._waiting, entry)
+        try:
+            while True:
+                delay = self._delay(tokens) if self._waiting[0] is entry else None
+                if delay == 0.0:
+                    break
+                entry[2].clear()
+                try:
+                    await asyncio.wait_for(entry[2].wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+            if self.requests is not None:
+                self.requests.take(1)
+            if self.tokens is not None:
+                self.tokens.take(tokens)
+        finally:
+            self._waiting.remove(entry)
+            heapq.heapify(self._waiting)
+            if self._waiting:
+                self._waiting[0][2].set()
+        waited = time.perf_counter() - started
+        self.calls += 1
+        self.queue_wait_total += waited
+        self.queue_wait_max = max(self.queue_wait_max, waited)
+
+    def record_usage(self, estimated, used):
+        """Charge the token bucket with the difference between the estimate and the reported usage."""
+        if self.tokens is not None and used:
+            self.tokens.take(used - estimated)
+
+    def retry_delay(self, error, attempt):
+        """Seconds to wait before retrying after `error`, or None if it should be raised."""
+        if attempt >= self.retries or not is_retryable(error):
+            return None
+        delay = self.backoff * 2 ** attempt * random.uniform(1.0, 1.5)
+        rate_limited = is_rate_limit(error)
+        if rate_limited:
+            delay = max(delay, retry_after(error) or 0.0)
+        with self._retry_lock:
+            self.retried += 1
+            if rate_limited:
+                self.rate_limited += 1
+                # Everyone else would hit the same limit; hold the queue too.
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        logging.warning("LLM call to %s failed (%s), retrying in %.1f s (attempt %d/%d)",
+                        self.model, error, delay, attempt + 1, self.retries)
+        return delay
+
+    async def run(self, make_call, tokens, key=None):
+        """Await make_call() once admitted, retrying transient failures.
+
+        Calls with the same `key` made while one is in flight wait for its
+        result instead of calling upstream again.
+        """
+        if key is None:
+            return await self._run(make_call, tokens)
+        entry = self._inflight.get(key)
+        if entry is None:
+            task = asyncio.ensure_future(self._run(make_call, tokens))
+            entry = self._inflight[key] = [task, 0]
+            task.add_done_callback(lambda _: self._inflight.pop(key, None) if self._inflight.get(key) is entry else None)
+        else:
+            self.coalesced += 1
+        entry[1] += 1
+        try:
+            return await asyncio.shield(entry[0])
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not entry[0].done():
+                # Every caller went away (timeouts, disconnects).
+                entry[0].cancel()
+
+    async def _run(self, make_call, tokens):
+        attempt = 0
+        while True:
+            await self.acquire(tokens)
+            try:
+                return await make_call()
+            except Exception as e:
+                delay = self.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    def stats(self):
+        return {
+            "queued": len(self._waiting),
+            "in_flight_shared": len(self._inflight),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "retried": self.retried,
+            "rate_limited": self.rate_limited,
+            "avg_queue_wait_ms": 1000 * self.queue_wait_total / self.calls if self.calls else 0.0,
+            "max_queue_wait_ms": 1000 * self.queue_wait_max,
+        }
+
+
+_schedulers = {}
+
+
+def get_scheduler(model):
+    """The process-wide LLMScheduler of `model`, configured from LLM_RPM/LLM_TPM/LLM_RATE_LIMITS."""
+    scheduler = _schedulers.get(model)
+    if scheduler is None:
+        limits = LLM_RATE_LIMITS.get(model, {})
+        scheduler = _schedulers.setdefault(
+            model, LLMScheduler(model, rpm=limits.get("rpm", LLM_RPM), tpm=limits.get("tpm", LLM_TPM))
+        )
+        stats_collector.add("llm_" + re.sub(r"\W", "_", model), scheduler.stats)
+    return scheduler
+
+
+# --- Chat model ---
+def estimate_tokens(messages, max_tokens=None):
+    return sum(len(str(message.content)) for message in messages) // 4 + (max_tokens or LLM_COMPLETION_TOKENS)
+
+
+def without_usage(result):
+    """Copy of a ChatResult without token usage, for callers that shared another caller's call."""
+    generations = [
+        ChatGeneration(message=generation.message.model_copy(update={"usage_metadata": None}),
+                       generation_info=generation.generation_info)
+        for generation in result.generations
+    ]
+    return ChatResult(generations=generations, llm_output=dict(result.llm_output or {}, token_usage={}))
+
+
+class ScheduledChatGroq(ChatGroq):
+    """ChatGroq whose async calls go through the model's LLMScheduler.
+
+    ainvoke calls are coalesced on their exact messages; only the caller
+    whose call went upstream reports its token usage. Streams are queued and
+    rate limited but never shared, and are only retried until the first chunk
+    arrives. Synchronous calls are not queued but are retried the same way.
+    """
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        scheduler = get_scheduler(self.model_name)
+        attempt = 0
+        while True:
+            try:
+                return ChatGroq._generate(self, messages, stop, run_manager, **kwargs)
+            except Exception as e:
+                delay = scheduler.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        scheduler = get_scheduler(self.model_name)
+        estimated = estimate_tokens(messages, self.max_tokens)
+        key = (tuple((message.type, str(message.content)) for message in messages), tuple(stop or ()), repr(kwargs))
+        owner = False
+
+        async def call():
+            nonlocal owner
+            owner = True
+            return await ChatGroq._agenerate(self, messages, stop, run_manager, **kwargs)
+
+        result = await scheduler.run(call, estimated, key=key)
+        if not owner:
+            # The caller that made the call reports (and is charged for) its usage.
+            return without_usage(result)
+        scheduler.record_usage(estimated, ((result.llm_output or {}).get("token_usage") or {}).get("total_tokens"))
+        return result
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        scheduler = get_scheduler(self.model_name)
+        estimated = estimate_tokens(messages, self.max_tokens)
+        attempt = 0
+        while True:
+            await scheduler.acquire(estimated)
+            stream = ChatGroq._astream(self, messages, stop, run_manager, **kwargs)
+            try:
+                first = await stream.__anext__()
+                break
+            except StopAsyncIteration:
+                return
+            except Exception as e:
+                await stream.aclose()
+                delay = scheduler.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+        try:
+            chunk = first
+            while True:
+                usage = getattr(chunk.message, "usage_metadata", None)
+                if usage:
+                    scheduler.record_usage(estimated, usage.get("total_tokens"))
+                yield chunk
+                chunk = await stream.__anext__()
+        except StopAsyncIteration:
+            pass
+        finally:
+            await stream.aclose()
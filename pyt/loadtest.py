@@ -0,0 +1,345 @@
+# python loadtest.py --launch appfast --workers 2 --mode stream --concurrency 32 --duration 60
+# python loadtest.py --url http://127.0.0.1:5001 --mode parlant --concurrency 16 --requests 500
+# python loadtest.py --launch appfast --compare bench_results/<previous>.json
+# python loadtest.py --launch appfast --workers 4 --retrieval sidecar
+# Drives appfast or the parlant events API with concurrent simulated users
+# asking a mix of questions about the EXEO policy PDFs (first questions and
+# follow-ups, in sessions). Reports RPS, p50/p95/p99 latency, time to first
+# token for the streaming endpoints and the memory of every server process.
+# With --launch the app is started with uvicorn against stub_llm.py, so no
+# Groq quota is used. Results are saved to bench_results/ with the git commit
+# so runs can be compared with --compare. The environment is passed on to the
+# launched app, e.g. SEMANTIC_CACHE_ENABLED=0 to measure uncached answers.
+# --retrieval sidecar also starts retrieval_sidecar.py and points the workers
+# at it (RETRIEVAL_SOCKET); its memory is reported with the workers'.
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+import httpx
+import numpy as np
+
+# (weight, conversation): a first question and the follow-ups of the same user.
+CONVERSATIONS = [
+    (5, ["How many days of annual leave do I get?", "Can I carry over the unused days?", "Who approves it?"]),
+    (3, ["How many annual leave days are employees entitled to?"]),
+    (4, ["What is the per diem for business travel?", "And for international trips?"]),
+    (3, ["Which public holidays are observed this year?", "Is Labour Day included?"]),
+    (3, ["Is sick leave paid?", "How long can it last?"]),
+    (2, ["What does the code of business conduct say about gifts?", "What about gifts from suppliers?"]),
+    (2, ["Who approves training and certification requests?"]),
+    (2, ["What is the maximum number of working hours per week?", "How is overtime compensated?"]),
+    (2, ["What benefits are included in the compensation package?", "Is medical insurance covered for family members?"]),
+    (1, ["Is maternity leave paid?", "And paternity leave?"]),
+    (1, ["Can I claim hotel expenses above the travel allowance?"]),
+    (1, ["What happens if I violate the fair labor policy?"]),
+]
+
+MODES = {
+    "json": "GET /get_answer",
+    "stream": "GET /get_answer/stream",
+    "parlant": "POST /sessions/{id}/events",
+    "parlant-stream": "POST /sessions/{id}/events?stream=true",
+}
+APPS = {"appfast": "appfast:app", "parlant": "appfast-parlant:app"}
+
+
+def pick_conversation(rng):
+    weights = [weight for weight, _ in CONVERSATIONS]
+    return rng.choices([questions for _, questions in CONVERSATIONS], weights=weights)[0]
+
+
+# --- Requests ---
+async def ask(client, mode, session_id, question):
+    """Return (status, seconds to first token or None)."""
+    started = time.perf_counter()
+    if mode == "json":
+        response = await client.get("/get_answer", params={"query": question, "session_id": session_id})
+        return response.status_code, None
+    if mode == "parlant":
+        response = await client.post(f"/sessions/{session_id}/events", json={"message": question})
+        return response.status_code, None
+
+    if mode == "stream":
+        request = client.build_request("GET", "/get_answer/stream", params={"query": question, "session_id": session_id})
+        first_marker, error_marker = "event: token", "event: error"
+    else:
+        request = client.build_request("POST", f"/sessions/{session_id}/events", params={"stream": "true"}, json={"message": question})
+        first_marker, error_marker = '"kind": "message_chunk"', '"status": "error"'
+    response = await client.send(request, stream=True)
+    first_token = None
+    status = response.status_code
+    try:
+        async for line in response.aiter_lines():
+            if first_token is None and first_marker in line:
+                first_token = time.perf_counter() - started
+            if error_marker in line:
+                status = 599
+    finally:
+        await response.aclose()
+    return status, first_token
+
+
+async def new_session(client, mode):
+    if mode.startswith("parlant"):
+        response = await client.post("/sessions", json={"agent_id": "loadtest"})
+        response.raise_for_status()
+        return response.json()["id"]
+    return uuid.uuid4().hex
+
+
+async def user(client, mode, rng, stop_at, budget, samples, warmup_until):
+    while time.perf_counter() < stop_at and budget["left"] > 0:
+        session_id = await new_session(client, mode)
+        for question in pick_conversation(rng):
+            if time.perf_counter() >= stop_at or budget["left"] <= 0:
+                return
+            budget["left"] -= 1
+            started = time.perf_counter()
+            try:
+                status, first_token = await ask(client, mode, session_id, question)
+            except httpx.HTTPError as e:
+                status, first_token = type(e).__name__, None
+            if started >= warmup_until:
+                samples.append((started, time.perf_counter() - started, first_token, status))
+
+
+# --- Server processes ---
+def child_pids(pid):
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+            children.extend(child_pids(int(entry)))
+    return children
+
+
+def read_memory_kib(pid):
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("Rss", "Pss"):
+                    memory[key] = int(value.split()[0])
+    except OSError:
+        pass
+    return memory
+
+
+async def sample_memory(pids, peaks, interval=1.0):
+    """Record the peak RSS/PSS of `pids` and every worker process they started."""
+    while True:
+        for process in [child for pid in pids for child in [pid] + child_pids(pid)]:
+            memory = read_memory_kib(process)
+            peak = peaks.setdefault(process, {"Rss": 0, "Pss": 0})
+            for key, value in memory.items():
+                peak[key] = max(peak[key], value)
+        await asyncio.sleep(interval)
+
+
+def launch(args):
+    """Start stub_llm.py, the retrieval sidecar if asked for, and the app; return (processes, base url).
+
+    The app is the last process.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, GROQ_API_BASE=f"http://127.0.0.1:{args.stub_port}")
+    env.pop("RETRIEVAL_SOCKET", None)
+    stub = subprocess.Popen(
+        [sys.executable, "stub_llm.py", "--port", str(args.stub_port), "--latency-ms", str(args.stub_latency_ms),
+         "--tokens-per-second", str(args.stub_tokens_per_second), "--answer-tokens", str(args.stub_answer_tokens)],
+        cwd=here, env=env,
+    )
+    helpers = [stub]
+    if args.retrieval == "sidecar":
+        socket_path = f"/tmp/exeo-retrieval-{args.port}.sock"
+        helpers.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "retrieval_sidecar:app", "--uds", socket_path, "--log-level", "warning"],
+            cwd=here, env=env,
+        ))
+        env = dict(env, RETRIEVAL_SOCKET=socket_path)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", APPS[args.launch], "--host", "127.0.0.1", "--port", str(args.port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=here, env=env,
+    )
+    url = f"http://127.0.0.1:{args.port}"
+    deadline = time.time() + args.startup_timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            for process in helpers:
+                process.terminate()
+            raise SystemExit(f"{APPS[args.launch]} exited with code {server.returncode}")
+        try:
+            if httpx.get(url + "/readyz", timeout=1).status_code == 200:
+                return helpers + [server], url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    for process in helpers + [server]:
+        process.terminate()
+    raise SystemExit(f"{APPS[args.launch]} was not ready after {args.startup_timeout} s")
+
+
+# --- Report ---
+def percentiles(values):
+    if not values:
+        return None
+    values = np.array(values) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(values, 50)), 1),
+        "p95_ms": round(float(np.percentile(values, 95)), 1),
+        "p99_ms": round(float(np.percentile(values, 99)), 1),
+        "mean_ms": round(float(values.mean()), 1),
+        "max_ms": round(float(values.max()), 1),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def summarize(samples, elapsed, peaks):
+    ok = [sample for sample in samples if sample[3] == 200]
+    errors = {}
+    for sample in samples:
+        if sample[3] != 200:
+            errors[str(sample[3])] = errors.get(str(sample[3]), 0) + 1
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "seconds": round(elapsed, 1),
+        "rps": round(len(ok) / elapsed, 2) if elapsed > 0 else 0.0,
+        "latency": percentiles([sample[1] for sample in ok]),
+        "ttft": percentiles([sample[2] for sample in ok if sample[2] is not None]),
+        "memory_mib": {str(pid): {key: round(value / 1024, 1) for key, value in peak.items()} for pid, peak in peaks.items()},
+        # Sum of the peaks: an upper bound, as processes peak at different times.
+        "total_pss_mib": round(sum(peak["Pss"] for peak in peaks.values()) / 1024, 1),
+    }
+
+
+def print_report(result, baseline=None):
+    summary = result["summary"]
+    print(f"{result['config']['mode']} @ {result['commit']}: {summary['requests']} requests in {summary['seconds']} s, "
+          f"{summary['rps']} req/s, errors {summary['errors'] or 0}")
+    for name in ("latency", "ttft"):
+        stats = summary[name]
+        if not stats:
+            continue
+        line = "  ".join(f"{key}={value:8.1f}" for key, value in stats.items())
+        if baseline and baseline["summary"].get(name):
+            before = baseline["summary"][name]
+            line += f"   (p50 {stats['p50_ms'] - before['p50_ms']:+.1f} ms, p99 {stats['p99_ms'] - before['p99_ms']:+.1f} ms vs {baseline['commit']})"
+        print(f"  {name:8} {line}")
+    if baseline:
+        print(f"  rps      {summary['rps'] - baseline['summary']['rps']:+.2f} vs {baseline['commit']}")
+    for pid, memory in summary["memory_mib"].items():
+        print(f"  pid {pid:>7}: peak RSS {memory.get('Rss', 0):8.1f} MiB, PSS {memory.get('Pss', 0):8.1f} MiB")
+    if summary["memory_mib"]:
+        line = f"  total peak PSS {summary['total_pss_mib']:8.1f} MiB"
+        if baseline and baseline["summary"].get("total_pss_mib"):
+            line += f"   ({summary['total_pss_mib'] - baseline['summary']['total_pss_mib']:+.1f} MiB vs {baseline['commit']})"
+        print(line)
+
+
+async def run(args, url, server_pids):
+    rng = random.Random(args.seed)
+    samples, peaks = [], {}
+    started = time.perf_counter()
+    stop_at = started + args.warmup + args.duration if args.duration else float("inf")
+    budget = {"left": args.requests or float("inf")}
+    memory = asyncio.ensure_future(sample_memory(server_pids, peaks)) if server_pids else None
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client:
+        await asyncio.gather(*(
+            user(client, args.mode, random.Random(rng.random()), stop_at, budget, samples, started + args.warmup)
+            for _ in range(args.concurrency)
+        ))
+    if memory is not None:
+        memory.cancel()
+    measured = [sample[0] for sample in samples]
+    elapsed = time.perf_counter() - (min(measured) if measured else started)
+    return summarize(samples, elapsed, peaks)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:5001", help="app to test when not using --launch")
+    parser.add_argument("--launch", choices=sorted(APPS), help="start this app (and the stub LLM) for the run")
+    parser.add_argument("--mode", choices=sorted(MODES), default="json")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--retrieval", choices=["in-process", "sidecar"], default="in-process",
+                        help="with --launch: retrieval in every worker or in one retrieval_sidecar.py")
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--server-pid", type=int, help="pid of a running server, to report its memory")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=60, help="seconds; 0 to run until --requests are done")
+    parser.add_argument("--requests", type=int, default=0)
+    parser.add_argument("--warmup", type=float, default=5, help="seconds excluded from the results")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stub-port", type=int, default=8900)
+    parser.add_argument("--stub-latency-ms", type=float, default=300)
+    parser.add_argument("--stub-tokens-per-second", type=float, default=200)
+    parser.add_argument("--stub-answer-tokens", type=int, default=120)
+    parser.add_argument("--startup-timeout", type=float, default=600)
+    parser.add_argument("--out", default="bench_results")
+    parser.add_argument("--compare", help="result file of an earlier run")
+    return parser
+
+
+if __name__ == "__main__":
+    parser = build_parser()
+    args = parser.parse_args()
+    if args.mode.startswith("parlant") != (args.launch == "parlant") and args.launch:
+        parser.error(f"--mode {args.mode} does not match --launch {args.launch}")
+
+    processes, url, server_pids = [], args.url, [args.server_pid] if args.server_pid else []
+    if args.launch:
+        processes, url = launch(args)
+        # The app and the retrieval sidecar; not the stub LLM.
+        server_pids = [process.pid for process in processes[1:]]
+    try:
+        summary = asyncio.run(run(args, url, server_pids))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    config = {key: value for key, value in vars(args).items() if key not in ("out", "compare")}
+    result = {
+        "commit": git_commit(),
+        "created_utc": datetime.now(timezone.utc).isoformat(),
+        "endpoint": MODES[args.mode],
+        "config": config,
+        "summary": summary,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{result['commit']}-{args.launch or 'external'}-{args.mode}{'-sidecar' if args.retrieval == 'sidecar' else ''}.json")
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Saved {path}")
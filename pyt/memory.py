@@ -0,0 +1,376 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from langchain.prompts import PromptTemplate
+
+SUMMARY_TEMPLATE = """Progressively summarize the conversation between an employee and EXEO Assist, adding onto the previous summary and returning a new summary. Keep names, dates, policy names and numbers. Reply with the summary only.
+
+Previous summary:
+{summary}
+
+New lines of conversation:
+{lines}
+
+New summary:"""
+
+CONDENSE_TEMPLATE = """Given the following conversation and a follow-up question, rephrase the follow-up question to be a standalone question in its original language. If it is already standalone, return it unchanged. Reply with the question only.
+
+Conversation:
+{history}
+
+Follow-up question: {question}
+Standalone question:"""
+
+
+class Session:
+    def __init__(self, session_id, metadata=None, summary="", turns=None, last_seen=None):
+        self.id = session_id
+        self.metadata = metadata or {}
+        self.summary = summary
+        self.turns = turns or []  # [(role, text)]
+        self.last_seen = last_seen or time.time()
+        self.lock = threading.Lock()
+        # Row version and turn sequence numbers in SqliteSessionStore.
+        self.version = 0
+        self.seqs = []
+
+
+class SessionStore:
+    """Conversation memory keyed by session ID.
+
+    Sessions are kept in memory with LRU eviction beyond `max_sessions` and
+    dropped after `idle_timeout` seconds without a request. Each session keeps
+    the last `window_turns` turns verbatim; older turns are folded into a
+    rolling summary by `compact()`, so the history sent with a prompt stays
+    bounded however long the chat runs.
+    """
+
+    def __init__(self, max_sessions=10000, idle_timeout=3600.0, window_turns=6, max_turn_chars=1500):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.window_turns = window_turns
+        self.max_turn_chars = max_turn_chars
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    # --- Persistence hooks (no-ops for the in-memory store) ---
+    def _load(self, session_id):
+        return None
+
+    def _save(self, session):
+        pass
+
+    def _save_turn(self, session, role, text):
+        pass
+
+    def _turn_mark(self, session, count):
+        """Storage marker of the first `count` turns, passed back to _save_summary."""
+        return None
+
+    def _save_summary(self, session, mark):
+        pass
+
+    def _save_metadata(self, session, metadata):
+        pass
+
+    def _delete(self, session_id):
+        pass
+
+    async def _call(self, fn, *args):
+        """Run a store call from a coroutine (off the event loop when it blocks on I/O)."""
+        return fn(*args)
+
+    # --- Sessions ---
+    def _evict(self, now):
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if len(self._sessions) > self.max_sessions or now - oldest.last_seen > self.idle_timeout:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+            else:
+                break
+
+    def create(self, session_id, **metadata):
+        session = Session(session_id, metadata)
+        with self._lock:
+            self._sessions[session_id] = session
+            self._evict(session.last_seen)
+        self._save(session)
+        return session
+
+    def get(self, session_id, create=True):
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and now - session.last_seen > self.idle_timeout:
+                del self._sessions[session_id]
+                session = None
+            if session is None:
+                session = self._load(session_id)
+                if session is None and not create:
+                    return None
+                if session is None:
+                    session = Session(session_id)
+                self._sessions[session_id] = session
+            session.last_seen = now
+            self._sessions.move_to_end(session_id)
+            self._evict(now)
+            return session
+
+    def update(self, session_id, **metadata):
+        """Merge `metadata` into an existing session's; None if there is no such session."""
+        session = self.get(session_id, create=False)
+        if session is None:
+            return None
+        with session.lock:
+            session.metadata.update(metadata)
+        self._save_metadata(session, metadata)
+        return session
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+        self._delete(session_id)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    # --- Turns ---
+    def append(self, session_id, role, text):
+        session = self.get(session_id)
+        text = text[:self.max_turn_chars]
+        with session.lock:
+            session.turns.append((role, text))
+        self._save_turn(session, role, text)
+        return session
+
+    def history_text(self, session_id):
+        """Rolling summary plus the recent turns, formatted for a prompt."""
+        session = self.get(session_id)
+        with session.lock:
+            lines = [f"{role}: {text}" for role, text in session.turns[-self.window_turns:]]
+            if session.summary:
+                lines.insert(0, f"Summary of earlier conversation: {session.summary}")
+        return "\n".join(lines)
+
+    def needs_compaction(self, session_id):
+        session = self.get(session_id)
+        return len(session.turns) > self.window_turns
+
+    async def compact(self, session_id, llm):
+        """Fold the turns that fell out of the window into the rolling summary."""
+        session = await self._call(self.get, session_id)
+        with session.lock:
+            overflow = session.turns[:-self.window_turns]
+            summary = session.summary
+            mark = self._turn_mark(session, len(overflow))
+        if not overflow:
+            return
+        lines = "\n".join(f"{role}: {text}" for role, text in overflow)
+        prompt = PromptTemplate.from_template(SUMMARY_TEMPLATE).format(summary=summary or "(none)", lines=lines)
+        try:
+            response = await llm.ainvoke(prompt)
+        except Exception as e:
+            logging.error("Failed to summarize session %s: %s", session_id, e)
+            return
+        with session.lock:
+            session.summary = response.content.strip()[:self.max_turn_chars * 2]
+            # Turns may have been appended meanwhile; drop only what was summarized.
+            session.turns = session.turns[len(overflow):]
+        await self._call(self._save_summary, session, mark)
+
+    def stats(self):
+        return {"sessions": len(self._sessions), "evictions": self.evictions}
+
+
+class SqliteSessionStore(SessionStore):
+    """SessionStore that writes sessions through to SQLite, so they survive restarts
+    and can be shared by workers on one host. The in-memory LRU acts as a cache.
+
+    Every write bumps the session's row version, and get() re-reads a session
+    whose version changed since it was cached, so a worker sees the turns
+    other workers added. Turns are rows of their own: a write appends a turn
+    or updates the summary in a transaction instead of replacing the whole
+    session. Sessions idle for `idle_timeout` are purged at most every
+    `purge_interval` seconds, on write.
+    """
+
+    def __init__(self, path, purge_interval=60.0, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.purge_interval = purge_interval
+        self._last_purge = time.monotonic()
+        self.purged = 0
+        self._local = threading.local()
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        with self._transaction() as connection:
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(sessions)")]
+            if "turns" in columns:
+                # Layout of earlier versions (turns as JSON in the session row);
+                # conversation memory is short-lived, so it is not migrated.
+                connection.execute("DROP TABLE sessions")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, metadata TEXT NOT NULL, "
+                "summary TEXT NOT NULL, last_seen REAL NOT NULL, version INTEGER NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS turns (seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "session_id TEXT NOT NULL, role TEXT NOT NULL, text TEXT NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS turns_by_session ON turns (session_id, seq)")
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def _read(self, connection, session_id):
+        row = connection.execute(
+            "SELECT metadata, summary, last_seen, version FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        turns = connection.execute(
+            "SELECT seq, role, text FROM turns WHERE session_id = ? ORDER BY seq", (session_id,)
+        ).fetchall()
+        session = Session(session_id, json.loads(row[0]), row[1], [(role, text) for _, role, text in turns], row[2])
+        session.version = row[3]
+        session.seqs = [seq for seq, _, _ in turns]
+        return session
+
+    def _refresh(self, session, connection=None):
+        """Replace the cached copy of `session` with what is stored."""
+        stored = self._read(connection or self._connection(), session.id)
+        if stored is None:
+            return
+        with session.lock:
+            session.metadata = stored.metadata
+            session.summary = stored.summary
+            session.turns = stored.turns
+            session.seqs = stored.seqs
+            session.version = stored.version
+
+    def get(self, session_id, create=True):
+        session = super().get(session_id, create)
+        if session is not None:
+            row = self._connection().execute("SELECT version FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None and session.version:
+                # Deleted or purged by another worker.
+                with self._lock:
+                    self._sessions.pop(session_id, None)
+                return super().get(session_id, create)
+            if row is not None and row[0] != session.version:
+                self._refresh(session)
+        return session
+
+    def _load(self, session_id):
+        session = self._read(self._connection(), session_id)
+        if session is None or time.time() - session.last_seen > self.idle_timeout:
+            return None
+        return session
+
+    def _ensure_row(self, connection, session):
+        with session.lock:
+            metadata = json.dumps(session.metadata)
+        connection.execute("INSERT OR IGNORE INTO sessions VALUES (?, ?, '', ?, 0)", (session.id, metadata, time.time()))
+
+    def _touch(self, connection, session):
+        connection.execute("UPDATE sessions SET version = version + 1, last_seen = ? WHERE id = ?", (time.time(), session.id))
+
+    def _save(self, session):
+        with session.lock:
+            values = (session.id, json.dumps(session.metadata), session.summary, session.last_seen)
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM turns WHERE session_id = ?", (session.id,))
+            connection.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, 1)", values)
+            self._refresh(session, connection)
+        self._purge_if_due()
+
+    def _save_turn(self, session, role, text):
+        with self._transaction() as connection:
+            self._ensure_row(connection, session)
+            connection.execute("INSERT INTO turns (session_id, role, text) VALUES (?, ?, ?)", (session.id, role, text))
+            self._touch(connection, session)
+            self._refresh(session, connection)
+        self._purge_if_due()
+
+    async def _call(self, fn, *args):
+        # Transactions wait up to 10 s for the write lock; keep that off the event loop.
+        return await asyncio.to_thread(fn, *args)
+
+    def _turn_mark(self, session, count):
+        # Last summarized turn; compaction deletes it and the turns before it.
+        return session.seqs[count - 1] if 0 < count <= len(session.seqs) else None
+
+    def _save_summary(self, session, mark):
+        with session.lock:
+            summary = session.summary
+        with self._transaction() as connection:
+            self._ensure_row(connection, session)
+            connection.execute("UPDATE sessions SET summary = ? WHERE id = ?", (summary, session.id))
+            if mark is not None:
+                connection.execute("DELETE FROM turns WHERE session_id = ? AND seq <= ?", (session.id, mark))
+            self._touch(connection, session)
+            self._refresh(session, connection)
+
+    def _save_metadata(self, session, metadata):
+        with self._transaction() as connection:
+            self._ensure_row(connection, session)
+            row = connection.execute("SELECT metadata FROM sessions WHERE id = ?", (session.id,)).fetchone()
+            connection.execute("UPDATE sessions SET metadata = ? WHERE id = ?",
+                               (json.dumps({**json.loads(row[0]), **metadata}), session.id))
+            self._touch(connection, session)
+            self._refresh(session, connection)
+
+    def _delete(self, session_id):
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+            connection.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def _purge_if_due(self):
+        if time.monotonic() - self._last_purge >= self.purge_interval:
+            self._last_purge = time.monotonic()
+            self.purge_idle()
+
+    def purge_idle(self):
+        cutoff = time.time() - self.idle_timeout
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM turns WHERE session_id IN (SELECT id FROM sessions WHERE last_seen < ?)", (cutoff,))
+            self.purged += connection.execute("DELETE FROM sessions WHERE last_seen < ?", (cutoff,)).rowcount
+
+    def stats(self):
+        return {**super().stats(), "purged": self.purged}
+
+
+async def condense_question(llm, history, question):
+    """Rewrite a follow-up question into a standalone question for retrieval."""
+    if not history:
+        return question
+    prompt = PromptTemplate.from_template(CONDENSE_TEMPLATE).format(history=history, question=question)
+    try:
+        response = await llm.ainvoke(prompt)
+    except Exception as e:
+        logging.error("Failed to condense follow-up question '%s': %s", question, e)
+        return question
+    return response.content.strip() or question
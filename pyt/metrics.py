@@ -0,0 +1,155 @@
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# --- Metrics ---
+STAGE_SECONDS = Histogram(
+    "exeo_stage_seconds", "Time spent in each stage of answering a query.", ["stage"], buckets=LATENCY_BUCKETS
+)
+REQUEST_SECONDS = Histogram(
+    "exeo_http_request_seconds", "HTTP request duration, including streamed bodies.", ["method", "route"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUESTS = Counter("exeo_http_requests", "HTTP requests by route and status.", ["method", "route", "status"])
+IN_FLIGHT = Gauge("exeo_http_requests_in_flight", "HTTP requests being served.", multiprocess_mode="livesum")
+LLM_TOKENS = Counter("exeo_llm_tokens", "Tokens reported by the Groq API.", ["model", "kind"])
+
+_timings = contextvars.ContextVar("exeo_timings", default=None)
+
+
+# --- Spans ---
+@contextmanager
+def trace():
+    """Collect the stage durations (seconds) of the current request into a dict."""
+    timings = {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+@contextmanager
+def span(stage):
+    """Time a stage: observed in exeo_stage_seconds and added to the active trace."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started)
+
+
+def observe(stage, seconds):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    timings = _timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def timings_ms(timings):
+    return {stage: round(seconds * 1000, 1) for stage, seconds in timings.items()}
+
+
+# --- Token usage ---
+class TokenUsageCallback(BaseCallbackHandler):
+    """Counts prompt/completion tokens of every call made by one chat model."""
+
+    run_inline = True
+
+    def __init__(self, model):
+        self.prompt_tokens = LLM_TOKENS.labels(model, "prompt")
+        self.completion_tokens = LLM_TOKENS.labels(model, "completion")
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    self.prompt_tokens.inc(usage.get("input_tokens", 0))
+                    self.completion_tokens.inc(usage.get("output_tokens", 0))
+                    return
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        self.prompt_tokens.inc(usage.get("prompt_tokens", 0))
+        self.completion_tokens.inc(usage.get("completion_tokens", 0))
+
+
+# --- Stats of the caches and services ---
+class StatsCollector:
+    """Exposes the numeric values of registered stats() callables as gauges,
+    e.g. the semantic cache's hit_ratio as exeo_answer_cache_hit_ratio."""
+
+    def __init__(self):
+        self.sources = {}
+
+    def add(self, name, stats):
+        self.sources[name] = stats
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        for name, stats in list(self.sources.items()):
+            try:
+                values = stats() or {}
+            except Exception:
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    yield GaugeMetricFamily(f"exeo_{name}_{key}", f"{key} from {name}.stats()", value=value)
+
+
+stats_collector = StatsCollector()
+REGISTRY.register(stats_collector)
+
+
+def render():
+    """Return (body, content type) for the /metrics endpoint."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        # Several uvicorn workers: aggregate the files they write. The stats
+        # gauges are per process and are not included in this mode.
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+# --- HTTP ---
+class MetricsMiddleware:
+    """ASGI middleware counting requests per route template and status.
+
+    Timing ends when the response body is complete, so streamed answers are
+    measured in full.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            IN_FLIGHT.dec()
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUESTS.labels(scope["method"], route, str(status)).inc()
+            REQUEST_SECONDS.labels(scope["method"], route).observe(time.perf_counter() - started)
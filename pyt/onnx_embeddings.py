@@ -0,0 +1,195 @@
+# python onnx_embeddings.py export --out models/mpnet-int8
+# python onnx_embeddings.py check db --onnx-dir models/mpnet-int8
+# Runs the sentence-transformers mpnet model as an int8-quantized ONNX graph on
+# onnxruntime, for CPU-only hosts. `export` converts and quantizes the model
+# once (needs optimum + transformers); serving only needs onnxruntime and
+# tokenizers. Select it with EMBEDDING_BACKEND=onnx-int8 and
+# EMBEDDING_ONNX_DIR=<export dir> (functions.py) or --backend onnx-int8
+# (ingest.py). Vectors differ slightly from the PyTorch model, so
+# check_compatibility() compares both on chunks already in the index.
+import argparse
+import json
+import logging
+import os
+
+import faiss
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+try:
+    import onnxruntime
+    from tokenizers import Tokenizer
+except ImportError:  # pragma: no cover - depends on the deployment
+    onnxruntime = None
+    Tokenizer = None
+
+DEFAULT_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-mpnet-base-v2"
+CONFIG_NAME = "embedding_config.json"
+MODEL_FILE = "model_quantized.onnx"
+
+
+# --- Export ---
+def export(model_name, out_dir, quantization="avx2"):
+    """Export `model_name` to ONNX and quantize its weights to int8 (dynamic quantization).
+
+    `quantization` names an optimum AutoQuantizationConfig preset: avx2,
+    avx512, avx512_vnni or arm64 -- pick the instruction set of the servers.
+    """
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from sentence_transformers import SentenceTransformer
+    from transformers import AutoTokenizer
+
+    os.makedirs(out_dir, exist_ok=True)
+    model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    tokenizer.save_pretrained(out_dir)
+    quantizer = ORTQuantizer.from_pretrained(model)
+    config = getattr(AutoQuantizationConfig, quantization)(is_static=False, per_channel=False)
+    quantizer.quantize(save_dir=out_dir, quantization_config=config)
+
+    reference = SentenceTransformer(model_name, device="cpu")
+    with open(os.path.join(out_dir, CONFIG_NAME), "w") as f:
+        json.dump({
+            "model": model_name,
+            "file_name": MODEL_FILE,
+            "dimension": reference.get_sentence_embedding_dimension(),
+            "max_length": reference.max_seq_length,
+            "pad_token_id": tokenizer.pad_token_id,
+            "quantization": quantization,
+        }, f, indent=2)
+    logging.info("Exported %s as int8 ONNX (%s) to %s", model_name, quantization, out_dir)
+
+
+# --- Runtime ---
+class OnnxEmbeddings(Embeddings):
+    """Mean-pooled sentence embeddings from an exported ONNX model.
+
+    `threads` sets onnxruntime's intra-op thread count (0 lets it decide).
+    Texts are sorted by length before batching so padding stays small.
+    """
+
+    def __init__(self, model_dir, threads=0, batch_size=32):
+        if onnxruntime is None:
+            raise ImportError("The onnx-int8 embedding backend needs onnxruntime and tokenizers installed")
+        with open(os.path.join(model_dir, CONFIG_NAME), "r") as f:
+            self.config = json.load(f)
+        self.model_name = self.config["model"]
+        self.dimension = self.config["dimension"]
+        self.max_length = self.config["max_length"]
+        self.pad_token_id = self.config["pad_token_id"]
+        self.batch_size = batch_size
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.no_padding()
+        self.tokenizer.enable_truncation(max_length=self.max_length)
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, self.config["file_name"]), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def _embed_batch(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        length = max(len(encoding.ids) for encoding in encodings)
+        input_ids = np.full((len(texts), length), self.pad_token_id, dtype=np.int64)
+        attention_mask = np.zeros((len(texts), length), dtype=np.int64)
+        for i, encoding in enumerate(encodings):
+            input_ids[i, :len(encoding.ids)] = encoding.ids
+            attention_mask[i, :len(encoding.ids)] = 1
+        feed = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feed["token_type_ids"] = np.zeros_like(input_ids)
+        hidden = self.session.run(None, feed)[0]
+        mask = attention_mask[:, :, None].astype(np.float32)
+        return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for start in range(0, len(order), self.batch_size):
+            rows = order[start:start + self.batch_size]
+            vectors[rows] = self._embed_batch([texts[i] for i in rows])
+        return vectors.tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+# --- Compatibility with an existing index ---
+def stored_vectors(vectorstore, rows, index_path=None):
+    """Exact stored vectors for `rows`, or None when the index only keeps compressed codes."""
+    index = faiss.downcast_index(vectorstore.index)
+    master = os.path.join(index_path, "master", "index.faiss") if index_path else None
+    if not isinstance(index, faiss.IndexFlat) and master and os.path.exists(master):
+        # Approximate serving index: ingest.py keeps the exact vectors in <out>/master.
+        index = faiss.read_index(master, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    elif "PQ" in type(index).__name__:
+        return None
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    return np.vstack([index.reconstruct(int(row)) for row in rows])
+
+
+def check_compatibility(embeddings, vectorstore, index_path=None, samples=32, min_cosine=0.98, seed=0):
+    """Re-embed a sample of indexed chunks and compare with the vectors stored for them.
+
+    Raises ValueError if the dimension differs or any chunk's cosine
+    similarity is below `min_cosine`; returns a report otherwise.
+    """
+    rows = sorted(vectorstore.index_to_docstore_id)
+    rng = np.random.default_rng(seed)
+    rows = sorted(rng.choice(rows, size=min(samples, len(rows)), replace=False).tolist()) if rows else []
+    report = {"dimension": vectorstore.index.d, "samples": len(rows)}
+    if not rows:
+        return report
+    texts = [vectorstore.docstore.search(vectorstore.index_to_docstore_id[row]).page_content for row in rows]
+    new = np.array(embeddings.embed_documents(texts), dtype=np.float32)
+    if new.shape[1] != vectorstore.index.d:
+        raise ValueError(f"Embedding dimension {new.shape[1]} does not match the index dimension {vectorstore.index.d}")
+    old = stored_vectors(vectorstore, rows, index_path)
+    if old is None:
+        logging.warning("Index stores compressed vectors only; skipped the embedding similarity check")
+        report["samples"] = 0
+        return report
+    cosine = (new * old).sum(axis=1) / (np.linalg.norm(new, axis=1) * np.linalg.norm(old, axis=1) + 1e-12)
+    report.update({"mean_cosine": round(float(cosine.mean()), 4), "min_cosine": round(float(cosine.min()), 4)})
+    if report["min_cosine"] < min_cosine:
+        raise ValueError(
+            f"Embeddings are not compatible with the index (min cosine {report['min_cosine']} < {min_cosine}); "
+            "rebuild it with ingest.py --full using the same backend, or use the torch backend"
+        )
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="convert and quantize the model")
+    export_parser.add_argument("--model", default=DEFAULT_MODEL_NAME)
+    export_parser.add_argument("--out", default="models/mpnet-int8")
+    export_parser.add_argument("--quantization", default="avx2", choices=["avx2", "avx512", "avx512_vnni", "arm64"])
+    check_parser = commands.add_parser("check", help="compare the exported model with an index")
+    check_parser.add_argument("path", nargs="?", default="db")
+    check_parser.add_argument("--onnx-dir", default="models/mpnet-int8")
+    check_parser.add_argument("--threads", type=int, default=0)
+    check_parser.add_argument("--samples", type=int, default=64)
+    check_parser.add_argument("--min-cosine", type=float, default=0.98)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.command == "export":
+        export(args.model, args.out, args.quantization)
+    else:
+        from index_manager import load_faiss
+        from ingest import PrecomputedEmbeddings
+        vectorstore = load_faiss(args.path, PrecomputedEmbeddings())
+        embeddings = OnnxEmbeddings(args.onnx_dir, threads=args.threads)
+        print(check_compatibility(embeddings, vectorstore, args.path, args.samples, args.min_cosine))
@@ -0,0 +1,145 @@
+# Client side of retrieval_sidecar.py: with RETRIEVAL_SOCKET set, the workers
+# send query embedding and retrieval to the sidecar over its Unix socket
+# instead of loading the embedding model and the index themselves.
+import base64
+import logging
+import threading
+import time
+from typing import Any, List
+
+import httpx
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+from metrics import span
+
+
+def encode_vectors(vectors):
+    return base64.b64encode(np.asarray(vectors, dtype=np.float32).tobytes()).decode("ascii")
+
+
+def decode_vectors(data, dim):
+    return np.frombuffer(base64.b64decode(data), dtype=np.float32).reshape(-1, dim)
+
+
+def document_to_dict(doc):
+    return {"id": doc.id, "page_content": doc.page_content, "metadata": doc.metadata}
+
+
+def document_from_dict(data):
+    return Document(id=data.get("id"), page_content=data["page_content"], metadata=data["metadata"])
+
+
+class RetrievalClient:
+    """HTTP client for the retrieval sidecar listening on the Unix socket `path`.
+
+    Every response names the sidecar's index version; callbacks registered
+    with add_listener(fn) are called when it changes (e.g. to drop cached
+    answers after the sidecar reloaded its index).
+    """
+
+    def __init__(self, path, timeout=10.0, max_connections=32):
+        self.path = path
+        self.http = httpx.Client(
+            transport=httpx.HTTPTransport(uds=path),
+            base_url="http://retrieval",
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        self.index_version = None
+        self._listeners = []
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def _post(self, route, payload):
+        self.requests += 1
+        try:
+            response = self.http.post(route, json=payload)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            self.errors += 1
+            raise RuntimeError(f"Retrieval sidecar at {self.path} failed on {route}: {e}") from e
+        data = response.json()
+        self._check_version(data.get("index_version"))
+        return data
+
+    def _check_version(self, version):
+        with self._lock:
+            previous, self.index_version = self.index_version, version
+        if previous is not None and version != previous:
+            logging.info("Retrieval sidecar switched to index version %s", version)
+            for callback in self._listeners:
+                callback(version)
+
+    def wait_until_ready(self, timeout):
+        """Block until the sidecar answers /readyz; raise RuntimeError after `timeout` seconds."""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                response = self.http.get("/readyz")
+                if response.status_code == 200:
+                    return response.json()
+                if response.json().get("status") == "failed":
+                    raise RuntimeError(f"Retrieval sidecar at {self.path} failed to start: {response.json()}")
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Retrieval sidecar at {self.path} was not ready after {timeout} s")
+            time.sleep(0.5)
+
+    def embed(self, texts):
+        if not texts:
+            # Nothing to send; the sidecar could not tell the dimension either.
+            return np.empty((0, 0), dtype=np.float32)
+        data = self._post("/embed", {"texts": texts})
+        return decode_vectors(data["vectors"], data["dim"])
+
+    def retrieve(self, query):
+        return [document_from_dict(doc) for doc in self._post("/retrieve", {"query": query})["documents"]]
+
+    def search_batch(self, queries, vectors):
+        if not queries:
+            return []
+        vectors = np.asarray(vectors, dtype=np.float32)
+        data = self._post("/search_batch", {"queries": queries, "vectors": encode_vectors(vectors), "dim": vectors.shape[1]})
+        return [[document_from_dict(doc) for doc in docs] for docs in data["results"]]
+
+    def stats(self):
+        return {"requests": self.requests, "errors": self.errors}
+
+
+class RemoteEmbeddings(Embeddings):
+    """Query embeddings computed (and cached) by the sidecar's EmbeddingService."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def embed_query(self, text):
+        return self.client.embed([text])[0].tolist()
+
+    def embed_documents(self, texts):
+        return self.client.embed(list(texts)).tolist()
+
+
+class RemoteRetriever(BaseRetriever):
+    """Retriever that asks the sidecar, which runs the configured (hybrid or dense) retriever."""
+
+    client: Any
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        with span("retrieve_remote"):
+            return self.client.retrieve(query)
+
+    def search_batch(self, queries, vectors):
+        """Retrieve for many queries with one sidecar call; `vectors` are their embeddings."""
+        with span("retrieve_remote"):
+            return self.client.search_batch(queries, vectors)
@@ -0,0 +1,77 @@
+# uvicorn retrieval_sidecar:app --uds /tmp/exeo-retrieval.sock
+# Loads the embedding model and the index once and serves query embedding
+# and retrieval to every uvicorn worker on the host over a Unix socket (see
+# remote_retriever.py), so the workers started with RETRIEVAL_SOCKET stay
+# small. Queries from all workers share one EmbeddingService, so its cache
+# and micro-batches span the whole host. The index admin, health and metrics
+# routes of answer_service.py are served here too.
+import os
+
+# This process does the retrieval itself, even if RETRIEVAL_SOCKET is set
+# for the workers in a shared environment.
+os.environ.pop("RETRIEVAL_SOCKET", None)
+
+from fastapi import HTTPException
+from answer_service import create_app, ops_router
+from functions import ANSWER_TIMEOUT, get_engine, run_in_pool, wait_until_ready
+from remote_retriever import decode_vectors, document_to_dict, encode_vectors
+import asyncio
+import functions
+from pydantic import BaseModel
+from typing import List
+
+app = create_app()
+app.include_router(ops_router)
+
+
+class EmbedRequest(BaseModel):
+    texts: List[str]
+
+class RetrieveRequest(BaseModel):
+    query: str
+
+class SearchBatchRequest(BaseModel):
+    queries: List[str]
+    vectors: str  # float32, base64
+    dim: int
+
+
+def index_version():
+    index_manager = functions.index_manager
+    if index_manager is None:
+        return None
+    status = index_manager.status()
+    return f"{status.get('version')}@{status.get('loaded_utc')}"
+
+async def ready():
+    try:
+        await wait_until_ready(ANSWER_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Retrieval is still starting.")
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@app.post("/embed")
+async def embed(request: EmbedRequest):
+    await ready()
+    service = functions.embedding_service
+    if len(request.texts) == 1:
+        # Cached and micro-batched with the queries of the other workers.
+        vectors = [await run_in_pool(service.embed_query, request.texts[0])]
+    else:
+        vectors = await run_in_pool(service.embed_documents, request.texts)
+    return {"vectors": encode_vectors(vectors), "dim": len(vectors[0]) if vectors else 0, "index_version": index_version()}
+
+@app.post("/retrieve")
+async def retrieve(request: RetrieveRequest):
+    await ready()
+    documents = await run_in_pool(get_engine().retriever.invoke, request.query)
+    return {"documents": [document_to_dict(doc) for doc in documents], "index_version": index_version()}
+
+@app.post("/search_batch")
+async def search_batch(request: SearchBatchRequest):
+    await ready()
+    vectors = decode_vectors(request.vectors, request.dim)
+    results = await run_in_pool(get_engine().retriever.search_batch, request.queries, vectors)
+    return {"results": [[document_to_dict(doc) for doc in docs] for docs in results], "index_version": index_version()}
@@ -0,0 +1,127 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from langchain.prompts import PromptTemplate
+
+from llm_scheduler import is_rate_limit
+from metrics import span
+from semantic_cache import normalize_query
+from structured_log import fields
+
+GUARD_TEMPLATE = """[INST]
+**Your Role:** You are an advanced AI security guardian.
+**Your Task:** Analyze the user's query below. Your response MUST be a single word: either "safe" or "unsafe".
+**User query:**
+'{user_query}'
+[/INST]"""
+
+
+class SafetyGuard:
+    """Llama Guard check with a bounded LRU of verdicts per normalized query.
+
+    Rate limits are raised. Other errors (e.g. a misconfigured guard model)
+    count as unsafe, as in the original is_query_safe, unless `fail_closed`
+    is turned off, which lets the query through with a warning. Only
+    verdicts the model actually returned are cached.
+    """
+
+    def __init__(self, llm, cache_size=4096, fail_closed=True):
+        self.llm = llm
+        self.fail_closed = fail_closed
+        self.prompt = PromptTemplate.from_template(GUARD_TEMPLATE)
+        self.cache_size = cache_size
+        self._verdicts = OrderedDict()
+        self._lock = threading.Lock()
+        self.checks = 0
+        self.cache_hits = 0
+        self.unsafe = 0
+        self.errors = 0
+        self.failed_open = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def _cached(self, key):
+        with self._lock:
+            self.checks += 1
+            verdict = self._verdicts.get(key)
+            if verdict is not None:
+                self._verdicts.move_to_end(key)
+                self.cache_hits += 1
+                if not verdict:
+                    self.unsafe += 1
+            return verdict
+
+    def _record(self, key, query, content, started):
+        elapsed = time.perf_counter() - started
+        safe = "unsafe" not in content.strip().lower()
+        with self._lock:
+            self.latency_total += elapsed
+            self.latency_max = max(self.latency_max, elapsed)
+            if not safe:
+                self.unsafe += 1
+            self._verdicts[key] = safe
+            self._verdicts.move_to_end(key)
+            while len(self._verdicts) > self.cache_size:
+                self._verdicts.popitem(last=False)
+        logging.log(
+            logging.INFO if safe else logging.WARNING, "Llama Guard result",
+            extra=fields(verdict="safe" if safe else "unsafe", latency_ms=round(elapsed * 1000), query=query),
+        )
+        return safe
+
+    def _error(self, query, error):
+        if is_rate_limit(error):
+            # Overload is not a verdict; let the caller answer 429.
+            raise error
+        with self._lock:
+            self.errors += 1
+            if self.fail_closed:
+                self.unsafe += 1
+            else:
+                self.failed_open += 1
+        if self.fail_closed:
+            logging.error("Error during Llama Guard safety check for query '%s', refusing it: %s", query, error)
+            return False
+        logging.warning("Error during Llama Guard safety check for query '%s', letting it through: %s", query, error)
+        return True
+
+    def check(self, query):
+        key = normalize_query(query)
+        verdict = self._cached(key)
+        if verdict is not None:
+            return verdict
+        started = time.perf_counter()
+        try:
+            with span("guard"):
+                response = self.llm.invoke(self.prompt.format(user_query=query))
+        except Exception as e:
+            return self._error(query, e)
+        return self._record(key, query, response.content, started)
+
+    async def acheck(self, query):
+        key = normalize_query(query)
+        verdict = self._cached(key)
+        if verdict is not None:
+            return verdict
+        started = time.perf_counter()
+        try:
+            with span("guard"):
+                response = await self.llm.ainvoke(self.prompt.format(user_query=query))
+        except Exception as e:
+            return self._error(query, e)
+        return self._record(key, query, response.content, started)
+
+    def stats(self):
+        with self._lock:
+            calls = self.checks - self.cache_hits - self.errors
+            return {
+                "checks": self.checks,
+                "cache_hits": self.cache_hits,
+                "unsafe": self.unsafe,
+                "errors": self.errors,
+                "failed_open": self.failed_open,
+                "avg_latency_ms": 1000 * self.latency_total / calls if calls > 0 else 0.0,
+                "max_latency_ms": 1000 * self.latency_max,
+            }
@@ -0,0 +1,113 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+class SemanticCache:
+    """Answer cache keyed on query embeddings.
+
+    A lookup returns the stored value of the most similar cached query when its
+    cosine similarity is at least `threshold`. Entries expire after `ttl`
+    seconds and the least recently used entry is evicted once `max_entries` is
+    reached.
+    """
+
+    def __init__(self, embed_query, threshold=0.95, max_entries=1024, ttl=3600.0):
+        self.embed_query = embed_query
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # normalized query -> (vector, value, created)
+        self._keys = []
+        self._matrix = None
+
+    def _embed(self, query, vector=None):
+        # `vector` is a precomputed embedding of `query` (e.g. from a batch call).
+        vector = np.asarray(self.embed_query(query) if vector is None else vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _purge_expired(self, now):
+        expired = [key for key, (_, _, created) in self._entries.items() if now - created > self.ttl]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+            self.evictions += len(expired)
+
+    def _similarities(self):
+        if self._matrix is None:
+            self._keys = list(self._entries)
+            self._matrix = np.stack([self._entries[key][0] for key in self._keys]) if self._keys else None
+        if self._matrix is None:
+            return None
+        return self._keys, self._matrix
+
+    def lookup(self, query, vector=None):
+        """Return the cached value for `query` or None."""
+        key = normalize_query(query)
+        now = time.monotonic()
+        with self._lock:
+            self._purge_expired(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if not self._entries:
+                self.misses += 1
+                return None
+        vector = self._embed(query, vector)
+        with self._lock:
+            candidates = self._similarities()
+            if candidates is not None:
+                keys, matrix = candidates
+                scores = matrix @ vector
+                best = int(np.argmax(scores))
+                best_key = keys[best]
+                if scores[best] >= self.threshold and best_key in self._entries:
+                    self._entries.move_to_end(best_key)
+                    self.hits += 1
+                    logging.debug("Semantic cache hit (%.3f) for query '%s' -> '%s'", scores[best], query, best_key)
+                    return self._entries[best_key][1]
+            self.misses += 1
+            return None
+
+    def store(self, query, value, vector=None):
+        key = normalize_query(query)
+        vector = self._embed(query, vector)
+        with self._lock:
+            self._entries[key] = (vector, value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._matrix = None
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+        logging.info("Semantic cache invalidated")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
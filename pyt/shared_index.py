@@ -0,0 +1,133 @@
+# python shared_index.py db
+# Shared storage mode for the FAISS index. The vectors in index.faiss are
+# memory-mapped read-only, so every uvicorn worker on the host shares the same
+# page-cache pages, and the docstore lives in docstore.sqlite instead of the
+# index.pkl pickle that every worker would otherwise unpickle into its heap.
+import json
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+from collections.abc import Mapping
+
+import faiss
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+DOCSTORE_NAME = "docstore.sqlite"
+MMAP_FLAGS = faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_READ_ONLY
+
+
+class SqliteReader:
+    """Read-only SQLite connection opened when the index version loads.
+
+    It stays bound to the file it opened: ingest replaces docstore.sqlite by
+    renaming a new file over it, and a connection opened later by path would
+    map this version's FAISS rows to the new file's chunks. The connection is
+    shared by all threads; lookups are short, so a lock serializes them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(f"file:{path}?mode=ro&immutable=1", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    def fetchone(self, sql, parameters=()):
+        with self._lock:
+            return self.connection.execute(sql, parameters).fetchone()
+
+    def fetchall(self, sql, parameters=()):
+        with self._lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+
+class SqliteDocstore(Docstore):
+    def __init__(self, reader):
+        self.reader = reader
+
+    def search(self, search):
+        row = self.reader.fetchone("SELECT page_content, metadata FROM docs WHERE id = ?", (search,))
+        if row is None:
+            return f"ID {search} not found."
+        return Document(id=search, page_content=row[0], metadata=json.loads(row[1]))
+
+
+class SqliteIndexMap(Mapping):
+    """FAISS row -> docstore id, read from the docstore on demand."""
+
+    def __init__(self, reader):
+        self.reader = reader
+        self._length = reader.fetchone("SELECT COUNT(*) FROM docs")[0]
+
+    def __getitem__(self, position):
+        row = self.reader.fetchone("SELECT id FROM docs WHERE position = ?", (int(position),))
+        if row is None:
+            raise KeyError(position)
+        return row[0]
+
+    def __iter__(self):
+        for (position,) in self.reader.fetchall("SELECT position FROM docs ORDER BY position"):
+            yield position
+
+    def __len__(self):
+        return self._length
+
+
+def export_docstore(vectorstore, path):
+    """Write the docstore of `vectorstore` to `path`/docstore.sqlite."""
+    write_docstore(vectorstore.docstore, vectorstore.index_to_docstore_id, path)
+
+
+def write_docstore(docstore, index_to_docstore_id, path):
+    target = os.path.join(path, DOCSTORE_NAME)
+    tmp_target = target + ".tmp"
+    if os.path.exists(tmp_target):
+        os.remove(tmp_target)
+    connection = sqlite3.connect(tmp_target)
+    with connection:
+        connection.execute(
+            "CREATE TABLE docs (position INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, "
+            "page_content TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        connection.executemany(
+            "INSERT INTO docs VALUES (?, ?, ?, ?)",
+            (
+                (position, doc_id, doc.page_content, json.dumps(doc.metadata))
+                for position, doc_id in index_to_docstore_id.items()
+                for doc in [docstore.search(doc_id)]
+            ),
+        )
+    connection.execute("VACUUM")
+    connection.close()
+    os.replace(tmp_target, target)
+
+
+def export_shared_index(path):
+    """Add the shared-mode docstore next to an index written by save_local."""
+    with open(os.path.join(path, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    write_docstore(docstore, index_to_docstore_id, path)
+    return len(index_to_docstore_id)
+
+
+def load_shared(path, embeddings):
+    """Loader for IndexManager: mmap'd vectors plus the SQLite docstore."""
+    docstore_path = os.path.join(path, DOCSTORE_NAME)
+    if not os.path.exists(docstore_path):
+        raise FileNotFoundError(f"{docstore_path} is missing; run `python shared_index.py {path}` first")
+    index = faiss.read_index(os.path.join(path, "index.faiss"), MMAP_FLAGS)
+    reader = SqliteReader(docstore_path)
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=SqliteDocstore(reader),
+        index_to_docstore_id=SqliteIndexMap(reader),
+    )
+
+
+if __name__ == "__main__":
+    for index_path in sys.argv[1:] or ["db"]:
+        count = export_shared_index(index_path)
+        print(f"Wrote {os.path.join(index_path, DOCSTORE_NAME)} ({count} documents)")
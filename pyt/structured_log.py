@@ -0,0 +1,232 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+# --- Configuration ---
+# Every process writes and rotates its own file, named after its pid
+# (app.<pid>.log), so uvicorn workers never rotate each other's file. "-" logs
+# to stdout instead, for a process manager that collects it. Files of exited
+# processes are deleted on startup beyond the LOG_KEEP_STALE most recent ones.
+LOG_FILE = os.environ.get("LOG_FILE", "app.log")
+LOG_KEEP_STALE = int(os.environ.get("LOG_KEEP_STALE", "5"))
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", "5"))
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+LOG_BATCH_SIZE = int(os.environ.get("LOG_BATCH_SIZE", "256"))
+LOG_FLUSH_INTERVAL = float(os.environ.get("LOG_FLUSH_INTERVAL", "0.5"))
+# Strings in structured fields (answers, sources) longer than this are cut;
+# a sampled fraction of records keeps them whole for debugging.
+LOG_MAX_FIELD_CHARS = int(os.environ.get("LOG_MAX_FIELD_CHARS", "512"))
+LOG_FULL_FIELD_SAMPLE_RATE = float(os.environ.get("LOG_FULL_FIELD_SAMPLE_RATE", "0.0"))
+
+
+def fields(**values):
+    """extra= argument attaching structured fields to a log record:
+    logging.info("Generated answer", extra=fields(query=query, answer=answer))"""
+    return {"fields": values}
+
+
+def truncate(value, limit):
+    if isinstance(value, str):
+        return value if len(value) <= limit else f"{value[:limit]}...(+{len(value) - limit} chars)"
+    if isinstance(value, dict):
+        return {key: truncate(item, limit) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [truncate(item, limit) for item in value]
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, message and the record's fields."""
+
+    def __init__(self, max_field_chars=LOG_MAX_FIELD_CHARS, full_sample_rate=LOG_FULL_FIELD_SAMPLE_RATE):
+        super().__init__()
+        self.max_field_chars = max_field_chars
+        self.full_sample_rate = full_sample_rate
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        values = getattr(record, "fields", None)
+        if values:
+            if random.random() >= self.full_sample_rate:
+                values = truncate(values, self.max_field_chars)
+            entry.update(values)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class BatchingFileHandler(logging.Handler):
+    """Logging handler that never touches the disk on the caller's thread.
+
+    emit() only puts the record on a bounded queue (records are dropped and
+    counted when it is full). A daemon thread formats the records and writes
+    them in batches, rotating the file when it exceeds max_bytes like
+    RotatingFileHandler does. `path` "-" writes to stdout, never rotated.
+    """
+
+    def __init__(self, path, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT, queue_size=LOG_QUEUE_SIZE,
+                 batch_size=LOG_BATCH_SIZE, flush_interval=LOG_FLUSH_INTERVAL):
+        super().__init__()
+        self.path = path if path == "-" else os.path.abspath(path)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.written = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stream = sys.stdout if path == "-" else open(self.path, "a", encoding="utf-8")
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def emit(self, record):
+        if record.exc_info and not record.exc_text:
+            # Tracebacks hold frames alive; render them now.
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _rotate(self):
+        self._stream.close()
+        if self.backup_count > 0:
+            for i in range(self.backup_count - 1, 0, -1):
+                source, target = f"{self.path}.{i}", f"{self.path}.{i + 1}"
+                if os.path.exists(source):
+                    os.replace(source, target)
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            open(self.path, "w").close()
+        self._stream = open(self.path, "a", encoding="utf-8")
+
+    def _write(self, records):
+        lines = []
+        for record in records:
+            try:
+                lines.append(self.format(record))
+            except Exception:
+                self.handleError(record)
+        if not lines:
+            return
+        self._stream.write("\n".join(lines) + "\n")
+        self._stream.flush()
+        self.written += len(lines)
+        if self.path != "-" and self.max_bytes > 0 and self._stream.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    record = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if record is None:
+                    stop = True
+                    break
+                batch.append(record)
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception as e:  # pragma: no cover - disk full etc.
+                    self.dropped += len(batch)
+                    print(f"log-writer: failed to write {len(batch)} records: {e}", file=sys.stderr)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+            if self._stream is not sys.stdout:
+                self._stream.close()
+        super().close()
+
+    def stats(self):
+        return {"queued": self._queue.qsize(), "written": self.written, "dropped": self.dropped}
+
+
+def process_log_path(path):
+    """`path` with this process's pid before the extension: app.log -> app.<pid>.log."""
+    base, extension = os.path.splitext(path)
+    return f"{base}.{os.getpid()}{extension}"
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def remove_stale_logs(path, keep=LOG_KEEP_STALE):
+    """Delete the per-process files for `path` (and their rotated backups) of
+    exited processes, except the `keep` most recently written ones."""
+    base, extension = os.path.splitext(os.path.abspath(path))
+    directory = os.path.dirname(base)
+    pattern = re.compile(re.escape(os.path.basename(base)) + r"\.(\d+)" + re.escape(extension) + r"(\.\d+)?$")
+    groups = {}  # pid -> [newest mtime, files]
+    for name in os.listdir(directory):
+        match = pattern.match(name)
+        if not match or int(match.group(1)) == os.getpid() or process_alive(int(match.group(1))):
+            continue
+        file = os.path.join(directory, name)
+        try:
+            modified = os.path.getmtime(file)
+        except OSError:  # removed by another worker starting up
+            continue
+        group = groups.setdefault(int(match.group(1)), [0.0, []])
+        group[0] = max(group[0], modified)
+        group[1].append(file)
+    removed = 0
+    for _, files in sorted(groups.values(), reverse=True)[keep:]:
+        for file in files:
+            try:
+                os.remove(file)
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def configure_logging(path=LOG_FILE, level=LOG_LEVEL):
+    """Send the root logger's records to this process's file for `path` (or
+    stdout for "-") as JSON lines, written in the background."""
+    root = logging.getLogger()
+    if path != "-":
+        remove_stale_logs(path)
+        path = os.path.abspath(process_log_path(path))
+    for existing in root.handlers:
+        if isinstance(existing, BatchingFileHandler) and existing.path == path:
+            return existing
+    handler = BatchingFileHandler(path)
+    handler.setFormatter(JsonFormatter())
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    atexit.register(handler.close)
+    return handler
@@ -0,0 +1,118 @@
+# uvicorn stub_llm:app --port 8900   (or: python stub_llm.py --port 8900 --latency-ms 300 --tokens-per-second 200)
+# A local stand-in for the Groq chat completions API, for load tests that
+# should not spend Groq quota. Point the apps at it with
+# GROQ_API_BASE=http://127.0.0.1:8900 (read by ChatGroq). It answers after
+# STUB_LATENCY_MS and streams STUB_ANSWER_TOKENS tokens at
+# STUB_TOKENS_PER_SECOND. Llama Guard prompts get "safe" and follow-up
+# rewrites get the question back, so every code path of functions.py runs.
+import asyncio
+import json
+import os
+import random
+import re
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+STUB_LATENCY_MS = float(os.environ.get("STUB_LATENCY_MS", "300"))
+STUB_JITTER_MS = float(os.environ.get("STUB_JITTER_MS", "50"))
+STUB_TOKENS_PER_SECOND = float(os.environ.get("STUB_TOKENS_PER_SECOND", "200"))
+STUB_ANSWER_TOKENS = int(os.environ.get("STUB_ANSWER_TOKENS", "120"))
+
+ANSWER_WORDS = (
+    "According to the EXEO policy documents, employees are entitled to the benefits described in the "
+    "relevant policy. Requests must be submitted through the HR portal and approved by the line manager "
+    "before the start date. Unused days are handled as set out in the Employee Leave policy, and travel "
+    "expenses are reimbursed at the per diem rates listed in the Travel Allowance Policy."
+).split()
+FOLLOW_UP_RE = re.compile(r"Follow-up question: (.*)\n", re.MULTILINE)
+
+app = FastAPI()
+
+
+def prompt_text(body):
+    return "\n".join(str(message.get("content", "")) for message in body.get("messages", []))
+
+
+def reply_tokens(prompt):
+    if "security guardian" in prompt:
+        return ["safe"]
+    match = FOLLOW_UP_RE.search(prompt)
+    if match:
+        return [match.group(1)]
+    if "New summary:" in prompt:
+        return ["The employee asked about EXEO HR policies."]
+    return [ANSWER_WORDS[i % len(ANSWER_WORDS)] + " " for i in range(STUB_ANSWER_TOKENS)]
+
+
+def usage(prompt, tokens):
+    prompt_tokens = len(prompt) // 4
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens), "total_tokens": prompt_tokens + len(tokens)}
+
+
+async def first_token_delay():
+    await asyncio.sleep(max(0.0, STUB_LATENCY_MS + random.uniform(-STUB_JITTER_MS, STUB_JITTER_MS)) / 1000)
+
+
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    prompt = prompt_text(body)
+    tokens = reply_tokens(prompt)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    model = body.get("model", "stub")
+
+    if not body.get("stream"):
+        await first_token_delay()
+        await asyncio.sleep(len(tokens) / STUB_TOKENS_PER_SECOND)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+            "usage": usage(prompt, tokens),
+        }
+
+    def chunk(delta, finish_reason=None, **extra):
+        data = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            **extra,
+        }
+        return f"data: {json.dumps(data)}\n\n"
+
+    async def events():
+        await first_token_delay()
+        yield chunk({"role": "assistant", "content": ""})
+        for token in tokens:
+            yield chunk({"content": token})
+            await asyncio.sleep(1 / STUB_TOKENS_PER_SECOND)
+        yield chunk({}, "stop", x_groq={"id": completion_id, "usage": usage(prompt, tokens)})
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import uvicorn
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=STUB_LATENCY_MS)
+    parser.add_argument("--tokens-per-second", type=float, default=STUB_TOKENS_PER_SECOND)
+    parser.add_argument("--answer-tokens", type=int, default=STUB_ANSWER_TOKENS)
+    args = parser.parse_args()
+    STUB_LATENCY_MS = args.latency_ms
+    STUB_TOKENS_PER_SECOND = args.tokens_per_second
+    STUB_ANSWER_TOKENS = args.answer_tokens
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
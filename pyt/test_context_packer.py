@@ -0,0 +1,70 @@
+# python -m pytest test_context_packer.py
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from context_packer import ContextPacker
+from index_manager import HybridRetriever, IndexManager
+
+TEXTS = [
+    "Employees are entitled to twenty one days of annual leave per calendar year.",
+    "Unused annual leave days may be carried over with the approval of the line manager.",
+    "The per diem for business travel covers meals and local transport.",
+    "Public holidays are published by HR at the start of every year.",
+    "Sick leave is paid when a medical certificate is submitted within two days.",
+    "Gifts from suppliers above a nominal value must be declared.",
+]
+
+TOPICS = ["leave", "travel", "holiday", "sick", "gift"]
+
+
+class TopicEmbeddings(Embeddings):
+    """One dimension per topic word, so distances follow the topics a text shares with the query."""
+
+    def embed_query(self, text):
+        return [float(topic in text.lower()) for topic in TOPICS]
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+def hybrid_retriever(tmp_path, k):
+    embeddings = TopicEmbeddings()
+    metadatas = [{"source": f"policy-{i}.pdf", "page": 0} for i in range(len(TEXTS))]
+    FAISS.from_texts(TEXTS, embeddings, metadatas=metadatas).save_local(str(tmp_path))
+    manager = IndexManager(str(tmp_path), embeddings, build_keyword_index=True)
+    manager.load()
+    return HybridRetriever(manager=manager, k=k)
+
+
+def test_fused_chunks_are_cut_on_dense_similarity_not_rrf_score():
+    # Fused RRF scores roughly halve for chunks only one retriever found; the
+    # relative cutoff must look at their dense similarity instead.
+    docs = [
+        Document(page_content=text, metadata={"source": f"p{i}.pdf", "page": 0, "score": score,
+                                               "score_kind": "rrf", "dense_score": dense_score})
+        for i, (text, score, dense_score) in enumerate(zip(TEXTS, [0.033, 0.016, 0.016], [1.0, 0.9, 0.3]))
+    ]
+    packed, _ = ContextPacker(relevance_cutoff=0.5).pack(docs)
+    assert sorted(doc.metadata["source"] for doc in packed) == ["p0.pdf", "p1.pdf"]
+
+
+def test_hybrid_retrieval_drops_irrelevant_chunks(tmp_path):
+    docs = hybrid_retriever(tmp_path, k=4).invoke("How many days of annual leave do I get?")
+    packed, _ = ContextPacker(relevance_cutoff=0.5).pack(docs)
+
+    sources = {doc.metadata["source"] for doc in packed}
+    assert len(docs) == 4
+    assert {"policy-0.pdf", "policy-1.pdf"} <= sources
+    assert len(packed) < len(docs)
+    assert all("leave" in doc.page_content.lower() for doc in packed)
+
+
+def test_relative_cutoff_still_applies_to_similarity_scores():
+    docs = [
+        Document(page_content=f"chunk {i} " + text, metadata={"source": f"p{i}.pdf", "page": 0, "score": score,
+                                                              "score_kind": "similarity"})
+        for i, (text, score) in enumerate(zip(TEXTS, [0.9, 0.8, 0.3]))
+    ]
+    packed, _ = ContextPacker(relevance_cutoff=0.5).pack(docs)
+    assert [doc.metadata["score"] for doc in packed] == [0.9, 0.8]
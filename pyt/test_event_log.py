@@ -0,0 +1,83 @@
+# python -m pytest test_event_log.py
+import asyncio
+import time
+
+import pytest
+
+from event_log import EventLog, OffsetGone, SqliteEventLog, make_event
+
+
+def message(text):
+    return make_event("message", {"message": text}, "c1")
+
+
+def test_offsets_go_on_after_eviction():
+    log = EventLog(max_sessions=1)
+    assert [log.append("s1", message(t))["offset"] for t in "ab"] == [0, 1]
+    log.append("s2", message("x"))  # evicts s1
+
+    assert log.events("s1", 2) == []
+    assert log.append("s1", message("c"))["offset"] == 2
+    assert log.stats()["evictions"] == 2
+
+
+def test_offset_past_the_end_is_gone():
+    log = EventLog()
+    log.append("s1", message("a"))
+    assert log.events("s1", 1) == []
+    with pytest.raises(OffsetGone):
+        log.events("s1", 2)
+
+    # A client still holding an offset after the session was dropped must re-read from 0.
+    log.delete("s1")
+    with pytest.raises(OffsetGone):
+        log.events("s1", 1)
+    assert log.events("s1", 0) == []
+
+
+def test_only_the_last_events_are_kept():
+    log = EventLog(max_events=2)
+    for t in "abc":
+        log.append("s1", message(t))
+    assert [event["offset"] for event in log.events("s1")] == [1, 2]
+
+
+def test_wait_returns_an_event_appended_meanwhile():
+    async def scenario():
+        log = EventLog()
+        waiting = asyncio.ensure_future(log.wait("s1", 0, timeout=5.0))
+        await asyncio.sleep(0.01)
+        await log.aappend("s1", message("a"))
+        return await waiting
+
+    started = time.monotonic()
+    events = asyncio.run(scenario())
+    assert [event["data"]["message"] for event in events] == ["a"]
+    assert time.monotonic() - started < 1.0
+
+
+def test_sqlite_log_is_shared_and_keeps_offsets(tmp_path):
+    path = str(tmp_path / "events.sqlite")
+    first, second = SqliteEventLog(path, max_events=2), SqliteEventLog(path, max_events=2)
+    for t in "abc":
+        first.append("s1", message(t))
+
+    assert [event["offset"] for event in second.events("s1")] == [1, 2]
+    assert second.append("s1", message("d"))["offset"] == 3
+    with pytest.raises(OffsetGone):
+        first.events("s1", 5)
+
+
+def test_sqlite_purge_drops_idle_sessions(tmp_path):
+    log = SqliteEventLog(str(tmp_path / "events.sqlite"), idle_timeout=60.0)
+    log.append("old", message("a"))
+    log.append("new", message("b"))
+    log._connection().execute("UPDATE events SET created = ? WHERE session_id = 'old'", (time.time() - 120,))
+
+    log.purge_idle()
+
+    assert log.stats()["purged"] == 1
+    assert log.events("old") == []
+    with pytest.raises(OffsetGone):
+        log.events("old", 1)
+    assert len(log.events("new")) == 1
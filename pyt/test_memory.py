@@ -0,0 +1,85 @@
+# python -m pytest test_memory.py
+import asyncio
+import itertools
+import time
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+from memory import SqliteSessionStore
+
+
+def summarizer(text="They asked about annual leave."):
+    return GenericFakeChatModel(messages=itertools.cycle([AIMessage(content=text)]))
+
+
+def test_turns_are_visible_to_another_worker(tmp_path):
+    path = str(tmp_path / "sessions.sqlite")
+    first, second = SqliteSessionStore(path), SqliteSessionStore(path)
+
+    first.append("s1", "user", "How many days of annual leave?")
+    assert second.get("s1").turns == [("user", "How many days of annual leave?")]
+
+    # A cached session is re-read once another worker wrote to it.
+    first.append("s1", "assistant", "Twenty one.")
+    assert second.history_text("s1") == "user: How many days of annual leave?\nassistant: Twenty one."
+
+    second.update("s1", language="fr")
+    assert first.get("s1").metadata == {"language": "fr"}
+
+
+def test_turns_survive_a_restart(tmp_path):
+    path = str(tmp_path / "sessions.sqlite")
+    SqliteSessionStore(path).append("s1", "user", "hello")
+    assert SqliteSessionStore(path).get("s1", create=False).turns == [("user", "hello")]
+
+
+def test_compaction_keeps_the_window_and_turns_added_meanwhile(tmp_path):
+    path = str(tmp_path / "sessions.sqlite")
+    store = SqliteSessionStore(path, window_turns=2)
+    for i in range(4):
+        store.append("s1", "user", f"turn {i}")
+    assert store.needs_compaction("s1")
+
+    asyncio.run(store.compact("s1", summarizer()))
+
+    session = SqliteSessionStore(path).get("s1")
+    assert session.summary == "They asked about annual leave."
+    assert session.turns == [("user", "turn 2"), ("user", "turn 3")]
+    assert not store.needs_compaction("s1")
+
+
+def test_failed_summary_keeps_the_turns(tmp_path):
+    class Failing:
+        async def ainvoke(self, prompt):
+            raise RuntimeError("LLM down")
+
+    store = SqliteSessionStore(str(tmp_path / "sessions.sqlite"), window_turns=1)
+    store.append("s1", "user", "a")
+    store.append("s1", "user", "b")
+    asyncio.run(store.compact("s1", Failing()))
+    assert store.get("s1").turns == [("user", "a"), ("user", "b")]
+
+
+def test_delete_by_another_worker(tmp_path):
+    path = str(tmp_path / "sessions.sqlite")
+    first, second = SqliteSessionStore(path), SqliteSessionStore(path)
+    first.append("s1", "user", "hello")
+    assert second.get("s1").turns
+
+    first.delete("s1")
+    assert second.get("s1", create=False) is None
+
+
+def test_purge_drops_idle_sessions(tmp_path):
+    store = SqliteSessionStore(str(tmp_path / "sessions.sqlite"), idle_timeout=60.0)
+    store.append("old", "user", "hello")
+    store.append("new", "user", "hello")
+    with store._transaction() as connection:
+        connection.execute("UPDATE sessions SET last_seen = ? WHERE id = 'old'", (time.time() - 120,))
+
+    store.purge_idle()
+
+    assert store.stats()["purged"] == 1
+    assert store._read(store._connection(), "old") is None
+    assert store._read(store._connection(), "new").turns == [("user", "hello")]